@@ -3,36 +3,58 @@ import numpy as np
 import torch
 import cv2
 import base64
-from flask import Flask, request, jsonify, render_template, send_from_directory
+from flask import Flask, request, jsonify, render_template, send_from_directory, Response, stream_with_context
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 import time
 import json
 from PIL import Image
 import io
+from concurrent.futures import ThreadPoolExecutor
 
 # 导入模型和工具
 import config.model_config as cfg
 from model.model import BuildModel
 import utils.gpu as gpu
-from utils.fits_operator import save_bbox_img
+from utils.fits_operator import save_bbox_img, load_fits_image, group_fits_bands, fits_wcs
+from utils.batch_inference import BatchInferenceEngine
+from utils.tiled_inference import TiledFrame, TiledInference, open_frame, to_preview
+from utils.postprocess import filter_detections, split_batch_predictions
+from utils.model_registry import ModelRegistry, file_sha256
+from utils.inference_optimizer import optimize_for_inference
+from utils.onnx_backend import OnnxModel, load_onnx_model
+from utils.quantization import QUANTIZED_SUFFIX, load_quantized_model
+from utils.detect_response import (OverlayStore, negotiate_mode, encode_png, multipart_body,
+                                   MULTIPART_BOUNDARY)
+from utils.job_queue import (JobQueue, TaskRecorder, create_task_dir, read_json,
+                             CANCELLED, COMPLETED, FAILED, FINISHED_STATES)
+from utils.task_store import TaskStore, TASK_DB_FILE, ORDERS
+from utils.detection_catalog import DetectionCatalog, open_writer, pa
+from utils.prediction_cache import PredictionCache
 
 app = Flask(__name__, static_folder='static', template_folder='templates')
 CORS(app)  # 允许跨域请求
 
 # 全局变量
-MODEL = None
+DEFAULT_WEIGHT_PATH = None  # 默认权重文件, 对应的模型与自定义权重一样由 MODEL_REGISTRY 管理
 DEVICE = None
+MODEL_REGISTRY = None  # 按权重内容哈希缓存的已加载模型
 OUTPUT_DIR = 'detection_results'
 UPLOAD_FOLDER = 'uploads'
 SAMPLE_DATA_DIR = 'sample_datasets' # 新增：存放预定义数据集的目录
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(SAMPLE_DATA_DIR, exist_ok=True) # 新增：创建数据集目录
+TASK_STORE = TaskStore(os.path.join(OUTPUT_DIR, TASK_DB_FILE))  # 任务摘要索引, 供 /api/tasks 分页查询
 
 def load_model(weight_path, device):
-    """加载预训练模型"""
+    """加载预训练模型, 按 cfg.INFERENCE['BACKEND'] 返回 torch 模型或 ONNX Runtime 会话"""
     print(f"正在加载模型权重: {weight_path}")
+    if weight_path.endswith('.onnx'):
+        return OnnxModel(weight_path, device)
+    if weight_path.endswith(QUANTIZED_SUFFIX):
+        # utils/quantization.py 生成的 int8 TorchScript 检查点
+        return load_quantized_model(weight_path, device)
     model = BuildModel().to(device)
     # 加载权重
     if weight_path.endswith('.pt'):
@@ -51,16 +73,28 @@ def load_model(weight_path, device):
             raise
     
     model.eval()  # 设置为评估模式
+    if cfg.INFERENCE['BACKEND'] == 'onnxruntime':
+        weight_key = MODEL_REGISTRY.key_for(weight_path) if MODEL_REGISTRY is not None else file_sha256(weight_path)
+        return load_onnx_model(model, weight_key, device)
+    model = optimize_for_inference(model, device)
+    if cfg.INFERENCE['HEAD_CONF_FLOOR'] is not None and isinstance(model, BuildModel):
+        # 稀疏输出只用于 eager/融合后的模型, 冻结的 TorchScript 图保持稠密输出
+        model.set_conf_floor(cfg.INFERENCE['HEAD_CONF_FLOOR'])
     return model
 
 def initialize_model(weight_path=None):
-    """初始化模型"""
-    global MODEL, DEVICE
+    """初始化模型注册表并加载默认模型"""
+    global DEFAULT_WEIGHT_PATH, DEVICE, MODEL_REGISTRY
     
     # 使用GPU如果可用
     device_id = 0  # 使用第一个可用的GPU (通常是0)
     device = gpu.select_device(device_id)
     DEVICE = device
+    if MODEL_REGISTRY is None:
+        MODEL_REGISTRY = ModelRegistry(load_model, device)
+        for preload_path in cfg.INFERENCE['PRELOAD_WEIGHTS']:
+            if os.path.exists(preload_path):
+                MODEL_REGISTRY.prefetch(preload_path)
     
     # 加载模型
     if weight_path is None or not os.path.exists(weight_path):
@@ -78,7 +112,8 @@ def initialize_model(weight_path=None):
     
     try:
         print(f"正在加载权重文件: {weight_path}")
-        MODEL = load_model(weight_path, device)
+        MODEL_REGISTRY.get(weight_path)
+        DEFAULT_WEIGHT_PATH = weight_path
         print("模型初始化完成")
         return True
     except Exception as e:
@@ -87,6 +122,47 @@ def initialize_model(weight_path=None):
         traceback.print_exc()
         return False
 
+def get_model(weight_path=None):
+    """
+    取得本次请求使用的模型. 默认模型每次也从注册表取得, 与自定义权重共享 LRU 与内存预算,
+    被淘汰后按需重新加载
+    :param weight_path: 自定义权重文件, None 时使用默认模型
+    :return: 模型, 加载失败时返回 None
+    """
+    if DEFAULT_WEIGHT_PATH is None and not initialize_model():
+        return None
+    try:
+        return MODEL_REGISTRY.get(weight_path or DEFAULT_WEIGHT_PATH)
+    except Exception as e:
+        print(f"加载自定义权重出错: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return None
+
+def save_weight_file(weight_file):
+    """保存上传的权重文件, 以内容哈希命名, 同一份权重只保留一个文件"""
+    weights_dir = os.path.join(UPLOAD_FOLDER, 'weights')
+    os.makedirs(weights_dir, exist_ok=True)
+    ext = os.path.splitext(secure_filename(weight_file.filename))[1] or '.pt'
+    tmp_path = os.path.join(weights_dir, f".upload_{os.getpid()}_{time.time_ns()}{ext}")
+    weight_file.save(tmp_path)
+    weight_path = os.path.join(weights_dir, f"{file_sha256(tmp_path)}{ext}")
+    if os.path.exists(weight_path):
+        os.remove(tmp_path)
+    else:
+        os.replace(tmp_path, weight_path)
+    print(f"权重文件已保存至: {weight_path}")
+    return weight_path
+
+def image_type_of(filename):
+    """按扩展名确定图像类型"""
+    name = filename.lower()
+    if name.endswith('.npy'):
+        return 'npy'
+    if name.endswith(('.fits', '.fit', '.fz')):
+        return 'fits'
+    return 'jpg'
+
 def preprocess_image(image_data, image_type='npy'):
     """预处理图像数据"""
     img_data = None
@@ -142,6 +218,15 @@ def preprocess_image(image_data, image_type='npy'):
                 raise ValueError("Could not decode image from bytes.")
         else:
             raise ValueError("Unsupported image_data type for JPG/PNG.")
+    elif image_type == 'fits':
+        # memmap 读取, SqrtStretch/MinMaxInterval 拉伸; 多波段按目标波段的 WCS 重投影后堆叠
+        fits_img = load_fits_image(image_data)
+        fits_img = np.clip(fits_img * 255.0, 0, 255).astype(np.uint8)
+        if fits_img.shape[2] == 1:
+            original_img_bgr = cv2.cvtColor(fits_img, cv2.COLOR_GRAY2BGR)
+        else:
+            # 波段按 cfg.FITS['BANDS'] 的顺序依次作为 B/G/R
+            original_img_bgr = np.ascontiguousarray(fits_img[..., :3])
     else:
         raise ValueError(f"Unsupported image_type: {image_type}")
     
@@ -153,112 +238,48 @@ def preprocess_image(image_data, image_type='npy'):
     
     return original_img_bgr, resized_img_rgb_for_model, original_shape
 
-def detect(model, image, conf_thresh=0.3, device='cuda'):
-    """使用模型检测图像中的目标"""
+def preprocess_with_fallback(image_data, image_type='npy'):
+    """批量检测的预处理: 与旧版批量接口一样, npy/jpg 解码失败时切换为另一种类型再试一次"""
+    try:
+        return preprocess_image(image_data, image_type)
+    except Exception as e:
+        if image_type not in ('npy', 'jpg'):
+            raise
+        fallback_type = 'jpg' if image_type == 'npy' else 'npy'
+        print(f"首次处理图像失败: {str(e)}, 尝试切换图像类型为 {fallback_type}")
+        return preprocess_image(image_data, fallback_type)
+
+def predict(model, image, device='cuda'):
+    """
+    模型前向, 返回置信度过滤之前的解码预测 [1, N, 5+num_classes](或 SparsePredictions),
+    可缓存后以不同的置信度阈值反复使用(见 postprocess)
+    """
     # 转换为PyTorch张量
     img = torch.from_numpy(image).permute(2, 0, 1).float().div(255.0).unsqueeze(0)
     img = img.to(device)
     
-    # 进行预测
+    # 进行预测, 直接使用 YOLOHead 已解码的输出 p_d
     with torch.no_grad():
-        outputs, _ = model(img)
-    
-    # 定义锚点盒和步长 (从模型配置中获取)
-    import config.model_config as cfg
-    anchors = cfg.MODEL['ANCHORS']
-    strides = cfg.MODEL['STRIDES']
+        _, p_d = model(img)
+    return split_batch_predictions(p_d, 1, cfg.VAL["TEST_IMG_SIZE"])
+
+def detect(model, image, conf_thresh=0.3, device='cuda'):
+    """使用模型检测图像中的目标"""
+    return postprocess(predict(model, image, device), conf_thresh)
+
+def postprocess(pred, conf_thresh=0.3):
+    """对 predict 的输出做置信度过滤与NMS, 返回输入图坐标下的 [x1, y1, x2, y2, score, class_id] 列表"""
     input_size = cfg.VAL["TEST_IMG_SIZE"]
-    
-    # 处理预测结果
     predictions = []
-    
     try:
-        # 直接使用YOLO模型输出进行解码和坐标转换
-        # 遇到的问题是坐标转换，可能导致边界框不准确
-        for i, output in enumerate(outputs):
-            # 获取参数
-            anchors_scale = anchors[i]
-            stride = strides[i]
-            
-            # 获取输出形状
-            batch_size, grid_h, grid_w, num_anchors, box_attrs = output.shape
-            
-            # 将预测展平用于处理
-            pred = output.reshape(batch_size, -1, box_attrs)[0]  # 取第一个批次
-            
-            # 使用sigmoid对置信度和类别预测进行激活
-            pred_conf = torch.sigmoid(pred[:, 4])
-            pred_cls = torch.sigmoid(pred[:, 5:6])  # 只有一个类别
-            
-            # 获取高置信度预测
-            mask = pred_conf > conf_thresh
-            
-            # 如果没有高置信度预测，继续下一个尺度
-            if not torch.any(mask):
-                continue
-                
-            # 提取高置信度预测
-            pred_boxes = pred[mask][:, :4]  # 所有高置信度的盒子预测值
-            pred_conf_filtered = pred_conf[mask]
-            pred_cls_filtered = pred_cls[mask]
-            
-            # 计算网格索引和锚点索引
-            grid_indices = torch.arange(grid_h * grid_w * num_anchors, device=output.device)
-            grid_indices = grid_indices[mask]
-            
-            # 将索引转换为网格坐标和锚点索引
-            anchor_indices = grid_indices % num_anchors
-            grid_indices = grid_indices // num_anchors
-            grid_x = grid_indices % grid_w
-            grid_y = grid_indices // grid_w
-            
-            # 获取当前尺度的锚点盒
-            anchors_tensor = torch.tensor(anchors_scale, device=output.device)
-            anchors_w = anchors_tensor[anchor_indices, 0]
-            anchors_h = anchors_tensor[anchor_indices, 1]
-            
-            # YOLO坐标解码：将预测值转换为实际坐标
-            # 系数变换，注意这里是根据训练数据进行调整
-            # bx = sigmoid(tx) + cx
-            # by = sigmoid(ty) + cy
-            # bw = pw * exp(tw)
-            # bh = ph * exp(th)
-            x_center = (torch.sigmoid(pred_boxes[:, 0]) + grid_x.float()) * stride
-            y_center = (torch.sigmoid(pred_boxes[:, 1]) + grid_y.float()) * stride
-            w = torch.exp(pred_boxes[:, 2]) * anchors_w * stride
-            h = torch.exp(pred_boxes[:, 3]) * anchors_h * stride
-            
-            # 转换为左上角和右下角坐标
-            x1 = x_center - w / 2
-            y1 = y_center - h / 2
-            x2 = x_center + w / 2
-            y2 = y_center + h / 2
-            
-            # 转换为 numpy 数组用于后续处理
-            boxes_np = torch.stack([x1, y1, x2, y2], dim=1).cpu().numpy()
-            scores_np = pred_conf_filtered.cpu().numpy()
-            labels_np = torch.argmax(pred_cls_filtered, dim=1).cpu().numpy()
-            
-            # 将检测框添加到 predictions 列表中
-            for j in range(len(boxes_np)):
-                x1, y1, x2, y2 = boxes_np[j]
-                # 确保坐标在图像范围内
-                x1 = max(0, min(input_size, x1))
-                y1 = max(0, min(input_size, y1))
-                x2 = max(0, min(input_size, x2))
-                y2 = max(0, min(input_size, y2))
-                
-                # 确保边界框大小合理
-                if x2 - x1 > 0 and y2 - y1 > 0:
-                    score = scores_np[j]
-                    label = labels_np[j]
-                    predictions.append([float(x1), float(y1), float(x2), float(y2), float(score), int(label)])
+        # 置信度过滤、裁剪到输入图范围与NMS均在设备上完成
+        # 使用高IoU阈值的类别无关NMS, 只合并非常相似的框
+        detections = filter_detections(pred, conf_thresh, nms_thresh=0.9,
+                                       class_agnostic=True, clip_size=input_size)[0]
+        predictions = [[float(x1), float(y1), float(x2), float(y2), float(score), int(label)]
+                       for x1, y1, x2, y2, score, label in detections.tolist()]
         
         print(f"YOLO模型检测到 {len(predictions)} 个目标")
-        
-        # 如果模型没有检测到目标，使用辅助检测方法
-        if len(predictions) == 0:
-            print("未找到,请使用更优的权重文件")
     
     except Exception as e:
         print(f"检测失败: {e}")
@@ -270,11 +291,6 @@ def detect(model, image, conf_thresh=0.3, device='cuda'):
         print("未检测到目标")
         return predictions
     
-    # 去除重复框
-    if len(predictions) > 1:
-        # 使用NMS合并重叠框，但使用高IoU阈值，只移除非常相似的框
-        predictions = apply_nms(predictions, iou_thresh=0.9)  # 使用高阈值只合并非常相似的框
-    
     # 输出每个框的信息用于调试
     for i, box in enumerate(predictions):
         print(f"绘制框 {i+1}: ({int(box[0])},{int(box[1])},{int(box[2])},{int(box[3])}) score={box[4]:.2f}")
@@ -283,56 +299,6 @@ def detect(model, image, conf_thresh=0.3, device='cuda'):
     return predictions
 
 
-def apply_nms(boxes, iou_thresh=0.5):
-    """应用非极大值抑制(NMS)算法合并重叠框"""
-    if len(boxes) <= 1:
-        return boxes
-    
-    # 提取置信度和坐标
-    scores = np.array([box[4] for box in boxes])
-    coords = np.array([[box[0], box[1], box[2], box[3]] for box in boxes])
-    classes = np.array([box[5] for box in boxes])
-    
-    # 按置信度降序排序
-    order = scores.argsort()[::-1]
-    keep = []
-    
-    # 工具函数：计算IoU
-    def calc_iou(box1, box2):
-        # 计算交集区域
-        x1 = max(box1[0], box2[0])
-        y1 = max(box1[1], box2[1])
-        x2 = min(box1[2], box2[2])
-        y2 = min(box1[3], box2[3])
-        
-        # 计算交集区域面积
-        inter_area = max(0, x2 - x1) * max(0, y2 - y1)
-        
-        # 计算两个框的面积
-        box1_area = (box1[2] - box1[0]) * (box1[3] - box1[1])
-        box2_area = (box2[2] - box2[0]) * (box2[3] - box2[1])
-        
-        # 计算IoU
-        iou = inter_area / (box1_area + box2_area - inter_area + 1e-8)
-        return iou
-    
-    while len(order) > 0:
-        # 选取当前置信度最高的框
-        i = order[0]
-        keep.append(i)
-        
-        # 计算与其他框的IoU
-        ious = np.array([calc_iou(coords[i], coords[order[j]]) for j in range(1, len(order))])
-        
-        # 保留IoU低于阈值的框
-        keep_indices = np.where(ious < iou_thresh)[0] + 1
-        order = order[keep_indices]
-    
-    # 根据保留的索引重建检测框列表
-    nms_boxes = [boxes[i] for i in keep]
-    return nms_boxes
-
-
 # 移除中心优先函数
 
 def scale_boxes(boxes, original_shape, input_shape):
@@ -427,12 +393,43 @@ def draw_boxes(image, boxes, class_names=None):
     
     return image_with_boxes
 
-def process_single_image(image_data, image_type='jpg', confidence=0.3):
-    """处理单张图像并返回检测结果"""
-    global MODEL, DEVICE
-    
-    if MODEL is None:
-        if not initialize_model():
+def format_boxes(boxes):
+    """将 [x1, y1, x2, y2, score, class_id] 列表转换为接口返回的字典格式"""
+    formatted_boxes = []
+    for i, box_data in enumerate(boxes):
+        x1, y1, x2, y2, conf, class_id_val = box_data
+        formatted_boxes.append({
+            'id': i + 1,
+            'confidence': float(conf),
+            'x1': float(x1),
+            'y1': float(y1),
+            'x2': float(x2),
+            'y2': float(y2),
+            'class_id': int(class_id_val)
+        })
+    return formatted_boxes
+
+def save_result_image(original_img_bgr, boxes, result_path):
+    """绘制检测框并以PNG格式保存结果图像"""
+    class_names = cfg.Customer_DATA["CLASSES"]
+    result_img_with_boxes_bgr = draw_boxes(original_img_bgr, boxes, class_names)
+    _, buffer_result = cv2.imencode('.png', result_img_with_boxes_bgr)
+    with open(result_path, 'wb') as f:
+        f.write(buffer_result.tobytes())
+
+OVERLAY_STORE = OverlayStore(lambda image, boxes: draw_boxes(image, boxes, cfg.Customer_DATA["CLASSES"]))
+PREDICTION_CACHE = PredictionCache()  # 单图检测的原图与阈值过滤前预测, 只调整 confidence 时不再重跑模型
+
+def process_single_image(image_data, image_type='jpg', confidence=0.3, model=None, tiled=False,
+                         response_mode='full'):
+    """
+    处理单张图像并返回检测结果, model 为 None 时使用默认模型;
+    tiled 为 True 时按原分辨率滑窗检测(适用于大幅面巡天图像), 否则缩放到 TEST_IMG_SIZE;
+    response_mode 见 utils.detect_response.RESPONSE_MODES, 只有 full 模式才编码并内嵌两张 base64 PNG
+    """
+    if model is None:
+        model = get_model()
+        if model is None:
              return {
                 'status': 'error',
                 'message': '模型初始化失败',
@@ -444,12 +441,26 @@ def process_single_image(image_data, image_type='jpg', confidence=0.3):
             
     original_img_bgr = None
     original_img_base64 = None
+    cache_key, cached = None, None
 
     try:
         try:
-            original_img_bgr, resized_img_rgb_for_model, original_shape = preprocess_image(image_data, image_type)
-            _, buffer_orig = cv2.imencode('.png', original_img_bgr)
-            original_img_base64 = base64.b64encode(buffer_orig).decode('utf-8')
+            if tiled:
+                tiled_frame = TiledFrame(*open_frame(image_data, image_type), bgr=image_type != 'npy')
+                # 结果图绘制在缩小的预览上, 不在内存中拼出整幅原分辨率图像
+                original_img_bgr, preview_scale = tiled_frame.render_preview()
+            else:
+                weight_key = MODEL_REGISTRY.key_of(model) if MODEL_REGISTRY is not None else None
+                cache_key = PREDICTION_CACHE.key(image_data, image_type, weight_key)
+                cached = PREDICTION_CACHE.get(cache_key)
+                if cached is not None:
+                    original_img_bgr, original_shape = cached['original_img_bgr'], cached['original_shape']
+                else:
+                    original_img_bgr, resized_img_rgb_for_model, original_shape = preprocess_image(image_data, image_type)
+            if response_mode == 'full':
+                original_img_base64 = cached.get('original_image') if cached is not None else None
+                if original_img_base64 is None:
+                    original_img_base64 = base64.b64encode(encode_png(original_img_bgr)).decode('utf-8')
         except Exception as e_preprocess:
             print(f"图像预处理错误: {str(e_preprocess)}")
             import traceback
@@ -463,31 +474,49 @@ def process_single_image(image_data, image_type='jpg', confidence=0.3):
                 'detection_count': 0
             }
 
-        boxes = detect(MODEL, resized_img_rgb_for_model, conf_thresh=confidence, device=DEVICE)
-        
-        input_size = cfg.VAL["TEST_IMG_SIZE"]
-        scaled_boxes = scale_boxes(boxes, original_shape, input_size)
+        if tiled:
+            engine = BatchInferenceEngine(model, DEVICE, preprocess_image)
+            scaled_boxes = TiledInference(engine).detect(tiled_frame, confidence).tolist()
+            overlay_boxes = to_preview(scaled_boxes, preview_scale).tolist()
+        else:
+            if cached is not None:
+                pred = cached['pred']
+            else:
+                pred = predict(model, resized_img_rgb_for_model, device=DEVICE)
+                cached = {'original_img_bgr': original_img_bgr, 'original_shape': original_shape, 'pred': pred}
+                PREDICTION_CACHE.put(cache_key, cached)
+            if original_img_base64 is not None and 'original_image' not in cached:
+                cached['original_image'] = original_img_base64
+                PREDICTION_CACHE.put(cache_key, cached)
+            boxes = postprocess(pred, conf_thresh=confidence)
+            
+            input_size = cfg.VAL["TEST_IMG_SIZE"]
+            scaled_boxes = scale_boxes(boxes, original_shape, input_size)
+            overlay_boxes = scaled_boxes
         
-        class_names = cfg.Customer_DATA["CLASSES"]
-        result_img_with_boxes_bgr = draw_boxes(original_img_bgr.copy(), scaled_boxes, class_names)
+        formatted_boxes = format_boxes(scaled_boxes)
         
-        _, buffer_result = cv2.imencode('.png', result_img_with_boxes_bgr)
-        result_img_base64 = base64.b64encode(buffer_result).decode('utf-8')
+        print(f"返回检测框格式化结果: {formatted_boxes}")
         
-        formatted_boxes = []
-        for i, box_data in enumerate(scaled_boxes):
-            x1, y1, x2, y2, conf, class_id_val = box_data
-            formatted_boxes.append({
-                'id': i + 1,
-                'confidence': float(conf),
-                'x1': float(x1),
-                'y1': float(y1),
-                'x2': float(x2),
-                'y2': float(y2),
-                'class_id': int(class_id_val)
-            })
+        if response_mode != 'full':
+            result = {
+                'status': 'success',
+                'boxes': formatted_boxes,
+                'detection_count': len(scaled_boxes)
+            }
+            if response_mode == 'url':
+                # 结果图在请求 URL 时才绘制
+                token = OVERLAY_STORE.put(original_img_bgr, overlay_boxes)
+                result['result_url'] = f'/api/overlay/{token}/result.png'
+                result['original_url'] = f'/api/overlay/{token}/original.png'
+            elif response_mode in ['multipart', 'image']:
+                class_names = cfg.Customer_DATA["CLASSES"]
+                result['_png'] = encode_png(draw_boxes(original_img_bgr, overlay_boxes, class_names))
+            return result
         
-        print(f"返回检测框格式化结果: {formatted_boxes}")
+        class_names = cfg.Customer_DATA["CLASSES"]
+        result_img_with_boxes_bgr = draw_boxes(original_img_bgr.copy(), overlay_boxes, class_names)
+        result_img_base64 = base64.b64encode(encode_png(result_img_with_boxes_bgr)).decode('utf-8')
         
         return {
             'status': 'success',
@@ -510,6 +539,114 @@ def process_single_image(image_data, image_type='jpg', confidence=0.3):
             'detection_count': 0
         }
 
+def detect_response(result, response_mode='full'):
+    """按协商的响应模式返回 process_single_image 的结果, 出错时一律返回 JSON"""
+    png = result.pop('_png', None)
+    if png is not None and response_mode == 'image':
+        return Response(png, mimetype='image/png', headers={'X-Detection-Count': str(result['detection_count'])})
+    if png is not None and response_mode == 'multipart':
+        return Response(multipart_body(result, png), mimetype=f'multipart/mixed; boundary={MULTIPART_BOUNDARY}')
+    return jsonify(result)
+
+def run_detection_task(task_dir, items, filenames, confidence, recorder, model, tiled=False):
+    """
+    批量检测一个任务的全部文件, 逐文件把结果写入 recorder(增量更新 task_info.json);
+    同步接口与异步作业共用. 收到取消请求时在当前文件之后停止.
+    :param items: list of (image_data, image_type), image_data 可为字节或文件路径
+    :param tiled: True 时对每张图做原分辨率滑窗检测
+    :return: 最终的 task_info
+    """
+    # 批量推理: 并行预处理, 每个微批一次前向, 结果图的绘制与PNG编码在线程池中进行
+    print(f"开始批量处理 {len(items)} 个文件")
+    engine = BatchInferenceEngine(model, DEVICE, preprocess_with_fallback)
+    runner = TiledInference(engine) if tiled else engine
+    # 检测框同时追加到列式检测目录(按日期与任务分区), FITS 输入附带 WCS 换算的 RA/Dec
+    catalog = open_writer(os.path.basename(task_dir), recorder.task_info.get('timestamp'))
+    try:
+        status = _run_detection_items(task_dir, items, filenames, confidence, recorder, runner, catalog)
+    finally:
+        if catalog is not None:
+            catalog.close()
+    return recorder.finish(status)
+
+def _run_detection_items(task_dir, items, filenames, confidence, recorder, runner, catalog):
+    """:return: COMPLETED 或 CANCELLED"""
+    status = COMPLETED
+    with ThreadPoolExecutor(cfg.INFERENCE['NUM_WORKERS']) as render_pool:
+        render_jobs = []
+        for index, result in runner.run(items, conf_thresh=confidence):
+            filename = filenames[index]
+            if result['status'] != 'success':
+                print(f"处理文件 {filename} 时出错: {result['message']}")
+                recorder.add_result({
+                    'filename': filename,
+                    'status': 'error',
+                    'message': result['message']
+                })
+            else:
+                boxes = result['boxes'].tolist()
+                result_filename = f"{os.path.splitext(filename)[0]}_result.png"
+                # 分块推理返回的是缩小的预览图, 绘制前把框换算到预览坐标
+                overlay_boxes = to_preview(boxes, result['preview_scale']).tolist() if 'preview_scale' in result else boxes
+                render_jobs.append(render_pool.submit(
+                    save_result_image, result['original_img_bgr'], overlay_boxes, os.path.join(task_dir, result_filename)))
+                recorder.add_result({
+                    'filename': filename,
+                    'result_filename': result_filename,
+                    'boxes': format_boxes(boxes),
+                    'detection_count': len(boxes)
+                })
+                if catalog is not None and boxes:
+                    image_data, image_type = items[index]
+                    wcs = fits_wcs(image_data) if image_type == 'fits' else None
+                    catalog.add(filename, result['boxes'], result['original_shape'], wcs)
+            if recorder.cancelled():
+                print(f"任务 {os.path.basename(task_dir)} 已被取消")
+                status = CANCELLED
+                break
+        for job in render_jobs:
+            job.result()
+    return status
+
+def run_detection_job(task_dir, job):
+    """作业队列工作进程中执行一个检测作业(job 由 submit_detection_job 写入 job.json)"""
+    # 工作进程各自维护模型缓存, 相同权重的后续作业无需重新加载
+    model = get_model(job.get('weight_path'))
+    if model is None:
+        raise RuntimeError('模型初始化失败')
+    task_info = read_json(os.path.join(task_dir, 'task_info.json'), {})
+    recorder = TaskRecorder(task_dir, task_info, total=len(job['inputs']), store=TASK_STORE)
+    items = [(path, image_type) for path, image_type in job['inputs']]
+    run_detection_task(task_dir, items, job['filenames'], job['confidence'], recorder, model,
+                       tiled=job.get('tiled', False))
+
+# 异步检测作业队列, 工作进程在首次提交作业或服务启动时创建
+JOB_QUEUE = JobQueue(OUTPUT_DIR, run_detection_job, cfg.INFERENCE['JOB_WORKERS'], store=TASK_STORE)
+
+def submit_detection_job(task_id, inputs, filenames, confidence, weight_path=None, tiled=False, **task_fields):
+    """
+    把检测作业放入队列并立即返回 202, 客户端通过 /api/task/<task_id> 轮询
+    或 /api/task/<task_id>/events (SSE) 获取逐文件进度
+    :param inputs: list of (file_path, image_type)
+    """
+    job = {
+        'inputs': inputs,
+        'filenames': filenames,
+        'confidence': confidence,
+        'weight_path': weight_path,
+        'tiled': tiled,
+        'total': len(inputs)
+    }
+    task_info = JOB_QUEUE.submit(task_id, job, task_fields)
+    return jsonify({
+        'status': task_info['status'],
+        'task_id': task_id,
+        'files_count': len(inputs),
+        'status_url': f'/api/task/{task_id}',
+        'events_url': f'/api/task/{task_id}/events',
+        'cancel_url': f'/api/task/{task_id}/cancel'
+    }), 202
+
 @app.route('/')
 def index():
     """首页"""
@@ -543,22 +680,29 @@ def api_detect():
     if 'weight_file' in request.files:
         weight_file = request.files['weight_file']
         if weight_file.filename != '':
-            # 创建临时目录来存储上传的权重文件
-            weights_dir = os.path.join(UPLOAD_FOLDER, 'weights')
-            os.makedirs(weights_dir, exist_ok=True)
-            
             # 保存权重文件
-            weight_filename = secure_filename(weight_file.filename)
-            custom_weight_path = os.path.join(weights_dir, weight_filename)
-            weight_file.save(custom_weight_path)
-            print(f"权重文件已保存至: {custom_weight_path}")
-            
-            # 加载自定义权重模型
-            if not initialize_model(custom_weight_path):
-                return jsonify({
-                    'status': 'error',
-                    'message': '加载自定义权重文件失败'
-                }), 400
+            custom_weight_path = save_weight_file(weight_file)
+    
+    # 大幅面图像可选择原分辨率滑窗检测
+    tiled = str(request.values.get('tiled', 'false')).lower() == 'true'
+    if request.is_json:
+        tiled = bool(request.json.get('tiled', tiled))
+    
+    # 响应格式: 参数 response 或 Accept 头, 默认仍为内嵌 base64 图像的 JSON
+    try:
+        response_mode = negotiate_mode(request)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    
+    # 取得本次请求的模型(自定义权重按内容哈希缓存, 不影响其他请求)
+    model = get_model(custom_weight_path)
+    if model is None:
+        if custom_weight_path:
+            return jsonify({
+                'status': 'error',
+                'message': '加载自定义权重文件失败'
+            }), 400
+        return jsonify({'status': 'error', 'message': '模型初始化失败'}), 500
     
     # 处理application/x-www-form-urlencoded格式的请求（示例图片请求）
     if request.content_type and 'application/x-www-form-urlencoded' in request.content_type:
@@ -591,24 +735,24 @@ def api_detect():
         try:
             if image_type == 'npy':
                 try:
-                    result = process_single_image(actual_path, 'npy', confidence)
+                    result = process_single_image(actual_path, 'npy', confidence, model, tiled, response_mode)
                 except Exception as e:
                     print(f"NPY处理错误: {str(e)}")
                     # 尝试直接加载文件内容
                     with open(actual_path, 'rb') as f:
                         npy_bytes = f.read()
-                    result = process_single_image(npy_bytes, 'npy', confidence)
+                    result = process_single_image(npy_bytes, 'npy', confidence, model, tiled, response_mode)
             else:
                 try:
                     with open(actual_path, 'rb') as f:
                         image_bytes = f.read()
-                    result = process_single_image(image_bytes, 'jpg', confidence)
+                    result = process_single_image(image_bytes, 'jpg', confidence, model, tiled, response_mode)
                 except Exception as e:
                     print(f"读取图片文件错误: {str(e)}")
                     # 尝试直接传递路径
-                    result = process_single_image(actual_path, 'jpg', confidence)
+                    result = process_single_image(actual_path, 'jpg', confidence, model, tiled, response_mode)
             
-            return jsonify(result)
+            return detect_response(result, response_mode)
         except Exception as e:
             import traceback
             traceback.print_exc()
@@ -715,8 +859,8 @@ def api_detect():
                     file_content = f.read()
                     
                 # 处理图片
-                result = process_single_image(file_content, image_type, confidence)
-                return jsonify(result)
+                result = process_single_image(file_content, image_type, confidence, model, tiled, response_mode)
+                return detect_response(result, response_mode)
             except Exception as e:
                 import traceback
                 traceback.print_exc()
@@ -748,8 +892,8 @@ def api_detect():
             
         try:
             # 处理图片
-            result = process_single_image(file_content, image_type, confidence)
-            return jsonify(result)
+            result = process_single_image(file_content, image_type, confidence, model, tiled, response_mode)
+            return detect_response(result, response_mode)
         except Exception as e:
             import traceback
             traceback.print_exc()
@@ -788,22 +932,22 @@ def api_detect():
                 
                 if image_type == 'npy':
                     try:
-                        result = process_single_image(image_path, 'npy', confidence)
+                        result = process_single_image(image_path, 'npy', confidence, model, tiled, response_mode)
                     except Exception as e:
                         print(f"NPY处理错误: {str(e)}")
                         # 尝试直接加载文件内容
                         with open(image_path, 'rb') as f:
                             npy_bytes = f.read()
-                        result = process_single_image(npy_bytes, 'npy', confidence)
+                        result = process_single_image(npy_bytes, 'npy', confidence, model, tiled, response_mode)
                 else:
                     try:
                         with open(image_path, 'rb') as f:
                             image_bytes = f.read()
-                        result = process_single_image(image_bytes, 'jpg', confidence)
+                        result = process_single_image(image_bytes, 'jpg', confidence, model, tiled, response_mode)
                     except Exception as e:
                         print(f"读取图片文件错误: {str(e)}")
                         # 尝试直接传递路径
-                        result = process_single_image(image_path, 'jpg', confidence)
+                        result = process_single_image(image_path, 'jpg', confidence, model, tiled, response_mode)
             except Exception as e:
                 import traceback
                 traceback.print_exc()
@@ -822,12 +966,12 @@ def api_detect():
             # 解码BASE64数据
             try:
                 image_bytes = base64.b64decode(image_data)
-                result = process_single_image(image_bytes, image_type, confidence)
+                result = process_single_image(image_bytes, image_type, confidence, model, tiled, response_mode)
             except Exception as e:
                 print(f"解码图片错误: {str(e)}")
                 return jsonify({'status': 'error', 'message': f'图片解码错误: {str(e)}'}), 400
         
-        return jsonify(result)
+        return detect_response(result, response_mode)
     
     # 不支持的请求类型
     return jsonify({'error': '不支持的请求格式'}), 415
@@ -844,22 +988,8 @@ def api_batch_detect():
     if 'weight_file' in request.files:
         weight_file = request.files['weight_file']
         if weight_file.filename != '':
-            # 创建临时目录来存储上传的权重文件
-            weights_dir = os.path.join(UPLOAD_FOLDER, 'weights')
-            os.makedirs(weights_dir, exist_ok=True)
-            
-            # 保存权重文件
-            weight_filename = secure_filename(weight_file.filename)
-            custom_weight_path = os.path.join(weights_dir, weight_filename)
-            weight_file.save(custom_weight_path)
-            print(f"权重文件已保存至: {custom_weight_path}")
-            
-            # 加载自定义权重模型
-            if not initialize_model(custom_weight_path):
-                return jsonify({
-                    'status': 'error',
-                    'message': '加载自定义权重文件失败'
-                }), 400
+            # 保存权重文件, 模型在实际检测时按内容哈希从缓存中获取
+            custom_weight_path = save_weight_file(weight_file)
     
     # 检查请求中是否有文件
     if 'images[]' not in request.files:
@@ -881,88 +1011,49 @@ def api_batch_detect():
     
     # detection_mode = request.form.get('detection_mode', 'bbox') # 根据需要处理
     # save_results = request.form.get('save_results', 'true').lower() == 'true' # 根据需要处理
+    run_async = request.form.get('async', 'false').lower() == 'true'
+    tiled = request.form.get('tiled', 'false').lower() == 'true'
 
-    task_id = f"task_{int(time.time())}"
-    task_dir = os.path.join(OUTPUT_DIR, task_id)
-    os.makedirs(task_dir, exist_ok=True)
+    task_id, task_dir = create_task_dir(OUTPUT_DIR)
+    filenames = [file.filename for file in files]
+    image_types = [image_type_of(name) for name in filenames]
+
+    if run_async:
+        # 上传文件保存到任务目录, 由工作进程读取
+        inputs_dir = os.path.join(task_dir, 'inputs')
+        os.makedirs(inputs_dir, exist_ok=True)
+        inputs = []
+        for i, (file, image_type) in enumerate(zip(files, image_types)):
+            input_path = os.path.join(inputs_dir, f"{i:05d}_{secure_filename(file.filename)}")
+            file.save(input_path)
+            inputs.append((input_path, image_type))
+        return submit_detection_job(task_id, inputs, filenames, confidence, custom_weight_path, tiled)
+
+    model = get_model(custom_weight_path)
+    if model is None:
+        if custom_weight_path:
+            return jsonify({'status': 'error', 'message': '加载自定义权重文件失败'}), 400
+        return jsonify({'status': 'error', 'message': '模型初始化失败'}), 500
+
+    # 读取所有文件内容, 按扩展名确定类型
+    items = [(file.read(), image_type) for file, image_type in zip(files, image_types)]
+    recorder = TaskRecorder(task_dir, {'task_id': task_id, 'timestamp': time.time()}, total=len(files),
+                            store=TASK_STORE)
+    try:
+        task_info = run_detection_task(task_dir, items, filenames, confidence, recorder, model, tiled)
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        recorder.finish(FAILED, str(e))
+        return jsonify({'status': 'error', 'task_id': task_id, 'message': f'批量检测失败: {str(e)}'}), 500
 
-    results = []
-    detection_count = 0
-    
-    # 处理每个文件
-    print(f"开始处理 {len(files)} 个文件")
-    for i, file in enumerate(files):
-        print(f"\n处理文件 {i+1}/{len(files)}: {file.filename}")
-        try:
-            # 读取文件内容
-            file_content = file.read()
-            print(f"文件内容大小: {len(file_content)} 字节")
-            
-            # 确定文件类型
-            filename = file.filename
-            orig_image_type = 'npy' if filename.lower().endswith('.npy') else 'jpg'
-            image_type = orig_image_type
-            print(f"文件类型: {image_type}")
-            
-            # 处理图像
-            try:
-                print(f"开始调用process_single_image处理图像")
-                result = process_single_image(file_content, image_type, confidence)
-            except Exception as e:
-                print(f"首次处理图像失败: {str(e)}")
-                # 如果第一次处理失败，尝试切换图像类型
-                image_type = 'jpg' if orig_image_type == 'npy' else 'npy'
-                print(f"尝试切换图像类型为 {image_type}")
-                result = process_single_image(file_content, image_type, confidence)
-            
-            # 如果成功，保存结果
-            if result['status'] == 'success':
-                # 生成结果文件名
-                result_filename = f"{os.path.splitext(filename)[0]}_result.png"
-                result_path = os.path.join(task_dir, result_filename)
-                
-                # 保存结果图像
-                with open(result_path, 'wb') as f:
-                    f.write(base64.b64decode(result['result_image']))
-                
-                # 更新检测计数
-                detection_count += result['detection_count']
-                
-                # 添加到结果列表
-                results.append({
-                    'filename': filename,
-                    'result_filename': result_filename,
-                    'boxes': result['boxes'],
-                    'detection_count': result['detection_count']
-                })
-        
-        except Exception as e:
-            print(f"处理文件 {file.filename} 时出错: {str(e)}")
-            results.append({
-                'filename': file.filename,
-                'status': 'error',
-                'message': str(e)
-            })
-    
-    # 保存任务信息
-    task_info = {
-        'task_id': task_id,
-        'timestamp': time.time(),
-        'files_count': len(files),
-        'detection_count': detection_count,
-        'results': results
-    }
-    
-    with open(os.path.join(task_dir, 'task_info.json'), 'w') as f:
-        json.dump(task_info, f, indent=2)
-    
     # 返回结果
     return jsonify({
         'status': 'success',
         'task_id': task_id,
-        'files_count': len(files),
-        'detection_count': detection_count,
-        'results': results
+        'files_count': task_info['files_count'],
+        'detection_count': task_info['detection_count'],
+        'results': task_info['results']
     })
 
 @app.route('/api/batch_detect_dataset', methods=['POST'])
@@ -977,14 +1068,7 @@ def api_batch_detect_dataset():
     if 'weight_file' in request.files:
         weight_file = request.files['weight_file']
         if weight_file.filename != '':
-            weights_dir = os.path.join(UPLOAD_FOLDER, 'weights')
-            os.makedirs(weights_dir, exist_ok=True)
-            weight_filename = secure_filename(weight_file.filename)
-            custom_weight_path = os.path.join(weights_dir, weight_filename)
-            weight_file.save(custom_weight_path)
-            print(f"权重文件已保存至: {custom_weight_path}")
-            if not initialize_model(custom_weight_path):
-                return jsonify({'status': 'error', 'message': '加载自定义权重文件失败'}), 400
+            custom_weight_path = save_weight_file(weight_file)
     
     dataset_name = request.form.get('dataset')
     if not dataset_name:
@@ -1001,123 +1085,142 @@ def api_batch_detect_dataset():
     
     # detection_mode = request.form.get('detection_mode', 'bbox') # 根据需要处理
     # save_results = request.form.get('save_results', 'true').lower() == 'true' # 根据需要处理
+    run_async = request.form.get('async', 'false').lower() == 'true'
+    tiled = request.form.get('tiled', 'false').lower() == 'true'
 
-    task_id = f"task_{int(time.time())}"
-    task_dir = os.path.join(OUTPUT_DIR, task_id)
-    os.makedirs(task_dir, exist_ok=True)
-
-    results_summary = []
-    total_detection_count = 0
-    processed_files_count = 0
-    
     image_files_to_process = []
-    for filename in os.listdir(dataset_path):
-        if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.fits', '.fit', '.npy')):
+    for filename in sorted(os.listdir(dataset_path)):
+        if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.fits', '.fit', '.fz', '.npy')):
             image_files_to_process.append(filename)
     
     print(f"在数据集 {dataset_name} 中找到 {len(image_files_to_process)} 个图像文件进行处理")
 
+    # 数据集文件直接按路径交给预处理, 不整体读入内存
+    inputs = []
+    filenames = []
+    fits_files = []
     for filename in image_files_to_process:
-        file_path = os.path.join(dataset_path, filename)
-        try:
-            with open(file_path, 'rb') as f_content:
-                image_data = f_content.read()
-            
-            image_type = 'npy' if filename.lower().endswith('.npy') else 'fits' if filename.lower().endswith(('.fits', '.fit')) else 'jpg'
-            
-            # 调用核心处理函数
-            # 注意: process_single_image 可能需要根据 image_type 处理 FITS
-            # 当前 process_single_image 主要针对 'jpg' 和 'npy'
-            # 如果需要FITS原生支持，process_single_image 或其调用的 preprocess_image 需要增强
-            print(f"处理数据集文件: {filename} (类型: {image_type})")
-            result = process_single_image(image_data, image_type, confidence)
-
-            if result['status'] == 'success':
-                result_img_filename = f"{os.path.splitext(filename)[0]}_result.png"
-                result_img_path = os.path.join(task_dir, result_img_filename)
-                with open(result_img_path, 'wb') as f_img:
-                    f_img.write(base64.b64decode(result['result_image']))
-                
-                total_detection_count += result['detection_count']
-                results_summary.append({
-                    'filename': filename,
-                    'result_filename': result_img_filename,
-                    'boxes': result['boxes'],
-                    'detection_count': result['detection_count']
-                })
-            else:
-                 results_summary.append({
-                    'filename': filename,
-                    'status': 'error',
-                    'message': result.get('message', '处理失败')
-                })
-            processed_files_count += 1
-        except Exception as e:
-            print(f"处理数据集文件 {filename} 时出错: {str(e)}")
-            results_summary.append({
-                'filename': filename,
-                'status': 'error',
-                'message': str(e)
-            })
-    
-    task_info = {
-        'task_id': task_id,
-        'dataset_name': dataset_name,
-        'timestamp': time.time(),
-        'files_count': processed_files_count,
-        'detection_count': total_detection_count,
-        'results': results_summary
-    }
+        image_type = image_type_of(filename)
+        if image_type == 'fits':
+            fits_files.append(filename)
+            continue
+        inputs.append((os.path.join(dataset_path, filename), image_type))
+        filenames.append(filename)
 
-    with open(os.path.join(task_dir, 'task_info.json'), 'w') as f_json:
-        json.dump(task_info, f_json, indent=2)
+    # 同一视场的多波段 FITS 合并为一个多通道输入
+    for group_name, members, target_index in group_fits_bands(fits_files):
+        if len(members) == 1:
+            inputs.append((os.path.join(dataset_path, members[0]), 'fits'))
+        else:
+            fits_paths = [os.path.join(dataset_path, member) for member in members]
+            inputs.append(({'fits_paths': fits_paths, 'target_index': target_index}, 'fits'))
+        filenames.append(group_name)
+
+    task_id, task_dir = create_task_dir(OUTPUT_DIR)
+    if run_async:
+        return submit_detection_job(task_id, inputs, filenames, confidence, custom_weight_path, tiled,
+                                    dataset_name=dataset_name)
+
+    model = get_model(custom_weight_path)
+    if model is None:
+        if custom_weight_path:
+            return jsonify({'status': 'error', 'message': '加载自定义权重文件失败'}), 400
+        return jsonify({'status': 'error', 'message': '模型初始化失败'}), 500
+
+    recorder = TaskRecorder(task_dir, {'task_id': task_id, 'dataset_name': dataset_name, 'timestamp': time.time()},
+                            total=len(inputs), store=TASK_STORE)
+    try:
+        task_info = run_detection_task(task_dir, inputs, filenames, confidence, recorder, model, tiled)
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        recorder.finish(FAILED, str(e))
+        return jsonify({'status': 'error', 'task_id': task_id, 'message': f'数据集检测失败: {str(e)}'}), 500
 
     return jsonify({
         'status': 'success',
         'task_id': task_id,
         'dataset_name': dataset_name,
-        'files_count': processed_files_count,
-        'detection_count': total_detection_count
+        'files_count': task_info['files_count'],
+        'detection_count': task_info['detection_count']
     })
 
 @app.route('/api/tasks', methods=['GET'])
 def api_tasks():
-    """获取所有任务列表"""
-    tasks = []
-    
-    # 遍历输出目录
-    for task_dir in os.listdir(OUTPUT_DIR):
-        task_path = os.path.join(OUTPUT_DIR, task_dir)
-        
-        # 检查是否是目录
-        if os.path.isdir(task_path):
-            # 尝试读取任务信息
-            info_path = os.path.join(task_path, 'task_info.json')
-            if os.path.exists(info_path):
-                try:
-                    with open(info_path, 'r') as f:
-                        task_info = json.load(f)
-                    tasks.append(task_info)
-                except:
-                    # 如果读取失败，添加基本信息
-                    tasks.append({
-                        'task_id': task_dir,
-                        'timestamp': os.path.getctime(task_path)
-                    })
-            else:
-                # 如果没有任务信息文件，添加基本信息
-                tasks.append({
-                    'task_id': task_dir,
-                    'timestamp': os.path.getctime(task_path)
-                })
-    
-    # 按时间戳排序（降序）
-    tasks.sort(key=lambda x: x.get('timestamp', 0), reverse=True)
-    
-    return jsonify({
+    """
+    分页获取任务列表(只查询任务索引, 不读取各任务的 task_info.json)
+    查询参数: page_size, cursor(上一页返回的 next_cursor, 不传为第一页), status, dataset, since, until(时间戳),
+             min_detections, order(newest|oldest|detections), stats(true|false)
+    第一页额外返回任务总数 total 与合计 stats: 无过滤条件时直接读取索引中维护的合计;
+    有过滤条件时需扫描满足条件的全部任务, 只在 stats=true 时计算
+    """
+    order = request.args.get('order', 'newest')
+    filtered = any(request.args.get(k) for k in ('status', 'dataset', 'since', 'until', 'min_detections'))
+    with_stats = request.args.get('stats', 'false' if filtered else 'true').lower() == 'true'
+    if order not in ORDERS:
+        return jsonify({'status': 'error', 'message': f'order 必须为 {list(ORDERS)} 之一'}), 400
+    try:
+        tasks, next_cursor, stats = TASK_STORE.list(
+            page_size=request.args.get('page_size', type=int),
+            cursor=request.args.get('cursor') or None,
+            status=request.args.get('status'),
+            dataset_name=request.args.get('dataset'),
+            since=request.args.get('since', type=float),
+            until=request.args.get('until', type=float),
+            min_detections=request.args.get('min_detections', type=int),
+            order=order,
+            with_stats=with_stats,
+        )
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    response = {
         'status': 'success',
-        'tasks': tasks
-    })
+        'tasks': tasks,
+        'next_cursor': next_cursor,
+    }
+    if stats is not None:
+        response['total'] = stats['total_tasks']
+        response['stats'] = stats
+    return jsonify(response)
+
+@app.route('/api/catalog', methods=['GET'])
+def api_catalog():
+    """
+    查询检测目录(只扫描满足条件的分区与行组, 不加载全部历史)
+    查询参数: min_confidence, task_id, source_file, class_id, date_from, date_to(YYYY-MM-DD),
+             ra_min, ra_max, dec_min, dec_max 或 ra, dec, radius(度, 锥形检索), columns(逗号分隔), limit
+    """
+    if pa is None or not cfg.INFERENCE['CATALOG_DIR']:
+        return jsonify({'status': 'error', 'message': '检测目录未启用(需要 pyarrow 并配置 CATALOG_DIR)'}), 501
+    args = request.args
+    max_limit = cfg.INFERENCE['CATALOG_QUERY_LIMIT']
+    limit = min(args.get('limit', max_limit, type=int), max_limit)
+    filters = {
+        'min_confidence': args.get('min_confidence', type=float),
+        'task_id': args.get('task_id'),
+        'source_file': args.getlist('source_file') or None,
+        'class_id': args.get('class_id', type=int),
+        'date_from': args.get('date_from'),
+        'date_to': args.get('date_to'),
+    }
+    ra_min, ra_max = args.get('ra_min', type=float), args.get('ra_max', type=float)
+    dec_min, dec_max = args.get('dec_min', type=float), args.get('dec_max', type=float)
+    if ra_min is not None and ra_max is not None:
+        filters['ra_range'] = (ra_min, ra_max)
+    if dec_min is not None and dec_max is not None:
+        filters['dec_range'] = (dec_min, dec_max)
+    cone = None
+    if all(key in args for key in ('ra', 'dec', 'radius')):
+        cone = (args.get('ra', type=float), args.get('dec', type=float), args.get('radius', type=float))
+    columns = args.get('columns')
+    columns = [c.strip() for c in columns.split(',') if c.strip()] if columns else None
+    try:
+        table = DetectionCatalog().query(columns=columns, cone=cone, limit=limit + 1, **filters)
+    except (pa.ArrowInvalid, KeyError, ValueError) as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    truncated = table.num_rows > limit
+    rows = table.slice(0, limit).to_pylist()
+    return jsonify({'status': 'success', 'detections': rows, 'count': len(rows), 'truncated': truncated})
 
 @app.route('/api/task/<task_id>', methods=['GET'])
 def api_task(task_id):
@@ -1134,12 +1237,98 @@ def api_task(task_id):
         try:
             with open(info_path, 'r') as f:
                 task_info = json.load(f)
+            # 轮询时可只取 since 之后新增的逐文件结果
+            since = request.args.get('since', type=int)
+            if since is not None:
+                task_info['results'] = task_info.get('results', [])[since:]
             return jsonify(task_info)
         except:
             return jsonify({'error': f'读取任务信息失败'}), 500
     else:
         return jsonify({'error': f'任务信息文件不存在'}), 404
 
+@app.route('/api/task/<task_id>/events', methods=['GET'])
+def api_task_events(task_id):
+    """
+    以 Server-Sent Events 推送任务进度, 每个事件附带上次推送之后新完成的文件结果.
+    本进程的工作进程全部退出, 或任务超过 TASK_EVENTS_TIMEOUT 秒没有进展时, 推送 error 事件后结束
+    """
+    info_path = os.path.join(OUTPUT_DIR, secure_filename(task_id), 'task_info.json')
+    if not os.path.exists(info_path):
+        return jsonify({'error': f'任务 {task_id} 不存在'}), 404
+
+    def error_event(status, message):
+        return f"event: error\ndata: {json.dumps({'task_id': task_id, 'status': status, 'message': message})}\n\n"
+
+    def stream():
+        sent = 0
+        last_mtime = None
+        last_event = last_change = time.time()
+        status = None
+        while True:
+            mtime = os.path.getmtime(info_path)
+            if mtime != last_mtime:
+                last_mtime = mtime
+                task_info = read_json(info_path)
+                if task_info is not None:
+                    results = task_info.get('results', [])
+                    # 旧任务没有 status 字段, 视为已完成
+                    status = task_info.get('status', COMPLETED)
+                    event = {
+                        'task_id': task_id,
+                        'status': status,
+                        'progress': task_info.get('progress', {'processed': len(results), 'total': len(results)}),
+                        'files_count': task_info.get('files_count', 0),
+                        'detection_count': task_info.get('detection_count', 0),
+                        'results': results[sent:]
+                    }
+                    sent = len(results)
+                    last_event = last_change = time.time()
+                    yield f"data: {json.dumps(event)}\n\n"
+                    if status in FINISHED_STATES:
+                        break
+            elif JOB_QUEUE.started and not JOB_QUEUE.alive():
+                yield error_event(status, '工作进程已退出')
+                break
+            elif time.time() - last_change > cfg.INFERENCE['TASK_EVENTS_TIMEOUT']:
+                yield error_event(status, '任务长时间没有进展')
+                break
+            elif time.time() - last_event > 15:
+                # 注释行保活, 防止反向代理断开空闲连接
+                last_event = time.time()
+                yield ": keep-alive\n\n"
+            time.sleep(0.5)
+
+    return Response(stream_with_context(stream()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/task/<task_id>/cancel', methods=['POST'])
+def api_task_cancel(task_id):
+    """取消排队中或运行中的异步任务"""
+    task_info = JOB_QUEUE.cancel(secure_filename(task_id))
+    if task_info is None:
+        return jsonify({'error': f'任务 {task_id} 不存在'}), 404
+    return jsonify({'status': 'success', 'task_id': task_id, 'task_status': task_info.get('status', COMPLETED)})
+
+@app.route('/api/models', methods=['GET'])
+def api_models():
+    """查看模型缓存中已加载与正在加载的权重"""
+    if MODEL_REGISTRY is None:
+        return jsonify({'status': 'success', 'loaded': [], 'loading': []})
+    info = MODEL_REGISTRY.info()
+    info['status'] = 'success'
+    return jsonify(info)
+
+@app.route('/api/overlay/<token>/<kind>.png', methods=['GET'])
+def api_overlay(token, kind):
+    """url 响应模式下按需绘制并返回结果图(result)或原图(original)"""
+    if kind not in ['result', 'original']:
+        return jsonify({'error': f'未知的图像类型: {kind}'}), 404
+    png = OVERLAY_STORE.get_png(token, kind)
+    if png is None:
+        return jsonify({'error': '图像不存在或已过期'}), 404
+    return Response(png, mimetype='image/png', headers={'Cache-Control': f"private, max-age={cfg.INFERENCE['OVERLAY_TTL']}"})
+
 @app.route('/results/<task_id>/<filename>')
 def task_result(task_id, filename):
     """获取任务结果图像"""
@@ -1182,5 +1371,11 @@ def api_samples():
 if __name__ == '__main__':
     # 初始化模型
     initialize_model()
+    # 首次启动时把已有的任务目录写入任务索引
+    TASK_STORE.backfill(OUTPUT_DIR)
+    # debug 模式下 reloader 的监控进程不启动工作进程, 只在实际服务的子进程中启动并恢复未完成的作业;
+    # 以其他方式部署(多个 WSGI 进程)时不要恢复, 否则其他进程仍在运行的作业会被重复执行
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        JOB_QUEUE.start(recover=True)
     # 启动服务
     app.run(debug=True, host='0.0.0.0', port=5000)
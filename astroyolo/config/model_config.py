@@ -13,6 +13,8 @@ TRAIN = {
     'TRAIN_IMG_SIZE': 352,  # training image size
     'BATCH_SIZE': 4,  # 批大小，自动调整为4以避免显存溢出
     'IOU_THRESHOLD_LOSS': 0.5,  # iou threshold for loss
+    'IGNORE_MODE': 'iou',  # 背景掩码的计算方式: iou(只与真实框算 IoU) | ciou | dense(与全部 150 个槽位算 CIoU, 原实现)
+    'IGNORE_CHUNK': 32,  # 背景掩码每次参与计算的真实框数, 限制 [bs, grid, grid, anchors, chunk] 中间量的大小
     'YOLO_EPOCHS': 50,  # 总训练轮数
     'NUMBER_WORKERS': 8,  # 数据加载线程数
     'MOMENTUM': 0.9,  # SGD momentum
@@ -20,6 +22,12 @@ TRAIN = {
     'LR_INIT': 1e-3,  # initial learning rate
     'LR_END': 1e-6,  # 最终学习率
     'WARMUP_EPOCHS': 2,  # 预热轮数
+    'DATASET_CACHE': False,  # 使用预处理后的内存映射数据集缓存(首次使用时自动编译), 默认关闭
+    'DATASET_CACHE_DIR': osp.join(DATA_PATH, 'cache'),  # 数据集缓存目录
+    'DATASET_CACHE_DTYPE': 'float32',  # 缓存中图像的存储类型, float16 可减半磁盘占用, uint8 为四分之一(配合 BATCH_AUGMENT)
+    'BATCH_LABEL_ASSIGN': False,  # True 时 Dataset 只返回图像与边界框, 标签在训练循环中按批在 GPU 上生成
+    'BATCH_AUGMENT': False,  # 与 BATCH_LABEL_ASSIGN 一起使用: Dataset 返回 uint8 图像与原始框, 训练循环需对每批调用 utils.batch_augment.build_augmented_targets 完成增强、Mixup 与标签分配; BatchAugment 默认只做 Mixup, 与逐样本流程相同
+    'DATASET_DIAGNOSTICS': False,  # 统计形状修正、NaN/Inf、缺失边界框等数据问题, 每个 epoch 汇总输出一次
 }
 
 # val
@@ -31,8 +39,16 @@ VAL = {
     'NUMBER_WORKERS': 8,  # 数据加载线程数
     'CONF_THRESH': 0.05,  # 降低置信度阈值
     'NMS_THRESH': 0.45,  # 保持NMS阈值
-    'MULTI_SCALE_VAL': False,
-    'FLIP_VAL': False,
+    'NMS_TOPK': 3000,  # 每张图按分数取前 NMS_TOPK 个候选框参与 NMS, 0 表示不限制
+    'NMS_CHUNK': 1024,  # 无 torchvision 时 NMS / soft-NMS 每次计算 IoU 的框数, 限制 IoU 矩阵的大小
+    'MULTI_SCALE_VAL': False,  # 测试时增强: 按 TTA_SCALES 缩放出多个视图
+    'FLIP_VAL': False,  # 测试时增强: 每个尺度再加上 TTA_FLIPS 中的翻转视图
+    'TTA_SCALES': (0.75, 1.0, 1.25),  # 相对 TEST_IMG_SIZE 的缩放比例, 视图边长取整到 32 的倍数
+    'TTA_FLIPS': ('h',),  # h: 水平翻转, v: 垂直翻转, hv: 两者同时
+    'TTA_MERGE': 'wbf',  # 多视图检测的合并方式: wbf(加权框融合) | nms
+    'TTA_WBF_IOU': 0.55,  # 加权框融合的聚类 IoU 阈值
+    'EVAL_PROCESSES': 5,  # utils.evaluator 并行评估各折时的进程数
+    'EVAL_DEVICE': 'cpu',  # 训练中异步评估(AsyncEvaluator)使用的设备, 如 'cuda:1'
 }
 
 Customer_DATA = {
@@ -59,6 +75,50 @@ MODEL = {
     'ANCHORS_PER_SCLAE': 3,
     'TRANSFORMER_BLOCKS': 3,  # 堆叠层数，主实验用3
     'TRANSFORMER_HEADS': 8,  # 多头数，必须能整除hidden_feature
+    'ATTENTION': 'sdpa',  # TransFusion 注意力实现: mha(nn.MultiheadAttention) | sdpa(scaled_dot_product_attention) | window(局部窗口注意力, 大输入时显存线性增长)
+    'ATTENTION_WINDOW': 11,  # window 模式的窗口边长(特征图格点数)
+}
+
+# inference (Web 服务端推理)
+INFERENCE = {
+    'BATCH_SIZE': 8,  # 批量检测时每个微批的图像数, 不足时补零以保持张量尺寸固定
+    'NUM_WORKERS': 4,  # 并行预处理/结果图编码的线程数
+    'JOB_WORKERS': 1,  # 异步检测作业的工作进程数, 每个进程各自加载一份模型
+    'MAX_MODELS': 3,  # 常驻内存的模型个数(按权重内容哈希缓存)
+    'MEMORY_BUDGET_MB': 2048,  # 常驻模型的总内存预算, 0 表示不限制
+    'PRELOAD_WEIGHTS': [],  # 服务启动后在后台预加载的权重文件
+    'TILE_OVERLAP': 64,  # 分块推理时相邻窗口(TEST_IMG_SIZE)的重叠像素数
+    'TILE_MERGE_THRESH': 0.5,  # 分块推理时合并跨窗口重复框的 IoU 阈值
+    'TILE_PREVIEW_MAX_SIDE': 4096,  # 分块推理结果图(预览)的长边上限, 更大的图像按整数步长抽样后再绘制
+    'OPTIMIZE': 'none',  # 加载模型后的推理优化: none(eager, 默认) | fuse(Conv+BN 融合) | torchscript(融合并冻结) | compile(融合后 torch.compile), 后三者需显式开启
+    'OPTIMIZE_TOL': (1e-3, 1e-3),  # 优化后模型与 eager 模型解码输出的容差 (rtol, atol), 超出则退回
+    'COMPILE_BACKEND': 'inductor',  # OPTIMIZE 为 compile 时使用的 torch.compile 后端
+    'HEAD_CONF_FLOOR': None,  # 不为 None 时 YOLOHead 只输出 conf 超过该值的框(稀疏输出), 仅对 OPTIMIZE 为 none/fuse 的模型生效
+    'BACKEND': 'torch',  # 推理后端: torch | onnxruntime(首次加载某份权重时导出 ONNX 并缓存)
+    'ONNX_DIR': osp.join(PROJECT_PATH, 'cache', 'onnx'),  # 导出的 ONNX 模型目录, 按权重哈希命名
+    'ONNX_OPSET': 17,
+    'ORT_INTRA_OP_THREADS': 0,  # ONNX Runtime 算子内线程数, 0 表示按物理核数
+    'ORT_INTER_OP_THREADS': 1,  # ONNX Runtime 算子间线程数, 大于 1 时并行执行相互独立的分支
+    'QUANT_BACKEND': 'x86',  # int8 量化的内核后端: x86 | fbgemm | qnnpack(ARM)
+    'QUANT_CALIB_SAMPLES': 200,  # 训练后量化从训练标注中抽取的校准图像数
+    'OVERLAY_CACHE_MB': 512,  # /api/detect 的 url 响应模式下缓存的原图与已编码结果图的内存上限
+    'OVERLAY_TTL': 600,  # url 响应模式下结果图 URL 的有效期(秒)
+    'TASK_EVENTS_TIMEOUT': 600,  # /api/task/<id>/events 在任务超过该秒数没有进展时结束推送
+    'TASKS_PAGE_SIZE': 50,  # /api/tasks 默认每页任务数
+    'TASKS_MAX_PAGE_SIZE': 500,  # /api/tasks 每页任务数上限
+    'CATALOG_DIR': osp.join(PROJECT_PATH, 'catalog'),  # 检测目录(Parquet, 按 date=/task_id= 分区), 为空则不写入
+    'CATALOG_FLUSH_ROWS': 50000,  # 检测目录写入时每个 Parquet 文件的最大行数
+    'CATALOG_QUERY_LIMIT': 10000,  # /api/catalog 单次返回的最大行数
+    'PREDICTION_CACHE_MB': 256,  # 单图检测按 (图像哈希, 权重哈希) 缓存原图与阈值过滤前预测的内存上限, 0 表示不缓存
+}
+
+# FITS 输入
+FITS = {
+    'BANDS': ['g', 'r', 'i'],  # 多波段 FITS 按此顺序堆叠为模型的三个输入通道(依次显示为 B/G/R)
+    'TARGET_BAND': 'r',  # 其余波段重投影到该波段的 WCS
+    'REPROJECT_CACHE_SIZE': 32,  # 缓存的重投影结果个数
+    'PLAN_CACHE_SIZE': 16,  # 内存中缓存的重投影坐标映射个数
+    'PLAN_CACHE_DIR': osp.join(PROJECT_PATH, 'cache', 'reproject_plans'),  # 坐标映射的持久化目录, 为空则不落盘
 }
 
 # 在训练过程中使用预训练权重
@@ -77,6 +137,8 @@ class _ModelConfig:
         self.VAL = VAL
         self.Customer_DATA = Customer_DATA
         self.MODEL = MODEL
+        self.INFERENCE = INFERENCE
+        self.FITS = FITS
         self.PRETRAIN = PRETRAIN
 
 # 创建可导入的全局配置对象
@@ -0,0 +1,144 @@
+import sys
+import time
+
+import torch
+import torch.nn.functional as F
+
+sys.path.append('..')
+import config.model_config as cfg
+
+ATTENTION_MODES = ('mha', 'sdpa', 'window')
+
+
+def _in_projection(mha, query, key, value):
+    """沿用 nn.MultiheadAttention 自身的投影参数, 权重文件无需任何转换"""
+    if mha._qkv_same_embed_dim:
+        w_q, w_k, w_v = mha.in_proj_weight.chunk(3)
+    else:
+        w_q, w_k, w_v = mha.q_proj_weight, mha.k_proj_weight, mha.v_proj_weight
+    b_q, b_k, b_v = mha.in_proj_bias.chunk(3) if mha.in_proj_bias is not None else (None, None, None)
+    return F.linear(query, w_q, b_q), F.linear(key, w_k, b_k), F.linear(value, w_v, b_v)
+
+
+def _to_windows(x, h, w, window):
+    """[b, h*w, c] -> [b*nh*nw, window*window, c], 不足一个窗口的边缘补零"""
+    b, _, c = x.shape
+    pad_h, pad_w = (-h) % window, (-w) % window
+    x = F.pad(x.view(b, h, w, c), (0, 0, 0, pad_w, 0, pad_h))
+    nh, nw = (h + pad_h) // window, (w + pad_w) // window
+    x = x.view(b, nh, window, nw, window, c).permute(0, 1, 3, 2, 4, 5)
+    return x.reshape(b * nh * nw, window * window, c)
+
+
+def _from_windows(x, b, h, w, window):
+    c = x.shape[-1]
+    nh, nw = -(-h // window), -(-w // window)
+    x = x.view(b, nh, nw, window, window, c).permute(0, 1, 3, 2, 4, 5)
+    return x.reshape(b, nh * window, nw * window, c)[:, :h, :w].reshape(b, h * w, c)
+
+
+def _window_mask(b, h, w, window, device):
+    """补零位置不能作为 key 参与注意力: [b*nh*nw, 1, 1, window*window] bool, True 表示可见"""
+    valid = torch.ones((1, h * w, 1), device=device)
+    return (_to_windows(valid, h, w, window) > 0).view(-1, 1, 1, window * window).repeat(b, 1, 1, 1)
+
+
+def attention_flops(mha, query, key, value, num_queries, num_keys):
+    """
+    注意力的乘加数(不含 out_proj): q/k/v 三个输入投影, 以及 QK^T 与注意力加权 V 两次矩阵乘
+    :param query, key, value: 投影前的输入 [..., dim]
+    :param num_queries: 参与注意力的 query 总数(窗口注意力含补零位置)
+    :param num_keys: 每个 query 可见的 key 数
+    """
+    embed_dim = mha.embed_dim
+    projection = (query.numel() + key.numel() + value.numel()) * embed_dim
+    return projection + 2 * num_queries * num_keys * embed_dim
+
+
+def efficient_attention(mha, query, key, value, hw, mode=None, window=None):
+    """
+    nn.MultiheadAttention(batch_first=True) 的等价实现, 注意力部分由 F.scaled_dot_product_attention 完成,
+    可使用 flash / memory-efficient 内核, 不再显式构造 [b, heads, n, n] 的注意力矩阵及其平均权重.
+    :param mha: nn.MultiheadAttention, 只使用其参数
+    :param query, key, value: [b, h*w, c], 三者来自同一 h x w 网格
+    :param hw: (h, w)
+    :param mode: 'mha' 直接调用原模块; 'sdpa' 全局注意力; 'window' 只在 window x window 的局部窗口内计算注意力,
+                 显存随 token 数线性增长
+    :return: [b, h*w, embed_dim]
+    """
+    mode = mode or cfg.MODEL['ATTENTION']
+    assert mode in ATTENTION_MODES, f"Error: attention mode must be in {ATTENTION_MODES}"
+    if mode == 'mha':
+        return mha(query, key, value, need_weights=False)[0]
+
+    b, n, _ = query.shape
+    h, w = hw
+    heads = mha.num_heads
+    q, k, v = _in_projection(mha, query, key, value)
+    mask = None
+    if mode == 'window':
+        window = window or cfg.MODEL['ATTENTION_WINDOW']
+        if h * w > window * window:
+            q, k, v = [_to_windows(t, h, w, window) for t in (q, k, v)]
+            if h % window or w % window:
+                mask = _window_mask(b, h, w, window, q.device)
+        else:
+            mode = 'sdpa'
+    if getattr(mha, '__flops__', None) is not None:
+        # utils/flops_counter 计数时: 投影与 SDPA 不经过任何模块的 hook, 在此计入(out_proj 由其自身 hook 计数)
+        mha.__flops__ += attention_flops(mha, query, key, value, q.shape[0] * q.shape[1], k.shape[1])
+    q, k, v = [t.view(t.shape[0], t.shape[1], heads, -1).transpose(1, 2) for t in (q, k, v)]
+    dropout = mha.dropout if mha.training else 0.0
+    out = F.scaled_dot_product_attention(q, k, v, attn_mask=mask, dropout_p=dropout)
+    out = out.transpose(1, 2).reshape(out.shape[0], -1, mha.embed_dim)
+    if mode == 'window':
+        out = _from_windows(out, b, h, w, window)
+    return mha.out_proj(out)
+
+
+def benchmark(img_sizes=(352, 704, 1056), batch_size=1, runs=5):
+    """
+    在 PANet 中最大的融合点(stride 8)上比较 mha / sdpa / window 三种实现的延迟与峰值显存.
+    CPU 上没有显存统计, 给出的是注意力矩阵 [b, heads, n, n] 的理论大小(window 模式按窗口计算).
+    """
+    from model.trans_fusion import TransFusion
+
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    channels = 256  # csp_darknet 第一个输出特征的通道数
+    module = TransFusion(channels // 2, channels).to(device).eval()
+    heads, window = cfg.MODEL['TRANSFORMER_HEADS'], cfg.MODEL['ATTENTION_WINDOW']
+    print(f"device={device}, batch={batch_size}, heads={heads}, window={window}")
+    print(f"{'img':>6} {'tokens':>7} {'mode':>7} {'latency ms':>11} {'peak MB':>9} {'attn MB':>9} {'max|diff|':>10}")
+    for img_size in img_sizes:
+        grid = img_size // cfg.MODEL['STRIDES'][0]
+        x1 = torch.rand((batch_size, channels // 2, grid, grid), device=device)
+        x2 = torch.rand((batch_size, channels // 2, grid, grid), device=device)
+        reference = None
+        for mode in ATTENTION_MODES:
+            module.attention_mode = mode
+            try:
+                with torch.no_grad():
+                    if device.type == 'cuda':
+                        torch.cuda.empty_cache()
+                        torch.cuda.reset_peak_memory_stats()
+                    out = module(x1, x2)
+                    start = time.perf_counter()
+                    for _ in range(runs):
+                        out = module(x1, x2)
+                    if device.type == 'cuda':
+                        torch.cuda.synchronize()
+                    ms = (time.perf_counter() - start) / runs * 1000
+            except RuntimeError as e:  # OOM
+                print(f"{img_size:>6} {grid * grid:>7} {mode:>7} {'failed':>11}  {str(e).splitlines()[0]}")
+                continue
+            peak = torch.cuda.max_memory_allocated() / 1024 ** 2 if device.type == 'cuda' else float('nan')
+            keys = min(window * window, grid * grid) if mode == 'window' else grid * grid
+            attn = batch_size * heads * grid * grid * keys * 4 / 1024 ** 2
+            reference = out if reference is None else reference
+            diff = (out - reference).abs().max().item()
+            print(f"{img_size:>6} {grid * grid:>7} {mode:>7} {ms:>11.1f} {peak:>9.1f} {attn:>9.1f} {diff:>10.3g}")
+
+
+if __name__ == "__main__":
+    # python -m model.attention [batch_size]
+    benchmark(batch_size=int(sys.argv[1]) if len(sys.argv) > 1 else 1)
@@ -2,6 +2,35 @@ import torch
 import torch.nn as nn
 
 
+class SparsePredictions(object):
+    """
+    YOLOHead 稀疏输出: 只保留 conf 超过下限的框, 不再返回 [bs*grid*grid*anchors, 5+num_classes] 的稠密张量.
+    boxes [M, 5+num_classes] 为解码后的 (x, y, w, h, conf, cls...), img_ind [M] 为所属图片在批内的序号.
+    """
+
+    def __init__(self, boxes, img_ind, batch_size):
+        self.boxes = boxes
+        self.img_ind = img_ind
+        self.batch_size = batch_size
+
+    @staticmethod
+    def cat(predictions):
+        return SparsePredictions(torch.cat([p.boxes for p in predictions], 0),
+                                 torch.cat([p.img_ind for p in predictions], 0),
+                                 predictions[0].batch_size)
+
+    def __len__(self):
+        return self.batch_size
+
+    def __getitem__(self, index):
+        """只支持连续切片(如去掉补齐的图片 pred[:n]), 图片序号相应平移"""
+        assert isinstance(index, slice), "SparsePredictions only supports slicing"
+        start, stop, step = index.indices(self.batch_size)
+        assert step == 1
+        mask = (self.img_ind >= start) & (self.img_ind < stop)
+        return SparsePredictions(self.boxes[mask], self.img_ind[mask] - start, max(stop - start, 0))
+
+
 class YOLOHead(nn.Module):
     def __init__(self, num_classes, anchors, stride):
         super(YOLOHead, self).__init__()
@@ -9,36 +38,64 @@ class YOLOHead(nn.Module):
         self.num_anchors = len(anchors)
         self.num_classes = num_classes
         self.stride = stride
+        self.conf_floor = None  # eval 模式下不为 None 时输出 SparsePredictions, 只保留 conf > conf_floor 的框
+        self.__grids = {}  # (grid, device, dtype) -> (grid_xy, anchors_wh)
 
     def forward(self, p):
         batch_size, n_g = p.shape[0], p.shape[-1]
         p = p.view(batch_size, self.num_anchors, 5 + self.num_classes, n_g, n_g).permute(0, 3, 4, 1, 2)
-        p_de = self.__decode(p.clone())
+        if self.training:
+            p_de = self.__decode(p.clone())
+        elif self.conf_floor is not None:
+            p_de = self.__decode_sparse(p)
+        else:
+            # __decode 不会原地修改 p, eval 时无需拷贝
+            p_de = self.__decode(p)
         return p, p_de
 
+    def __make_grid(self, output_size, device, dtype):
+        y = torch.arange(0, output_size, device=device).unsqueeze(1).repeat(1, output_size)
+        x = torch.arange(0, output_size, device=device).unsqueeze(0).repeat(output_size, 1)
+        grid_xy = torch.stack([x, y], dim=-1).to(dtype).unsqueeze(0).unsqueeze(3)  # [1, grid, grid, 1, 2]
+        anchors_wh = (1.0 * self.anchors).to(device=device, dtype=dtype) * self.stride  # [anchors, 2]
+        return grid_xy, anchors_wh
+
+    def __grid(self, output_size, device, dtype):
+        # 网格与按 stride 缩放的 anchor 只依赖特征图尺寸, 按 (尺寸, 设备, 类型) 缓存;
+        # 追踪(TorchScript/ONNX)时不走缓存, 以免把网格固化成常量
+        if torch.jit.is_tracing():
+            return self.__make_grid(output_size, device, dtype)
+        key = (output_size, device, dtype)
+        grid = self.__grids.get(key)
+        if grid is None:
+            grid = self.__grids[key] = self.__make_grid(output_size, device, dtype)
+        return grid
+
     def __decode(self, p):
-        batch_size, output_size = p.shape[:2]
-        device = p.device
+        output_size = p.shape[1]
         stride = self.stride
-        anchors = (1.0 * self.anchors).to(device)
+        grid_xy, anchors_wh = self.__grid(output_size, p.device, p.dtype)
         conv_raw_dxdy = p[:, :, :, :, 0:2]
         conv_raw_dwdh = p[:, :, :, :, 2:4]
         conv_raw_conf = p[:, :, :, :, 4:5]
         conv_raw_prob = p[:, :, :, :, 5:]
-        y = torch.arange(0, output_size).unsqueeze(1).repeat(1, output_size)
-        x = torch.arange(0, output_size).unsqueeze(0).repeat(output_size, 1)
-        grid_xy = torch.stack([x, y], dim=-1)
-        grid_xy = (
-            grid_xy.unsqueeze(0)
-            .unsqueeze(3)
-            .repeat(batch_size, 1, 1, 3, 1)
-            .float()
-            .to(device)
-        )
         pred_xy = (torch.sigmoid(conv_raw_dxdy) + grid_xy) * stride
-        pred_wh = (torch.exp(conv_raw_dwdh) * anchors) * stride
+        pred_wh = torch.exp(conv_raw_dwdh) * anchors_wh
         pred_xywh = torch.cat([pred_xy, pred_wh], dim=-1)
         pred_conf = torch.sigmoid(conv_raw_conf)
         pred_prob = torch.sigmoid(conv_raw_prob)
         pred_bbox = torch.cat([pred_xywh, pred_conf, pred_prob], dim=-1)
         return pred_bbox.view(-1, 5 + self.num_classes) if not self.training else pred_bbox
+
+    def __decode_sparse(self, p):
+        # 先按 conf 筛选, 只对保留下来的少量框做解码
+        _, anchors_wh = self.__grid(p.shape[1], p.device, p.dtype)
+        pred_conf = torch.sigmoid(p[..., 4])
+        img_ind, grid_y, grid_x, anchor_ind = (pred_conf > self.conf_floor).nonzero(as_tuple=True)
+        raw = p[img_ind, grid_y, grid_x, anchor_ind]  # [M, 5+num_classes]
+        grid_xy = torch.stack([grid_x, grid_y], dim=-1).to(p.dtype)
+        pred_xy = (torch.sigmoid(raw[:, 0:2]) + grid_xy) * self.stride
+        pred_wh = torch.exp(raw[:, 2:4]) * anchors_wh[anchor_ind]
+        pred_bbox = torch.cat([pred_xy, pred_wh, pred_conf[img_ind, grid_y, grid_x, anchor_ind, None],
+                               torch.sigmoid(raw[:, 5:])], dim=-1)
+        return SparsePredictions(pred_bbox, img_ind, p.shape[0])
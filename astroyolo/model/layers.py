@@ -1,4 +1,4 @@
-from typing import Union
+from typing import Optional
 
 import torch
 import torch.nn as nn
@@ -6,9 +6,11 @@ import torch.nn.functional as F
 
 
 class CBM(nn.Module):
-    def __init__(self, in_channels, out_channels, kernel_size=3, stride=1, padding: Union[str, int] = 'same',
+    def __init__(self, in_channels, out_channels, kernel_size=3, stride=1, padding: Optional[int] = None,
                  activation=True):
         super(CBM, self).__init__()
+        # 显式的整数 padding(奇数卷积核时与 'same' 等价): FX 量化的 conv2d_prepack 不接受字符串 padding
+        padding = kernel_size // 2 if padding is None else padding
         self.conv2d = nn.Conv2d(in_channels, out_channels, kernel_size, stride, padding)
         self.bn = nn.BatchNorm2d(out_channels)
         self.activation = nn.Mish()
@@ -23,8 +25,9 @@ class CBM(nn.Module):
 
 
 class CBL(nn.Module):
-    def __init__(self, in_channels, out_channels, kernel_size=3, stride=1, padding: Union[str, int] = 'same'):
+    def __init__(self, in_channels, out_channels, kernel_size=3, stride=1, padding: Optional[int] = None):
         super(CBL, self).__init__()
+        padding = kernel_size // 2 if padding is None else padding
         self.conv2d = nn.Conv2d(in_channels, out_channels, kernel_size, stride, padding)
         self.bn = nn.BatchNorm2d(out_channels)
         self.activation = nn.LeakyReLU()
@@ -60,8 +63,8 @@ class CSPLayer(nn.Module):
         self.cbm_end = CBM(hidden_channel * 2, out_channels, 1)
 
     def forward(self, x):
-        res_unit = self.res_units(self.cbm_start(x))
-        x = torch.cat([self.cbm_start(x), res_unit], dim=1)
+        x = self.cbm_start(x)
+        x = torch.cat([x, self.res_units(x)], dim=1)
         x = self.cbm_end(x)
         return x
 
@@ -1,10 +1,20 @@
 import sys
+import time
 
 sys.path.append('../utils')
 import torch
 import torch.nn as nn
 from utils import tools
 
+sys.path.append('..')
+import config.model_config as cfg
+
+# 背景掩码(忽略与任一真实框重叠较大的预测)的计算方式:
+# dense: 与全部 150 个补零槽位逐一计算 CIoU 并保留梯度图(原实现)
+# ciou: 同样用 CIoU, 但只与真实框计算, 在 no_grad 下分块进行
+# iou: 只与真实框计算普通 IoU, 在 no_grad 下分块进行
+IGNORE_MODES = ('dense', 'ciou', 'iou')
+
 
 class FocalLoss(nn.Module):
     def __init__(self, gamma=2.0, alpha=1.0, reduction='mean'):
@@ -23,10 +33,13 @@ class FocalLoss(nn.Module):
 
 
 class YOLOLoss(nn.Module):
-    def __init__(self, anchors, strides, iou_threshold_loss=0.5):
+    def __init__(self, anchors, strides, iou_threshold_loss=0.5, ignore_mode=None, ignore_chunk=None):
         super(YOLOLoss, self).__init__()
         self.__iou_threshold_loss = iou_threshold_loss
         self.__strides = strides
+        self.ignore_mode = ignore_mode or cfg.TRAIN['IGNORE_MODE']
+        self.ignore_chunk = ignore_chunk or cfg.TRAIN['IGNORE_CHUNK']
+        assert self.ignore_mode in IGNORE_MODES, f"Error: ignore mode must be in {IGNORE_MODES}"
 
     def forward(
             self,
@@ -130,10 +143,13 @@ class YOLOLoss(nn.Module):
         loss_ciou = label_obj_mask * bbox_loss_scale * (1.0 - ciou) * label_mix
 
         # loss confidence
-        iou = tools.CIOU_xywh_torch(
-            p_d_xywh.unsqueeze(4), bboxes.unsqueeze(1).unsqueeze(1).unsqueeze(1)
-        )
-        iou_max = iou.max(-1, keepdim=True)[0]
+        if self.ignore_mode == 'dense':
+            iou = tools.CIOU_xywh_torch(
+                p_d_xywh.unsqueeze(4), bboxes.unsqueeze(1).unsqueeze(1).unsqueeze(1)
+            )
+            iou_max = iou.max(-1, keepdim=True)[0]
+        else:
+            iou_max = self.__ignore_iou_max(p_d_xywh, bboxes)
         label_noobj_mask = (1.0 - label_obj_mask) * (
                 iou_max < self.__iou_threshold_loss
         ).float()
@@ -154,3 +170,86 @@ class YOLOLoss(nn.Module):
         loss = loss_ciou + loss_conf + loss_cls
 
         return loss, loss_ciou, loss_conf, loss_cls
+
+    def __ignore_iou_max(self, p_d_xywh, bboxes):
+        """
+        每个预测框与本图真实框的最大重叠, 只用于和阈值比较得到背景掩码, 不需要梯度:
+        1、在 no_grad 下计算, 不为反向传播保存 [bs, grid, grid, anchors, 150] 的中间量;
+        2、补零的槽位(w*h 为 0)不参与计算, 框数取批内单张图真实框数的最大值;
+        3、每次只与 ignore_chunk 个框计算后取最大值, 显存上限与框数无关.
+        :param p_d_xywh: [bs, grid, grid, anchors, 4]
+        :param bboxes: [bs, 150, 4]
+        :return: [bs, grid, grid, anchors, 1], 没有真实框的图片为 0
+        """
+        metric = tools.iou_xywh_torch if self.ignore_mode == 'iou' else tools.CIOU_xywh_torch
+        with torch.no_grad():
+            batch_size = bboxes.shape[0]
+            valid = bboxes[..., 2] * bboxes[..., 3] > 0
+            iou_max = p_d_xywh.new_zeros(p_d_xywh.shape[:-1] + (1,))
+            num_boxes = int(valid.sum(1).max()) if batch_size else 0
+            if num_boxes == 0:
+                return iou_max
+            # 真实框移到前面, 只保留前 num_boxes 个槽位
+            order = torch.sort(valid.to(torch.uint8), dim=1, descending=True, stable=True)[1][:, :num_boxes]
+            boxes = torch.gather(bboxes, 1, order.unsqueeze(-1).expand(-1, -1, 4)).view(batch_size, 1, 1, 1, -1, 4)
+            valid = torch.gather(valid, 1, order).view(batch_size, 1, 1, 1, -1)
+            pred = p_d_xywh.unsqueeze(4)
+            for start in range(0, num_boxes, self.ignore_chunk):
+                end = start + self.ignore_chunk
+                iou = metric(pred, boxes[..., start:end, :]).masked_fill(~valid[..., start:end], 0)
+                iou_max = torch.max(iou_max, iou.max(-1, keepdim=True)[0])
+        return iou_max
+
+
+def benchmark(img_size=None, batch_size=None, boxes_per_image=(2, 20), runs=5):
+    """
+    比较三种背景掩码计算方式下单次 forward + backward 的耗时与峰值显存, 以及总损失与 dense 的差异.
+    输入为随机的网络输出与随机真实框(标签由 label_assign.assign_targets 生成), 只涉及损失本身.
+    """
+    from model.head import YOLOHead
+    from utils.label_assign import assign_targets
+
+    img_size = img_size or cfg.TRAIN['TRAIN_IMG_SIZE']
+    batch_size = batch_size or cfg.TRAIN['BATCH_SIZE']
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    num_classes = cfg.Customer_DATA['NUM']
+    anchors = torch.FloatTensor(cfg.MODEL['ANCHORS'])
+    strides = torch.FloatTensor(cfg.MODEL['STRIDES'])
+    heads = [YOLOHead(num_classes, anchors[i], strides[i]).train() for i in range(3)]
+    channels = cfg.MODEL['ANCHORS_PER_SCLAE'] * (num_classes + 5)
+    print(f"device={device}, img_size={img_size}, batch={batch_size}, chunk={cfg.TRAIN['IGNORE_CHUNK']}")
+    print(f"{'boxes':>6} {'mode':>6} {'ms':>8} {'peak MB':>9} {'loss':>10} {'loss diff':>10}")
+    for num_boxes in boxes_per_image:
+        torch.manual_seed(0)
+        xy = torch.rand(batch_size, num_boxes, 2) * img_size * 0.8
+        wh = torch.rand(batch_size, num_boxes, 2) * img_size * 0.2 + 4
+        bboxes = torch.cat([xy, xy + wh, torch.zeros(batch_size, num_boxes, 1), torch.ones(batch_size, num_boxes, 1)],
+                           dim=-1).to(device)
+        targets = assign_targets(bboxes, torch.ones(batch_size, num_boxes, dtype=torch.bool, device=device),
+                                 img_size, num_classes)
+        raw = [torch.randn(batch_size, channels, img_size // int(s), img_size // int(s), device=device) * 0.1
+               for s in strides]
+        reference = None
+        for mode in IGNORE_MODES:
+            loss_fn = YOLOLoss(anchors, strides, cfg.TRAIN['IOU_THRESHOLD_LOSS'], ignore_mode=mode)
+            if device.type == 'cuda':
+                torch.cuda.empty_cache()
+                torch.cuda.reset_peak_memory_stats()
+            start = time.perf_counter()
+            for _ in range(runs):
+                inputs = [r.clone().requires_grad_() for r in raw]
+                p, p_d = list(zip(*[head(x) for head, x in zip(heads, inputs)]))
+                loss = loss_fn(p, p_d, *targets)[0]
+                loss.backward()
+            if device.type == 'cuda':
+                torch.cuda.synchronize()
+            ms = (time.perf_counter() - start) / runs * 1000
+            peak = torch.cuda.max_memory_allocated() / 1024 ** 2 if device.type == 'cuda' else float('nan')
+            reference = loss.item() if reference is None else reference
+            print(f"{num_boxes:>6} {mode:>6} {ms:>8.1f} {peak:>9.1f} {loss.item():>10.4f} "
+                  f"{loss.item() - reference:>10.4f}")
+
+
+if __name__ == "__main__":
+    # 在 astroyolo 目录下运行: python -m model.loss.yolo_loss [img_size] [batch_size]
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else None, int(sys.argv[2]) if len(sys.argv) > 2 else None)
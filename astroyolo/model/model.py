@@ -5,7 +5,7 @@ import torch.nn as nn
 
 from model.conv_next import build_conv_next
 from model.csp_darknet import build_darknet
-from model.head import YOLOHead
+from model.head import SparsePredictions, YOLOHead
 from model.layers import SpatialPyramidPooling
 from model.panet_conv import PANet as PANetConv
 from model.panet_trans import PANet as PANetTrans
@@ -62,4 +62,15 @@ class BuildModel(nn.Module):
             return p, p_d
         else:
             p, p_d = list(zip(*out))
+            if isinstance(p_d[0], SparsePredictions):
+                return p, SparsePredictions.cat(p_d)
             return p, torch.cat(p_d, 0)
+
+    def set_conf_floor(self, conf_floor=None):
+        """
+        eval 模式的输出方式: None 为稠密输出 [sum_i(bs*grid_i*grid_i*anchors), 5+num_classes];
+        否则各尺度只输出 conf > conf_floor 的框, p_d 为 SparsePredictions
+        """
+        for head in [self.head_s, self.head_m, self.head_l]:
+            head.conf_floor = conf_floor
+        return self
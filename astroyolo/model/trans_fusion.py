@@ -1,6 +1,7 @@
 import torch
 import torch.nn as nn
 import config.model_config as cfg
+from model.attention import efficient_attention
 
 
 class TransMLP(nn.Module):
@@ -23,7 +24,8 @@ class TransMLP(nn.Module):
 
 
 class TransFusion(nn.Module):
-    def __init__(self, input_channel, hidden_feature, head_num=None, dropout=0.2, trans_block=None):
+    def __init__(self, input_channel, hidden_feature, head_num=None, dropout=0.2, trans_block=None,
+                 attention_mode=None):
         super(TransFusion, self).__init__()
         if head_num is None:
             head_num = cfg.MODEL['TRANSFORMER_HEADS']
@@ -53,24 +55,27 @@ class TransFusion(nn.Module):
         self.mhas_dropout = nn.Dropout(dropout)
         self.ffn_dropout = nn.Dropout(dropout)
         self.trans_block = trans_block
+        # mha | sdpa | window, 见 model/attention.py; 三者共用同一组参数
+        self.attention_mode = attention_mode or cfg.MODEL['ATTENTION']
 
     def forward(self, inputs_1, inputs_2):
         b, c, h, w = inputs_1.shape
-        inputs_1 = self.linear_projection(inputs_1)
-        inputs_2 = self.linear_projection(inputs_2)
+        # 两个输入共用 linear_projection, 拼成一批只做一次卷积
+        inputs_1, inputs_2 = self.linear_projection(torch.cat([inputs_1, inputs_2], dim=0)).chunk(2, dim=0)
         inputs_1 = inputs_1.flatten(2).permute(0, 2, 1)  # b, hidden_c, h, w -> b, h*w, hidden_c
         inputs_2 = inputs_2.flatten(2).permute(0, 2, 1)  # b, hidden_c, h, w -> b, h*w, hidden_c
         inputs = torch.cat([inputs_1, inputs_2], dim=2)
         res = self.feature_transform(inputs)  # hidden_c * 2 -> hidden_c
         inputs = self.fusion_mhsa_norm(inputs)
-        inputs, _ = self.fusion_mhsa(self.input_norm(inputs_1), self.input_norm(inputs_2), inputs)  # hidden_c
+        inputs = efficient_attention(self.fusion_mhsa, self.input_norm(inputs_1), self.input_norm(inputs_2), inputs,
+                                     (h, w), self.attention_mode)  # hidden_c
         inputs = self.ffn_norm(inputs + res)
         res = inputs
         inputs = self.ffn(inputs) + res
         for _ in range(self.trans_block - 1):
             res = inputs
             inputs = self.mhsa_norm(inputs)
-            inputs, _ = self.mhsa(inputs, inputs, inputs)
+            inputs = efficient_attention(self.mhsa, inputs, inputs, inputs, (h, w), self.attention_mode)
             inputs = self.ffn_norm(inputs + res)
             res = inputs
             inputs = self.ffn(inputs) + res
@@ -0,0 +1,6 @@
+# coding=utf-8
+import os
+import sys
+
+# 测试在 astroyolo 目录下运行(python -m pytest tests), 模块均以 astroyolo 为根导入
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -0,0 +1,63 @@
+# coding=utf-8
+import torch
+
+from utils.batch_augment import BatchAugment, build_augmented_targets
+from utils.label_assign import build_batch_targets, collate_boxes
+
+IMG_SIZE = 64
+
+
+def _samples():
+    torch.manual_seed(0)
+    boxes = [
+        torch.tensor([[4.0, 4.0, 20.0, 24.0, 0.0], [30.0, 30.0, 60.0, 50.0, 0.0]]),
+        torch.tensor([[10.0, 12.0, 40.0, 44.0, 0.0]]),
+        torch.zeros((0, 5)),
+    ]
+    return [(torch.randint(0, 256, (3, IMG_SIZE, IMG_SIZE), dtype=torch.uint8), b) for b in boxes]
+
+
+def test_build_augmented_targets_matches_loader_output():
+    imgs, label_s, label_m, label_l, sbboxes, mbboxes, lbboxes = build_augmented_targets(
+        collate_boxes(_samples()), BatchAugment(), torch.device('cpu'), num_classes=1)
+    assert imgs.dtype == torch.float32 and imgs.shape == (3, 3, IMG_SIZE, IMG_SIZE)
+    assert 0.0 <= imgs.min() and imgs.max() <= 1.0
+    assert label_s.shape == (3, IMG_SIZE // 8, IMG_SIZE // 8, 3, 7)
+    assert label_m.shape == (3, IMG_SIZE // 16, IMG_SIZE // 16, 3, 7)
+    assert label_l.shape == (3, IMG_SIZE // 32, IMG_SIZE // 32, 3, 7)
+    assert sbboxes.shape[0] == mbboxes.shape[0] == lbboxes.shape[0] == 3
+    assert torch.isfinite(label_s).all() and torch.isfinite(label_m).all() and torch.isfinite(label_l).all()
+
+
+def test_build_augmented_targets_without_augmentation():
+    # 所有增强关闭时等价于 uint8 /255 后直接分配标签(mix 列为 1)
+    batch = collate_boxes(_samples())
+    augment = BatchAugment(flip_p=0.0, crop_p=0.0, translate_p=0.0, mixup_p=0.0)
+    out = build_augmented_targets(batch, augment, torch.device('cpu'), num_classes=1)
+    imgs, bboxes, valid = batch
+    bboxes = torch.cat([bboxes, torch.ones_like(bboxes[..., :1])], dim=-1)
+    expected = build_batch_targets(imgs.float() / 255.0, bboxes, valid, torch.device('cpu'), num_classes=1)
+    assert torch.allclose(out[0], expected[0], atol=1e-5)
+    for a, b in zip(out[1:], expected[1:]):
+        assert torch.allclose(a, b, atol=1e-4)
+
+
+def test_transformed_boxes_cover_warped_content():
+    # 黑底上每张图一个白色矩形, 翻转、裁剪、平移后白色区域应落在变换后的框内
+    torch.manual_seed(1)
+    batch_size = 8
+    imgs = torch.zeros((batch_size, 3, IMG_SIZE, IMG_SIZE), dtype=torch.uint8)
+    bboxes = torch.zeros((batch_size, 1, 5))
+    for i in range(batch_size):
+        x1, y1 = torch.randint(2, 30, (2,)).tolist()
+        w, h = torch.randint(8, 30, (2,)).tolist()
+        imgs[i, :, y1:y1 + h, x1:x1 + w] = 255
+        bboxes[i, 0, :4] = torch.tensor([x1, y1, x1 + w, y1 + h], dtype=torch.float32)
+    valid = torch.ones((batch_size, 1), dtype=torch.bool)
+    augment = BatchAugment(flip_p=1.0, crop_p=1.0, translate_p=1.0, mixup_p=0.0)
+    out, out_boxes, out_valid = augment(imgs, bboxes, valid)
+    assert out_valid[:, 0].all()
+    for i in range(batch_size):
+        ys, xs = (out[i, 0] > 0.8).nonzero(as_tuple=True)
+        content = torch.tensor([xs.min(), ys.min(), xs.max() + 1, ys.max() + 1], dtype=torch.float32)
+        assert torch.allclose(content, out_boxes[i, 0, :4], atol=1.5), (content, out_boxes[i, 0, :4])
@@ -0,0 +1,54 @@
+# coding=utf-8
+import os
+import time
+
+import numpy as np
+import pytest
+
+from utils.dataset_cache import DatasetCache, cache_dir_for, compile_dataset_cache
+from utils.datasets import BuildDataset
+
+IMG_SIZE = 32
+
+
+def _dataset(tmp_path, count=3):
+    lines = []
+    for i in range(count):
+        path = str(tmp_path / f'img_{i}.npy')
+        np.save(path, np.random.rand(IMG_SIZE, IMG_SIZE, 3).astype(np.float32))
+        lines.append(f'{path} 2,2,10,12,0\n')
+    anno_path = tmp_path / 'anno.txt'
+    anno_path.write_text(''.join(lines))
+    return BuildDataset('test', img_size=IMG_SIZE, anno_txt_path=str(anno_path), use_cache=False), lines
+
+
+def _cache_dir(dataset, root):
+    return cache_dir_for(dataset.annotations, IMG_SIZE, 'float32', str(root), dataset.source_files())
+
+
+def test_source_change_invalidates_cache(tmp_path):
+    dataset, lines = _dataset(tmp_path)
+    cache_dir = _cache_dir(dataset, tmp_path / 'cache')
+    compile_dataset_cache(dataset, cache_dir, 'float32', num_workers=2)
+    assert DatasetCache.exists(cache_dir) and len(DatasetCache(cache_dir)) == 3
+    assert _cache_dir(dataset, tmp_path / 'cache') == cache_dir
+
+    # 标注文本不变, 只改写图像
+    time.sleep(0.01)
+    path = lines[1].split(' ')[0]
+    np.save(path, np.zeros((IMG_SIZE, IMG_SIZE, 3), dtype=np.float32))
+    assert _cache_dir(dataset, tmp_path / 'cache') != cache_dir
+
+
+def test_load_failure_is_not_cached(tmp_path):
+    dataset, lines = _dataset(tmp_path)
+    with open(lines[2].split(' ')[0], 'wb') as f:
+        f.write(b'not a npy file')
+    cache_dir = _cache_dir(dataset, tmp_path / 'cache')
+    with pytest.raises(RuntimeError):
+        compile_dataset_cache(dataset, cache_dir, 'float32', num_workers=2)
+    assert not os.path.exists(cache_dir)
+    assert not os.listdir(tmp_path / 'cache')
+    # 不经缓存时仍以空白图像代替
+    img, bboxes = dataset.parse_sample(2)
+    assert not img.any() and len(bboxes) == 0
@@ -0,0 +1,45 @@
+# coding=utf-8
+import numpy as np
+
+from utils.evaluator import IOU_THRESHOLDS, greedy_match, match_detections
+
+
+def _sequential_match(iou, scores, thresholds):
+    """逐个检测的贪心匹配, 作为 greedy_match 的参照"""
+    matched = np.full((len(iou), len(thresholds)), -1)
+    for k, thresh in enumerate(thresholds):
+        taken = np.zeros(iou.shape[1], dtype=bool)
+        for i in np.argsort(-scores, kind='stable'):
+            ok = (iou[i] >= thresh) & ~taken
+            if ok.any():
+                j = int(np.where(ok, iou[i], -1.0).argmax())
+                matched[i, k], taken[j] = j, True
+    return matched
+
+
+def test_greedy_match_contention():
+    # 三个检测都最想要真值 0: 分数最高者得到它, 其余退而求其次或成为误检
+    iou = np.array([[0.9, 0.6], [0.8, 0.0], [0.95, 0.7]])
+    scores = np.array([0.9, 0.8, 0.7])
+    assert greedy_match(iou, scores, [0.5]).ravel().tolist() == [0, -1, 1]
+    assert greedy_match(iou, scores, [0.65]).ravel().tolist() == [0, -1, 1]
+    assert greedy_match(iou, scores, [0.75]).ravel().tolist() == [0, -1, -1]
+
+
+def test_greedy_match_matches_sequential():
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        num_det, num_gt = rng.integers(0, 30), rng.integers(0, 12)
+        iou = np.where(rng.random((num_det, num_gt)) < 0.3, rng.random((num_det, num_gt)), 0.0)
+        scores = np.round(rng.random(num_det), 1)  # 含相同分数
+        expected = _sequential_match(iou, scores, IOU_THRESHOLDS)
+        assert np.array_equal(greedy_match(iou, scores, IOU_THRESHOLDS), expected)
+
+
+def test_match_detections_requires_same_class():
+    det = np.array([[0, 0, 10, 10, 0.9, 1], [0, 0, 10, 10, 0.8, 0]], dtype=np.float32)
+    gt = np.array([[0, 0, 10, 10, 0]], dtype=np.float32)
+    tp = match_detections(det, gt)
+    assert tp.shape == (2, len(IOU_THRESHOLDS))
+    assert not tp[0].any() and tp[1].all()
+    assert match_detections(det[:0], gt).shape == (0, len(IOU_THRESHOLDS))
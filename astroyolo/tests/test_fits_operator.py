@@ -0,0 +1,50 @@
+# coding=utf-8
+import numpy as np
+from astropy.io import fits
+from astropy.wcs import WCS
+
+from utils.fits_operator import ReprojectionPlan, fits_wcs, read_fits_header, read_fits_image
+
+
+def _tan_wcs(shape, crval=(150.0, 2.0), scale=0.4 / 3600):
+    wcs = WCS(naxis=2)
+    wcs.wcs.ctype = ['RA---TAN', 'DEC--TAN']
+    wcs.wcs.crval = crval
+    wcs.wcs.crpix = [shape[1] / 2, shape[0] / 2]
+    wcs.wcs.cdelt = [-scale, scale]
+    return wcs
+
+
+def _fits_file(path, shape=(40, 50)):
+    image = fits.ImageHDU(np.random.rand(*shape).astype(np.float32), header=_tan_wcs(shape).to_header())
+    table = fits.BinTableHDU.from_columns([fits.Column(name='x', format='E', array=np.zeros(3))])
+    fits.HDUList([fits.PrimaryHDU(), table, image]).writeto(path)
+    return str(path)
+
+
+def test_header_matches_image_hdu(tmp_path):
+    path = _fits_file(tmp_path / 'frame.fits')
+    _, header = read_fits_image(path)
+    for source in (path, open(path, 'rb').read()):
+        assert read_fits_header(source) == header
+    wcs = fits_wcs(path)
+    assert wcs is not None and np.allclose(wcs.wcs.crval, [150.0, 2.0])
+    assert fits_wcs({'fits_paths': [str(tmp_path / 'missing.fits'), path], 'target_index': 1}) is not None
+
+
+def test_reprojection_plan_matches_reproject_interp():
+    # 目标帧相对源帧平移并旋转, 边缘半像素内的坐标也应与 reproject_interp 一致
+    from reproject import reproject_interp
+    shape = (60, 80)
+    source = _tan_wcs(shape).to_header()
+    target_wcs = _tan_wcs(shape)
+    target_wcs.wcs.crpix = [shape[1] / 2 + 2.7, shape[0] / 2 - 1.3]
+    angle = np.radians(2.0)
+    target_wcs.wcs.pc = [[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]]
+    target = target_wcs.to_header()
+    data = np.random.RandomState(0).rand(*shape).astype(np.float32)
+    expected, _ = reproject_interp((data, source), target, shape_out=shape)
+    out = ReprojectionPlan.build(source, target, shape, shape).apply(data)
+    assert np.isnan(expected).any()
+    assert np.array_equal(np.isnan(out), np.isnan(expected))
+    assert np.nanmax(np.abs(out - expected)) < 1e-4
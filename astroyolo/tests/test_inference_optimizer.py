@@ -0,0 +1,32 @@
+# coding=utf-8
+import copy
+
+import pytest
+import torch
+
+import config.model_config as cfg
+from model.model import BuildModel
+from utils.inference_optimizer import OptimizedModel, example_input, max_abs_diff, optimize_for_inference
+
+
+@pytest.fixture(scope='module')
+def eager():
+    torch.manual_seed(0)
+    return BuildModel().eval()
+
+
+def test_default_is_eager(eager):
+    assert cfg.INFERENCE["OPTIMIZE"] == 'none'
+    assert optimize_for_inference(eager, torch.device('cpu')) is eager
+
+
+@pytest.mark.parametrize('mode', ['fuse', 'torchscript'])
+def test_optimized_matches_eager(eager, mode):
+    """融合/冻结后的模型与 eager 模型的解码输出一致(随机权重下最大误差约 3e-5)"""
+    optimized = optimize_for_inference(copy.deepcopy(eager), torch.device('cpu'), mode)
+    if mode == 'torchscript':
+        assert isinstance(optimized, OptimizedModel)
+    torch.manual_seed(1)
+    diff, ok = max_abs_diff(eager, optimized, example_input(torch.device('cpu'), batch_size=2))
+    assert ok, f"max|diff|={diff:.3g}"
+    assert diff < 1e-3
@@ -0,0 +1,57 @@
+# coding=utf-8
+import os
+import threading
+import time
+
+from utils.job_queue import (JOB_FILE, TASK_INFO_FILE, COMPLETED, RUNNING, JobQueue, read_json,
+                             write_json_atomic)
+
+
+def _runner(task_dir, job):
+    with open(os.path.join(task_dir, 'runs'), 'a') as f:
+        f.write('run\n')
+    write_json_atomic(os.path.join(task_dir, TASK_INFO_FILE), {'status': COMPLETED})
+
+
+def _unfinished_task(output_dir, task_id='task_1'):
+    task_dir = os.path.join(output_dir, task_id)
+    os.makedirs(task_dir)
+    write_json_atomic(os.path.join(task_dir, JOB_FILE), {'inputs': []})
+    write_json_atomic(os.path.join(task_dir, TASK_INFO_FILE), {'task_id': task_id, 'status': RUNNING})
+    return task_dir
+
+
+def _wait_finished(task_dir, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if read_json(os.path.join(task_dir, TASK_INFO_FILE), {}).get('status') == COMPLETED:
+            return True
+        time.sleep(0.1)
+    return False
+
+
+def test_lazy_start_does_not_requeue(tmp_path):
+    task_dir = _unfinished_task(str(tmp_path))
+    queue = JobQueue(str(tmp_path), _runner).start()
+    try:
+        assert not _wait_finished(task_dir, timeout=3)
+    finally:
+        queue.stop()
+
+
+def test_concurrent_recover_runs_job_once(tmp_path):
+    task_dir = _unfinished_task(str(tmp_path))
+    queue = JobQueue(str(tmp_path), _runner, num_workers=2)
+    threads = [threading.Thread(target=queue.start, kwargs={'recover': True}) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    try:
+        assert queue.alive()
+        assert _wait_finished(task_dir)
+        time.sleep(1.0)
+        with open(os.path.join(task_dir, 'runs')) as f:
+            assert f.read().count('run') == 1
+    finally:
+        queue.stop()
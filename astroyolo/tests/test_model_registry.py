@@ -0,0 +1,41 @@
+# coding=utf-8
+import threading
+
+import torch
+
+from utils.model_registry import ModelRegistry, file_sha256
+
+
+def _weights(tmp_path, name, value):
+    path = tmp_path / name
+    torch.save({'weight': torch.full((4,), value)}, path)
+    return str(path)
+
+
+def _load(weight_path, device):
+    model = torch.nn.Linear(4, 1, bias=False)
+    model.weight.data = torch.load(weight_path)['weight'].view(1, 4)
+    return model.eval()
+
+
+def test_evicted_model_is_reloaded_and_keyed(tmp_path):
+    registry = ModelRegistry(_load, torch.device('cpu'), max_models=1, memory_budget_mb=0)
+    default, custom = _weights(tmp_path, 'default.pt', 1.0), _weights(tmp_path, 'custom.pt', 2.0)
+    first = registry.get(default)
+    registry.get(custom)
+    assert registry.key_of(first) is None  # 已被淘汰
+    again = registry.get(default)
+    assert again is not first and registry.key_of(again) == file_sha256(default)
+    assert len(registry.info()['loaded']) == 1
+
+
+def test_key_for_concurrent(tmp_path):
+    registry = ModelRegistry(_load, torch.device('cpu'))
+    path = _weights(tmp_path, 'w.pt', 3.0)
+    keys = []
+    threads = [threading.Thread(target=lambda: keys.append(registry.key_for(path))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert set(keys) == {file_sha256(path)}
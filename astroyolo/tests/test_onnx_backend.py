@@ -0,0 +1,53 @@
+# coding=utf-8
+import os
+
+import pytest
+import torch
+
+import config.model_config as cfg
+from model.model import BuildModel
+from utils.postprocess import split_batch_predictions
+
+ort = pytest.importorskip('onnxruntime')
+from utils.onnx_backend import OnnxModel, export_onnx, sample_inputs  # noqa: E402
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'sample_images')
+
+
+@pytest.fixture(scope='module')
+def exported(tmp_path_factory):
+    torch.manual_seed(0)
+    model = BuildModel().eval()
+    onnx_path = str(tmp_path_factory.mktemp('onnx') / 'model.onnx')
+    export_onnx(model, onnx_path)
+    return model, OnnxModel(onnx_path, torch.device('cpu'))
+
+
+def test_export_keeps_eval_mode(exported):
+    model, _ = exported
+    assert not any(m.training for m in model.modules())
+
+
+def test_export_restores_train_mode(tmp_path):
+    torch.manual_seed(0)
+    model = BuildModel().train()
+    export_onnx(model, str(tmp_path / 'model.onnx'))
+    assert all(m.training for m in model.modules())
+
+
+def test_onnx_matches_torch(exported):
+    """整批(动态批大小)与逐张两种批大小下, 解码输出都与 torch 模型一致(随机权重下最大误差约 3e-5)"""
+    model, onnx_model = exported
+    names, batch = sample_inputs(SAMPLE_DIR)
+    rtol, atol = cfg.INFERENCE["OPTIMIZE_TOL"]
+    img_size = cfg.VAL["TEST_IMG_SIZE"]
+    for batch_size in [len(names), 1]:
+        for i in range(0, len(names), batch_size):
+            x = batch[i:i + batch_size]
+            with torch.no_grad():
+                expected = split_batch_predictions(model(x)[1], len(x), img_size)
+            actual = split_batch_predictions(onnx_model(x)[1], len(x), img_size)
+            assert actual.shape == expected.shape
+            assert torch.allclose(expected, actual, rtol=rtol, atol=atol), \
+                f"{names[i]}: max|diff|={(expected - actual).abs().max().item():.3g}"
+
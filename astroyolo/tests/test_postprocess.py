@@ -0,0 +1,75 @@
+# coding=utf-8
+import torch
+
+from utils.postprocess import _blockwise_nms, box_iou, filter_detections, weighted_box_fusion
+
+
+def test_weighted_box_fusion_merges_views():
+    detections = torch.tensor([
+        [10.0, 10.0, 50.0, 50.0, 0.9, 0.0],
+        [12.0, 10.0, 52.0, 50.0, 0.6, 0.0],
+        [11.0, 10.0, 51.0, 50.0, 0.3, 1.0],  # 类别不同, 单独成簇
+        [200.0, 200.0, 240.0, 240.0, 0.8, 0.0],
+    ])
+    fused = weighted_box_fusion(detections, num_views=2)
+    assert len(fused) == 3
+    # 按簇首分数降序: 两个视图都检出的框保持平均分数, 只有一个视图检出的框分数减半
+    assert torch.allclose(fused[0], torch.tensor([10.8, 10.0, 50.8, 50.0, 0.75, 0.0]))
+    assert torch.allclose(fused[1], torch.tensor([200.0, 200.0, 240.0, 240.0, 0.4, 0.0]))
+    assert torch.allclose(fused[2], torch.tensor([11.0, 10.0, 51.0, 50.0, 0.15, 1.0]))
+
+
+def test_weighted_box_fusion_joins_overlapping_cluster():
+    # 第三个框与两个簇首都重叠, 只有与第二个簇首的 IoU 超过阈值
+    detections = torch.tensor([
+        [0.0, 0.0, 100.0, 100.0, 0.9, 0.0],
+        [60.0, 0.0, 160.0, 100.0, 0.8, 0.0],
+        [55.0, 0.0, 155.0, 100.0, 0.7, 0.0],
+    ])
+    fused = weighted_box_fusion(detections, num_views=2, iou_thresh=0.3)
+    assert len(fused) == 2
+    assert torch.allclose(fused[0], torch.tensor([0.0, 0.0, 100.0, 100.0, 0.45, 0.0]))
+    assert torch.allclose(fused[1, 0], torch.tensor((60.0 * 0.8 + 55.0 * 0.7) / 1.5))
+
+
+def test_weighted_box_fusion_trivial():
+    assert weighted_box_fusion(torch.zeros((0, 6)), 3).shape == (0, 6)
+    # 只被一个视图检出的框与其他单视图的簇一样按 1 / num_views 降权
+    single = torch.tensor([[1.0, 2.0, 3.0, 4.0, 0.6, 0.0]])
+    assert torch.allclose(weighted_box_fusion(single, 3), torch.tensor([[1.0, 2.0, 3.0, 4.0, 0.2, 0.0]]))
+
+
+def _greedy_nms(boxes, scores, iou_thresh):
+    order = scores.argsort(descending=True).tolist()
+    keep = []
+    while order:
+        i = order.pop(0)
+        keep.append(i)
+        iou = box_iou(boxes[i:i + 1], boxes[order])[0]
+        order = [j for j, v in zip(order, iou.tolist()) if v <= iou_thresh]
+    return torch.tensor(keep, dtype=torch.long)
+
+
+def test_blockwise_nms_matches_greedy():
+    g = torch.Generator().manual_seed(0)
+    xy = torch.rand(300, 2, generator=g) * 100
+    boxes = torch.cat([xy, xy + torch.rand(300, 2, generator=g) * 20 + 2], dim=1)
+    scores = torch.rand(300, generator=g)
+    # 块小于框数, 覆盖跨块抑制
+    assert torch.equal(_blockwise_nms(boxes, scores, 0.45, chunk=32), _greedy_nms(boxes, scores, 0.45))
+
+
+def test_filter_detections_per_image_topk():
+    box = [50.0, 50.0, 20.0, 20.0]
+    pred = torch.tensor([
+        [box + [0.9, 1.0], box + [0.8, 1.0], [150.0, 150.0, 20.0, 20.0, 0.7, 1.0]],
+        [box + [0.6, 1.0], [200.0, 200.0, 20.0, 20.0, 0.5, 1.0], [250.0, 250.0, 20.0, 20.0, 0.4, 1.0]],
+    ])
+    # 同一位置的框只在同一张图内互相抑制
+    dets = filter_detections(pred, 0.1, 0.45, pre_nms_topk=0)
+    assert [len(d) for d in dets] == [2, 3]
+    assert torch.allclose(dets[1][:, 4], torch.tensor([0.6, 0.5, 0.4]))
+    # 每张图只有分数最高的两个候选框参与 NMS
+    dets = filter_detections(pred, 0.1, 0.45, pre_nms_topk=2)
+    assert [len(d) for d in dets] == [1, 2]
+    assert torch.allclose(dets[1][:, 4], torch.tensor([0.6, 0.5]))
@@ -0,0 +1,49 @@
+# coding=utf-8
+import copy
+import os
+
+import numpy as np
+import torch
+
+import config.model_config as cfg
+from model.model import BuildModel
+from utils.evaluator import ap50_by_size, size_bin
+from utils.onnx_backend import sample_inputs
+from utils.quantization import (QUANTIZED_SUFFIX, QuantizedModel, load_quantized_model, quantize_model,
+                                save_quantized_model, serialized_nbytes)
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'sample_images')
+
+
+def test_quantize_save_load(tmp_path):
+    """FX 量化(卷积 padding 为整数)、保存为 *.int8.pt 并重新加载, 输出形状与浮点模型相同"""
+    torch.manual_seed(0)
+    model = BuildModel().eval()
+    _, batch = sample_inputs(SAMPLE_DIR)
+    quant_model = quantize_model(copy.deepcopy(model), [batch])
+    path = str(tmp_path / f'model{QUANTIZED_SUFFIX}')
+    save_quantized_model(quant_model, path)
+
+    loaded = load_quantized_model(path, 'cpu')
+    assert isinstance(loaded, QuantizedModel)
+    assert serialized_nbytes(loaded) == os.path.getsize(path)
+    assert serialized_nbytes(loaded) < serialized_nbytes(model)
+    x = batch[:2]
+    with torch.no_grad():
+        assert loaded(x)[1].shape == model(x)[1].shape
+
+
+def test_size_bin():
+    boxes = np.array([[0, 0, 10, 10], [0, 0, 40, 40], [0, 0, 200, 100]], dtype=np.float32)
+    assert list(size_bin(boxes)) == ['small', 'medium', 'large']
+
+
+def test_ap50_by_size_with_detector():
+    img_size = cfg.VAL["TEST_IMG_SIZE"]
+    gt = np.array([[10, 10, 20, 20, 0], [50, 50, 150, 150, 0]], dtype=np.float32)
+    det = torch.tensor([[10, 10, 20, 20, 0.9, 0], [50, 50, 150, 150, 0.8, 0], [200, 200, 240, 240, 0.7, 0]])
+    imgs = torch.zeros((1, 3, img_size, img_size))
+    ap = ap50_by_size(None, [(imgs, [gt])], detector=lambda x: [det])
+    assert ap['small'] == ap['large'] == 1.0
+    assert ap['all'] == 1.0  # 误检的分数低于所有命中
+    assert np.isnan(ap['medium'])  # 没有该尺寸的真值
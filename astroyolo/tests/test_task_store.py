@@ -0,0 +1,49 @@
+# coding=utf-8
+import sqlite3
+
+from utils.task_store import TaskStore
+
+
+def _task(i, files, detections, status='completed'):
+    return {'task_id': f'task_{i}', 'timestamp': float(i), 'status': status,
+            'files_count': files, 'detection_count': detections}
+
+
+def test_totals_follow_upserts(tmp_path):
+    store = TaskStore(str(tmp_path / 'index.sqlite'))
+    for i in range(5):
+        store.upsert(_task(i, 2, i))
+    store.upsert(_task(3, 4, 10, status='failed'))  # 更新已有任务只计差值
+    assert store.totals() == {'total_tasks': 5, 'total_files': 12, 'total_detections': 17}
+
+    _, _, stats = store.list(page_size=2, with_stats=True)
+    assert stats == store.totals()
+    _, _, stats = store.list(page_size=2, status='failed', with_stats=True)
+    assert stats == {'total_tasks': 1, 'total_files': 4, 'total_detections': 10}
+    assert store.list(page_size=2)[2] is None
+
+
+def test_totals_initialized_for_existing_index(tmp_path):
+    path = str(tmp_path / 'index.sqlite')
+    store = TaskStore(path)
+    for i in range(3):
+        store.upsert(_task(i, 1, 5))
+    # 模拟没有合计记录的旧索引
+    with sqlite3.connect(path) as conn:
+        conn.execute("DELETE FROM meta")
+        conn.execute("DROP TRIGGER tasks_totals_insert")
+    assert TaskStore(path).totals() == {'total_tasks': 3, 'total_files': 3, 'total_detections': 15}
+
+
+def test_keyset_pages_cover_all_tasks(tmp_path):
+    store = TaskStore(str(tmp_path / 'index.sqlite'))
+    for i in range(7):
+        store.upsert(_task(i, 1, i % 3))
+    for order in ('newest', 'oldest', 'detections'):
+        seen, cursor = [], None
+        while True:
+            tasks, cursor, _ = store.list(page_size=3, cursor=cursor, order=order)
+            seen += [t['task_id'] for t in tasks]
+            if cursor is None:
+                break
+        assert sorted(seen) == sorted(f'task_{i}' for i in range(7)) and len(seen) == 7
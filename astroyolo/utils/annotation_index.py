@@ -0,0 +1,241 @@
+# coding=utf-8
+import hashlib
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append("..")
+import numpy as np
+
+import config.model_config as cfg
+
+INDEX_VERSION = 1
+XML_DIR = os.path.join(cfg.DATA_PATH, 'VOCdevkit', 'VOC2007', 'Annotations')
+CHUNK_SIZE = 256  # 每个子进程任务解析的 XML 个数, 减少进程间通信次数
+
+
+def parse_voc_xml(xml_path):
+    """
+    :return: (filename, (width, height), [(name, xmin, ymin, xmax, ymax), ...]), 解析失败时为 None;
+             单个目标坐标解析失败时跳过该目标; 尺寸缺失时为 (-1, -1)
+    """
+    try:
+        root = ET.parse(xml_path).getroot()
+    except Exception as e:
+        print(f"[警告] 解析xml失败，已跳过：{xml_path}，错误：{e}")
+        return None
+    filename = root.findtext('filename') or ''
+    try:
+        size = root.find('size')
+        wh = (int(float(size.findtext('width'))), int(float(size.findtext('height'))))
+    except Exception:
+        wh = (-1, -1)
+    objects = []
+    for obj in root.findall('object'):
+        bbox = obj.find('bndbox')
+        try:
+            objects.append((obj.findtext('name') or '',
+                            *(float(bbox.find(tag).text) for tag in ('xmin', 'ymin', 'xmax', 'ymax'))))
+        except Exception as e:
+            detail = ET.tostring(bbox, encoding='unicode') if bbox is not None else ''
+            print(f"[警告] 坐标解析失败，已跳过：{xml_path}，内容：{detail}，错误：{e}")
+    return filename, wh, objects
+
+
+def _parse_chunk(paths):
+    return [parse_voc_xml(path) for path in paths]
+
+
+def _index_path(xml_dir, root=None):
+    root = root or cfg.TRAIN['DATASET_CACHE_DIR']
+    digest = hashlib.sha1(os.path.abspath(xml_dir).encode('utf-8')).hexdigest()[:12]
+    return os.path.join(root, f'voc_index_{digest}.npz')
+
+
+class AnnotationIndex(object):
+    """
+    VOC Annotations 目录的标注索引, 所有 XML 解析一次后存为一个 npz:
+    stems/filenames/sizes 每个 XML 一项, boxes [M, 4] 与 labels [M](class_names 的下标)为全部目标拼接,
+    第 i 个 XML 的目标为 offsets[i]:offsets[i+1]; mtimes/file_sizes 用于失效判断.
+    load 时只扫描目录的 stat 信息, 新增或修改过(mtime、文件大小变化)的 XML 多进程重新解析, 已删除的移除.
+    """
+
+    def __init__(self, xml_dir, arrays):
+        self.xml_dir = xml_dir
+        self.stems = arrays['stems']
+        self.filenames = arrays['filenames']
+        self.sizes = arrays['sizes']
+        self.valid = arrays['valid']
+        self.offsets = arrays['offsets']
+        self.boxes = arrays['boxes']
+        self.labels = arrays['labels']
+        self.class_names = [str(name) for name in arrays['class_names']]
+        self.mtimes = arrays['mtimes']
+        self.file_sizes = arrays['file_sizes']
+        self.__rows = {str(stem): i for i, stem in enumerate(self.stems)}
+
+    def __len__(self):
+        return len(self.stems)
+
+    def __contains__(self, stem):
+        return stem in self.__rows
+
+    def get(self, stem):
+        """
+        :return: (filename, (width, height), boxes [k, 4] float32, names list), XML 不存在或解析失败时为 None
+        """
+        i = self.__rows.get(stem)
+        if i is None or not self.valid[i]:
+            return None
+        lo, hi = self.offsets[i], self.offsets[i + 1]
+        return (str(self.filenames[i]), tuple(int(v) for v in self.sizes[i]), self.boxes[lo:hi],
+                [self.class_names[label] for label in self.labels[lo:hi]])
+
+    def bboxes(self, stem, class_to_id):
+        """
+        :param class_to_id: {类别名: 类别序号}, 不在其中的目标被丢弃
+        :return: [k, 5] float32 (xmin, ymin, xmax, ymax, class_ind), 无记录时为 None
+        """
+        record = self.get(stem)
+        if record is None:
+            return None
+        _, _, boxes, names = record
+        keep = [j for j, name in enumerate(names) if name in class_to_id]
+        out = np.empty((len(keep), 5), dtype=np.float32)
+        out[:, :4] = boxes[keep]
+        out[:, 4] = [class_to_id[names[j]] for j in keep]
+        return out
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp.npz'
+        np.savez(tmp_path, version=INDEX_VERSION, xml_dir=os.path.abspath(self.xml_dir), stems=self.stems,
+                 filenames=self.filenames, sizes=self.sizes, valid=self.valid, offsets=self.offsets,
+                 boxes=self.boxes, labels=self.labels, class_names=np.array(self.class_names, dtype=str),
+                 mtimes=self.mtimes, file_sizes=self.file_sizes)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _read(path):
+        try:
+            with np.load(path) as data:
+                if int(data['version']) != INDEX_VERSION:
+                    return None
+                return {name: data[name] for name in data.files}
+        except Exception:
+            return None
+
+    @classmethod
+    def load(cls, xml_dir=None, index_path=None, workers=None):
+        """
+        读取索引并与目录同步, 有变化时写回
+        :param xml_dir: 默认 dataset/VOCdevkit/VOC2007/Annotations
+        :param index_path: 默认 DATASET_CACHE_DIR 下按目录绝对路径命名的 npz
+        :param workers: 解析进程数, 默认 TRAIN['NUMBER_WORKERS']
+        """
+        xml_dir = xml_dir or XML_DIR
+        index_path = index_path or _index_path(xml_dir)
+        workers = workers or cfg.TRAIN['NUMBER_WORKERS']
+        start = time.time()
+
+        entries = sorted((e for e in os.scandir(xml_dir) if e.name.endswith('.xml') and e.is_file()),
+                         key=lambda e: e.name)
+        stems = [e.name[:-4] for e in entries]
+        stats = [e.stat() for e in entries]
+        mtimes = np.array([s.st_mtime_ns for s in stats], dtype=np.int64)
+        file_sizes = np.array([s.st_size for s in stats], dtype=np.int64)
+
+        old = cls._read(index_path) if os.path.exists(index_path) else None
+        old_rows = {}
+        if old is not None:
+            old_rows = {str(stem): i for i, stem in enumerate(old['stems'])}
+        reuse = np.full(len(stems), -1, dtype=np.int64)
+        for i, stem in enumerate(stems):
+            j = old_rows.get(stem)
+            if j is not None and old['mtimes'][j] == mtimes[i] and old['file_sizes'][j] == file_sizes[i]:
+                reuse[i] = j
+        stale = np.flatnonzero(reuse < 0)
+        if old is not None and not len(stale) and len(stems) == len(old_rows):
+            return cls(xml_dir, old)
+
+        paths = [entries[i].path for i in stale]
+        chunks = [paths[i:i + CHUNK_SIZE] for i in range(0, len(paths), CHUNK_SIZE)]
+        # DataLoader 的 worker 是守护进程, 不能再创建子进程, 此时在当前进程内解析
+        if len(chunks) > 1 and workers > 1 and not multiprocessing.current_process().daemon:
+            # 可能在 compile_dataset_cache 的线程池中被调用, 不能 fork 多线程的进程
+            spawn = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(min(workers, len(chunks)), mp_context=spawn) as pool:
+                parsed = [record for chunk in pool.map(_parse_chunk, chunks) for record in chunk]
+        else:
+            parsed = _parse_chunk(paths)
+        parsed = dict(zip(stale.tolist(), parsed))
+
+        class_names = [str(name) for name in old['class_names']] if old is not None else []
+        class_ids = {name: i for i, name in enumerate(class_names)}
+        filenames, sizes, valid, counts, boxes, labels = [], [], [], [], [], []
+        for i in range(len(stems)):
+            j = reuse[i]
+            if j >= 0:
+                lo, hi = old['offsets'][j], old['offsets'][j + 1]
+                filenames.append(str(old['filenames'][j]))
+                sizes.append(old['sizes'][j])
+                valid.append(bool(old['valid'][j]))
+                boxes.append(old['boxes'][lo:hi])
+                labels.append(old['labels'][lo:hi])
+                counts.append(hi - lo)
+                continue
+            record = parsed[i]
+            filename, wh, objects = record if record is not None else ('', (-1, -1), [])
+            for name, *_ in objects:
+                if name not in class_ids:
+                    class_ids[name] = len(class_names)
+                    class_names.append(name)
+            filenames.append(filename)
+            sizes.append(wh)
+            valid.append(record is not None)
+            boxes.append(np.array([obj[1:] for obj in objects], dtype=np.float32).reshape(-1, 4))
+            labels.append(np.array([class_ids[obj[0]] for obj in objects], dtype=np.int16))
+            counts.append(len(objects))
+
+        offsets = np.zeros(len(stems) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(counts)
+        arrays = {
+            'stems': np.array(stems, dtype=str),
+            'filenames': np.array(filenames, dtype=str),
+            'sizes': np.array(sizes, dtype=np.int32).reshape(-1, 2),
+            'valid': np.array(valid, dtype=bool),
+            'offsets': offsets,
+            'boxes': np.concatenate(boxes) if boxes else np.empty((0, 4), dtype=np.float32),
+            'labels': np.concatenate(labels) if labels else np.empty(0, dtype=np.int16),
+            'class_names': np.array(class_names, dtype=str),
+            'mtimes': mtimes,
+            'file_sizes': file_sizes,
+        }
+        index = cls(xml_dir, arrays)
+        index.save(index_path)
+        print(f"标注索引: {len(stems)} 个 XML, 重新解析 {len(paths)} 个, 用时 {time.time() - start:.1f}s -> {index_path}")
+        return index
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def shared_index(xml_dir=None):
+    """进程内共享的索引, 同一目录只加载(与同步)一次; 目录不存在时为 None"""
+    xml_dir = os.path.abspath(xml_dir or XML_DIR)
+    with _shared_lock:  # compile_dataset_cache 在线程池中并发调用 parse_sample
+        if xml_dir not in _shared:
+            _shared[xml_dir] = AnnotationIndex.load(xml_dir) if os.path.isdir(xml_dir) else None
+        return _shared[xml_dir]
+
+
+if __name__ == "__main__":
+    # 在 astroyolo 目录下运行: python -m utils.annotation_index [xml_dir]
+    index = AnnotationIndex.load(sys.argv[1] if len(sys.argv) > 1 else None)
+    print(f"{len(index)} 个 XML, {len(index.boxes)} 个目标, 类别 {index.class_names}, "
+          f"解析失败 {int((~index.valid).sum())} 个")
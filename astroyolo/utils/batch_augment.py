@@ -0,0 +1,231 @@
+# coding=utf-8
+import sys
+import time
+
+sys.path.append("..")
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from utils.label_assign import build_batch_targets
+
+FILL = 128  # 与 data_augment.Resize 的填充值一致
+
+
+def _eye(batch_size, device):
+    return torch.eye(3, device=device).repeat(batch_size, 1, 1)
+
+
+def _union_boxes(bboxes, valid, width, height):
+    """
+    每个样本所有有效框的外接框 [B, 4], 没有有效框的样本取整幅图
+    """
+    inf = torch.tensor(float('inf'), device=bboxes.device)
+    x1 = torch.where(valid, bboxes[..., 0], inf).amin(1)
+    y1 = torch.where(valid, bboxes[..., 1], inf).amin(1)
+    x2 = torch.where(valid, bboxes[..., 2], -inf).amax(1)
+    y2 = torch.where(valid, bboxes[..., 3], -inf).amax(1)
+    union = torch.stack([x1, y1, x2, y2], dim=1)
+    full = torch.tensor([0.0, 0.0, width, height], device=bboxes.device)
+    union = torch.where(valid.any(1, keepdim=True), union, full)
+    return torch.minimum(torch.maximum(union, torch.zeros_like(full)), full)
+
+
+def _apply(matrix, union):
+    """把 [B, 4] 的框按 [B, 3, 3] 仿射矩阵(只含翻转、缩放、平移)变换, 结果仍为 (xmin, ymin, xmax, ymax)"""
+    xs = union[:, [0, 2]] * matrix[:, 0, 0, None] + matrix[:, 0, 2, None]
+    ys = union[:, [1, 3]] * matrix[:, 1, 1, None] + matrix[:, 1, 2, None]
+    return torch.stack([xs.amin(1), ys.amin(1), xs.amax(1), ys.amax(1)], dim=1)
+
+
+class BatchAugment(object):
+    """
+    data_augment 中 RandomHorizontalFilp / RandomCrop / RandomAffine / Resize / Mixup 的整批版本:
+    1、每个样本的翻转、裁剪(保持比例缩放回原尺寸并居中填充)、随机平移合成一个仿射矩阵, 整批只做一次 grid_sample;
+       随机平移对应 data_augment.RandomAffine, 与它一样不含缩放和旋转;
+    2、图像以 uint8 传入(DataLoader 只搬运 uint8), 在 grid_sample 时才转为浮点并归一化到 [0, 1];
+    3、框用同一矩阵变换后裁剪到图像内, 宽或高小于 min_size 的框置为无效;
+    4、Mixup 在批内与相邻样本配对, 框后追加混合权重列, 与逐样本 Mixup 的输出格式一致.
+    默认只做 Mixup, 与 BuildDataset 的逐样本流程一致(其中翻转、裁剪、平移已注释掉); 其余增强需显式给出概率.
+    设备取 device, 为 None 时与输入相同. 训练循环中的用法见 build_augmented_targets.
+    """
+
+    def __init__(self, flip_p=0.0, crop_p=0.0, translate_p=0.0, mixup_p=0.5, min_size=2.0, device=None):
+        self.flip_p = flip_p
+        self.crop_p = crop_p
+        self.translate_p = translate_p
+        self.mixup_p = mixup_p
+        self.min_size = min_size
+        self.device = device
+
+    def sample_matrices(self, bboxes, valid, width, height):
+        """
+        :return: [B, 3, 3] 正向仿射矩阵(输入像素坐标 -> 输出像素坐标), 以及是否有任何变换 [B]
+        """
+        batch_size, device = len(bboxes), bboxes.device
+        union = _union_boxes(bboxes, valid, width, height)
+        matrix = _eye(batch_size, device)
+
+        flip = torch.rand(batch_size, device=device) < self.flip_p
+        step = _eye(batch_size, device)
+        step[flip, 0, 0] = -1.0
+        step[flip, 0, 2] = width
+        matrix, union = step @ matrix, _apply(step, union)
+
+        # 裁剪: 在外接框与图像边界之间随机取裁剪区域, 按比例缩放回原尺寸并居中
+        crop = torch.rand(batch_size, device=device) < self.crop_p
+        r = torch.rand((batch_size, 4), device=device)
+        cx1, cy1 = union[:, 0] * (1 - r[:, 0]), union[:, 1] * (1 - r[:, 1])
+        cx2 = union[:, 2] + (width - union[:, 2]) * r[:, 2]
+        cy2 = union[:, 3] + (height - union[:, 3]) * r[:, 3]
+        scale = torch.minimum(width / (cx2 - cx1).clamp(min=1.0), height / (cy2 - cy1).clamp(min=1.0))
+        step = _eye(batch_size, device)
+        step[:, 0, 0] = step[:, 1, 1] = scale
+        step[:, 0, 2] = (width - (cx2 - cx1) * scale) / 2 - cx1 * scale
+        step[:, 1, 2] = (height - (cy2 - cy1) * scale) / 2 - cy1 * scale
+        step[~crop] = torch.eye(3, device=device)
+        matrix, union = step @ matrix, _apply(step, union)
+
+        # 平移(即 RandomAffine): 平移量保证外接框不移出图像
+        translate = torch.rand(batch_size, device=device) < self.translate_p
+        r = torch.rand((batch_size, 2), device=device)
+        lo_x, hi_x = -(union[:, 0] - 1), width - union[:, 2] - 1
+        lo_y, hi_y = -(union[:, 1] - 1), height - union[:, 3] - 1
+        step = _eye(batch_size, device)
+        step[:, 0, 2] = torch.where(translate & (hi_x > lo_x), lo_x + (hi_x - lo_x) * r[:, 0], torch.zeros_like(lo_x))
+        step[:, 1, 2] = torch.where(translate & (hi_y > lo_y), lo_y + (hi_y - lo_y) * r[:, 1], torch.zeros_like(lo_y))
+        matrix = step @ matrix
+        return matrix, flip | crop | translate
+
+    @staticmethod
+    def warp(imgs, matrix):
+        """
+        :param imgs: [n, 3, H, W] 浮点, 0~255
+        :param matrix: [n, 3, 3] 正向仿射矩阵
+        :return: [n, 3, H, W], 图像外的区域填充 FILL
+        """
+        n, _, height, width = imgs.shape
+        # 像素坐标 <-> grid_sample 的归一化坐标(align_corners=False)
+        norm = torch.tensor([[2.0 / width, 0, -1], [0, 2.0 / height, -1], [0, 0, 1]], device=imgs.device)
+        theta = norm @ torch.linalg.inv(matrix) @ torch.linalg.inv(norm)
+        grid = F.affine_grid(theta[:, :2], (n, 3, height, width), align_corners=False)
+        return F.grid_sample(imgs - FILL, grid, mode='bilinear', padding_mode='zeros', align_corners=False) + FILL
+
+    def transform_boxes(self, bboxes, valid, matrix, width, height):
+        out = bboxes.clone()
+        xs = bboxes[..., [0, 2]] * matrix[:, None, 0, 0, None] + matrix[:, None, 0, 2, None]
+        ys = bboxes[..., [1, 3]] * matrix[:, None, 1, 1, None] + matrix[:, None, 1, 2, None]
+        out[..., 0], out[..., 2] = xs.amin(-1).clamp(0, width), xs.amax(-1).clamp(0, width)
+        out[..., 1], out[..., 3] = ys.amin(-1).clamp(0, height), ys.amax(-1).clamp(0, height)
+        keep = ((out[..., 2] - out[..., 0]) >= self.min_size) & ((out[..., 3] - out[..., 1]) >= self.min_size)
+        return out, valid & keep
+
+    def mixup(self, imgs, bboxes, valid):
+        """
+        :return: imgs, bboxes [B, 2K, 6], valid [B, 2K]; 未混合的样本权重为 1, 配对样本的框无效
+        """
+        batch_size, device = len(imgs), imgs.device
+        lam = torch.ones(batch_size, device=device)
+        mixed = torch.zeros(batch_size, dtype=torch.bool, device=device)
+        if batch_size > 1 and self.mixup_p > 0:
+            mixed = torch.rand(batch_size, device=device) < self.mixup_p
+            beta = torch.distributions.Beta(torch.tensor(1.5, device=device), torch.tensor(1.5, device=device))
+            lam = torch.where(mixed, beta.sample((batch_size,)), lam)
+        pair = torch.roll(torch.arange(batch_size, device=device), 1)
+        if mixed.any():
+            imgs = torch.lerp(imgs[pair], imgs, lam[:, None, None, None])
+        weights = lam[:, None, None].expand(-1, bboxes.shape[1], 1)
+        bboxes = torch.cat([torch.cat([bboxes, weights], dim=-1), torch.cat([bboxes[pair], 1 - weights], dim=-1)], 1)
+        valid = torch.cat([valid, valid[pair] & mixed[:, None]], dim=1)
+        return imgs, bboxes, valid
+
+    def __call__(self, imgs, bboxes, valid):
+        """
+        :param imgs: [B, 3, S, S] uint8(0~255) 或浮点(0~1)
+        :param bboxes: [B, K, 5] (xmin, ymin, xmax, ymax, class_ind), 输入图像像素坐标
+        :param valid: [B, K] bool
+        :return: (imgs [B, 3, S, S] float32 0~1, bboxes [B, 2K, 6], valid [B, 2K]), 可直接交给
+                 label_assign.build_batch_targets
+        """
+        device = self.device or imgs.device
+        imgs = imgs.to(device, non_blocking=True)
+        bboxes = bboxes.to(device, non_blocking=True).float()
+        valid = valid.to(device, non_blocking=True)
+        height, width = imgs.shape[-2:]
+        if imgs.dtype == torch.uint8:
+            imgs = imgs.float()
+        else:
+            imgs = imgs.float() * 255.0
+
+        matrix, moved = self.sample_matrices(bboxes, valid, float(width), float(height))
+        if moved.any():
+            imgs[moved] = self.warp(imgs[moved], matrix[moved])
+        imgs = imgs.div_(255.0)
+        bboxes, valid = self.transform_boxes(bboxes, valid, matrix, width, height)
+        return self.mixup(imgs, bboxes, valid)
+
+
+def build_augmented_targets(batch, augment, device, img_size=None, num_classes=None):
+    """
+    BATCH_AUGMENT 训练时每个批次的入口: collate_boxes 的输出 -> 搬运 uint8 图像到 device -> 整批增强 -> 整批标签分配.
+    Dataset 为 BuildDataset(..., assign_labels=False, batch_augment=True), DataLoader 的 collate_fn 为
+    label_assign.collate_boxes, 训练循环中:
+        augment = BatchAugment()
+        for batch in loader:
+            imgs, label_sbbox, label_mbbox, label_lbbox, sbboxes, mbboxes, lbboxes = \
+                build_augmented_targets(batch, augment, device)
+    :param batch: (imgs [B, 3, S, S] uint8, bboxes [B, K, 5], valid [B, K])
+    :return: 与逐样本 DataLoader 相同的 7 元组, 均在 device 上
+    """
+    imgs, bboxes, valid = batch
+    imgs, bboxes, valid = augment(imgs.to(device, non_blocking=True), bboxes, valid)
+    return build_batch_targets(imgs, bboxes, valid, device, img_size, num_classes)
+
+
+def to_uint8(img):
+    """[0, 1] 浮点图像(Resize 的输出)转为 uint8, 已是 uint8 时原样返回"""
+    if img.dtype == np.uint8:
+        return img
+    return (np.clip(img, 0.0, 1.0) * 255.0 + 0.5).astype(np.uint8)
+
+
+def benchmark(batch_size=16, img_size=352, num_boxes=8, runs=10):
+    """逐样本 NumPy/OpenCV 流程(Resize + Mixup, 与 BuildDataset 一致)与 BatchAugment 的每批耗时对比"""
+    import utils.data_augment as dataAug
+
+    rng = np.random.default_rng(0)
+    raw = rng.integers(0, 256, (batch_size, img_size, img_size, 3), dtype=np.uint8)
+    xy = rng.uniform(0, img_size * 0.7, (batch_size, num_boxes, 2))
+    wh = rng.uniform(8, img_size * 0.3, (batch_size, num_boxes, 2))
+    boxes = np.concatenate([xy, xy + wh, np.zeros((batch_size, num_boxes, 1))], axis=-1).astype(np.float32)
+
+    start = time.perf_counter()
+    for _ in range(runs):
+        for i in range(batch_size):
+            img, bb = dataAug.Resize((img_size, img_size), True)(np.copy(raw[i]), np.copy(boxes[i]))
+            j = (i + 1) % batch_size
+            dataAug.Mixup()(img.transpose(2, 0, 1), bb, raw[j].transpose(2, 0, 1) / 255.0, boxes[j])
+    print(f"{'numpy per-sample':>18} {(time.perf_counter() - start) / runs * 1000:>9.2f} ms/batch")
+
+    devices = ['cpu'] + (['cuda'] if torch.cuda.is_available() else [])
+    augment = BatchAugment()
+    imgs = torch.from_numpy(raw).permute(0, 3, 1, 2).contiguous()
+    bboxes = torch.from_numpy(boxes)
+    valid = torch.ones((batch_size, num_boxes), dtype=torch.bool)
+    for device in devices:
+        augment.device = torch.device(device)
+        augment(imgs, bboxes, valid)  # 预热
+        if device == 'cuda':
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        for _ in range(runs):
+            augment(imgs, bboxes, valid)
+        if device == 'cuda':
+            torch.cuda.synchronize()
+        print(f"{'batch ' + device:>18} {(time.perf_counter() - start) / runs * 1000:>9.2f} ms/batch "
+              f"(含 uint8 拷贝到设备)")
+
+
+if __name__ == "__main__":
+    # 在 astroyolo 目录下运行: python -m utils.batch_augment [batch_size] [img_size]
+    benchmark(*(int(a) for a in sys.argv[1:3]))
@@ -0,0 +1,113 @@
+# coding=utf-8
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append("..")
+import numpy as np
+import torch
+
+import config.model_config as cfg
+from utils.postprocess import filter_detections, split_batch_predictions
+
+
+class BatchInferenceEngine(object):
+    """
+    批量推理引擎:
+    1、线程池并行预处理(解码/缩放), 下一个微批的预处理与当前微批的前向重叠;
+    2、把微批堆叠为固定尺寸 [batch_size, 3, H, W] 的张量(不足时补零), 每个微批只做一次前向;
+    3、置信度过滤、坐标转换与 NMS 在整个微批上向量化完成.
+    """
+
+    def __init__(self, model, device, preprocess_fn, batch_size=None, num_workers=None):
+        """
+        :param model: eval 模式的 BuildModel
+        :param device: torch.device
+        :param preprocess_fn: (image_data, image_type) -> (original_img_bgr, resized_img_rgb, original_shape)
+        """
+        self.model = model
+        self.device = torch.device(device) if isinstance(device, str) else device
+        self.preprocess_fn = preprocess_fn
+        self.batch_size = batch_size or cfg.INFERENCE["BATCH_SIZE"]
+        self.num_workers = num_workers or cfg.INFERENCE["NUM_WORKERS"]
+        self.img_size = cfg.VAL["TEST_IMG_SIZE"]
+        self.__buffer = None
+
+    def __preprocess_one(self, item):
+        try:
+            return self.preprocess_fn(*item)
+        except Exception as e:
+            return e
+
+    def __input_buffer(self):
+        # 固定尺寸的输入缓冲区, GPU 上使用锁页内存以便异步拷贝
+        if self.__buffer is None:
+            buffer = torch.zeros((self.batch_size, self.img_size, self.img_size, 3), dtype=torch.uint8)
+            if self.device.type == "cuda":
+                buffer = buffer.pin_memory()
+            self.__buffer = buffer
+        return self.__buffer
+
+    def forward(self, images):
+        """
+        :param images: list of [H, W, 3] uint8 RGB, len(images) <= batch_size
+        :return: [len(images), num_boxes, 5+num_classes] 解码后的预测(输入图尺度)
+        """
+        n = len(images)
+        buffer = self.__input_buffer()
+        buffer.zero_()
+        buffer[:n] = torch.from_numpy(np.stack(images))
+        batch = buffer.to(self.device, non_blocking=True).permute(0, 3, 1, 2).float().div_(255.0)
+        with torch.no_grad():
+            _, p_d = self.model(batch)
+        return split_batch_predictions(p_d, self.batch_size, self.img_size)[:n]
+
+    def decode(self, pred, original_shapes, conf_thresh=0.3, nms_thresh=0.9):
+        """
+        整个微批一次完成置信度过滤、坐标转换、裁剪与 NMS(见 utils.postprocess), 再按图缩放回原图.
+        :param pred: [n, num_boxes, 5+num_classes] 或 SparsePredictions
+        :param original_shapes: list of (h, w)
+        :return: list of np.ndarray [k, 6] (x1, y1, x2, y2, score, class)
+        """
+        detections = filter_detections(pred, conf_thresh, nms_thresh, class_agnostic=True, clip_size=self.img_size)
+        shapes = torch.tensor(original_shapes, dtype=torch.float32)  # [n, (h, w)]
+        scales = (shapes.flip(-1) / self.img_size).repeat(1, 2)  # [n, (w, h, w, h)]
+        results = []
+        for det, scale in zip(detections, scales):
+            det[:, :4] *= scale.to(det)
+            results.append(det.cpu().numpy())
+        return results
+
+    def run(self, items, conf_thresh=0.3):
+        """
+        :param items: list of (image_data, image_type)
+        :return: 生成器, 按输入顺序产出 (index, result);
+                 result 为 {'status': 'success', 'boxes': [k, 6], 'original_img_bgr': ..., 'original_shape': ...}
+                 或 {'status': 'error', 'message': ...}
+        """
+        chunks = [list(range(i, min(i + self.batch_size, len(items)))) for i in range(0, len(items), self.batch_size)]
+        with ThreadPoolExecutor(self.num_workers) as pool:
+            pending = [pool.submit(self.__preprocess_one, items[j]) for j in chunks[0]] if chunks else []
+            for k, chunk in enumerate(chunks):
+                prepared = [f.result() for f in pending]
+                # 预取下一个微批, 与本微批的前向重叠
+                if k + 1 < len(chunks):
+                    pending = [pool.submit(self.__preprocess_one, items[j]) for j in chunks[k + 1]]
+
+                ok = [i for i, p in enumerate(prepared) if not isinstance(p, Exception)]
+                detections = []
+                if ok:
+                    pred = self.forward([prepared[i][1] for i in ok])
+                    detections = self.decode(pred, [prepared[i][2] for i in ok], conf_thresh)
+                det_of = dict(zip(ok, detections))
+
+                for i, index in enumerate(chunk):
+                    if i in det_of:
+                        original_img_bgr, _, original_shape = prepared[i]
+                        yield index, {
+                            'status': 'success',
+                            'boxes': det_of[i],
+                            'original_img_bgr': original_img_bgr,
+                            'original_shape': original_shape,
+                        }
+                    else:
+                        yield index, {'status': 'error', 'message': str(prepared[i])}
@@ -111,7 +111,7 @@ class Resize(object):
         resize_h = int(resize_ratio * h_org)
         image_resized = cv2.resize(img, (resize_w, resize_h))
 
-        image_paded = np.full((self.h_target, self.w_target, 3), 128.0)
+        image_paded = np.full((self.h_target, self.w_target, 3), 128.0, dtype=np.float32)
         dw = int((self.w_target - resize_w) / 2)
         dh = int((self.h_target - resize_h) / 2)
         image_paded[dh: resize_h + dh, dw: resize_w + dw, :] = image_resized
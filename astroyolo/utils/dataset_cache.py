@@ -0,0 +1,176 @@
+# coding=utf-8
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append("..")
+import numpy as np
+
+import config.model_config as cfg
+from utils.batch_augment import to_uint8
+
+IMAGES_FILE = 'images.npy'
+INDEX_FILE = 'index.npz'
+META_FILE = 'meta.json'
+
+
+def cache_key(annotations, img_size, dtype, sources=()):
+    """
+    标注内容、源文件、输入尺寸与存储类型共同决定缓存, 任一变化都会生成新的缓存目录
+    :param sources: 样本读取的源文件(见 BuildDataset.source_files), 与 annotation_index 一样按修改时间与大小判断变化
+    """
+    sha = hashlib.sha1()
+    for annotation in annotations:
+        sha.update(annotation.strip().encode('utf-8'))
+        sha.update(b'\n')
+    for path in sources:
+        try:
+            stat = os.stat(path)
+            sha.update(f'{path}:{stat.st_mtime_ns}:{stat.st_size}\n'.encode('utf-8'))
+        except OSError:
+            sha.update(f'{path}:-\n'.encode('utf-8'))
+    sha.update(f'{img_size}:{np.dtype(dtype).str}'.encode('utf-8'))
+    return sha.hexdigest()[:16]
+
+
+def cache_dir_for(annotations, img_size, dtype=None, root=None, sources=()):
+    dtype = dtype or cfg.TRAIN['DATASET_CACHE_DTYPE']
+    root = root or cfg.TRAIN['DATASET_CACHE_DIR']
+    return os.path.join(root, f'{img_size}_{cache_key(annotations, img_size, dtype, sources)}')
+
+
+def compile_dataset_cache(dataset, cache_dir, dtype=None, num_workers=None):
+    """
+    一次性把数据集的全部样本解析(路径匹配、np.load、XML 解析、Resize)后写入缓存:
+    images.npy   [N, img_size, img_size, 3] 的内存映射数组
+    index.npz    boxes [M, 5] 所有样本的边界框拼接, offsets [N+1] 第 i 个样本的框为 boxes[offsets[i]:offsets[i+1]]
+    meta.json    样本数、尺寸、类型与原始图片路径
+    先写入本次编译独有的临时目录再改名, 中途失败不会留下不完整的缓存; 多个进程同时编译同一缓存时,
+    改名失败而目标缓存已完整存在视为成功(内容相同), 读者只会看到完整的缓存目录.
+    有样本读取失败时不生成缓存(否则占位的空白图像会一直留在缓存中), 抛出 RuntimeError.
+    :param dataset: BuildDataset(use_cache=False)
+    """
+    dtype = np.dtype(dtype or cfg.TRAIN['DATASET_CACHE_DTYPE'])
+    num_workers = num_workers or cfg.TRAIN['NUMBER_WORKERS']
+    n, img_size = len(dataset), dataset.img_size
+    tmp_dir = f'{cache_dir}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp'
+    os.makedirs(tmp_dir, exist_ok=True)
+
+    print(f"编译数据集缓存: {n} 个样本 -> {cache_dir}")
+    start = time.time()
+    images = np.lib.format.open_memmap(os.path.join(tmp_dir, IMAGES_FILE), mode='w+', dtype=dtype,
+                                       shape=(n, img_size, img_size, 3))
+    boxes = [None] * n
+    failures = []
+
+    def parse(index):
+        try:
+            return dataset.parse_sample(index, strict=True)
+        except Exception as e:
+            failures.append(f"{index}: {e}")
+            return None
+
+    with ThreadPoolExecutor(num_workers) as pool:
+        for i, sample in enumerate(pool.map(parse, range(n))):
+            if sample is None:
+                continue
+            img, bboxes = sample
+            if img.shape != (img_size, img_size, 3):
+                raise ValueError(f"样本 {i} 的图像形状 {img.shape} 与缓存尺寸不一致")
+            # uint8 缓存保存 0~255 的像素值, 读取方按 dtype 还原(见 BuildDataset)
+            images[i] = to_uint8(img) if dtype == np.uint8 else img
+            boxes[i] = np.asarray(bboxes, dtype=np.float32).reshape(-1, 5)
+    images.flush()
+    del images
+    if failures:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise RuntimeError(f"{len(failures)} 个样本读取失败, 未生成数据集缓存 {cache_dir}: " + "; ".join(failures[:5]))
+
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(b) for b in boxes])
+    all_boxes = np.concatenate(boxes, axis=0) if n else np.empty((0, 5), dtype=np.float32)
+    np.savez(os.path.join(tmp_dir, INDEX_FILE), boxes=all_boxes, offsets=offsets)
+    with open(os.path.join(tmp_dir, META_FILE), 'w') as f:
+        json.dump({
+            'count': n,
+            'img_size': img_size,
+            'dtype': dtype.str,
+            'created': time.time(),
+            'annotations': [a.strip().split(' ')[0] for a in dataset.annotations],
+        }, f, indent=2)
+    try:
+        os.replace(tmp_dir, cache_dir)
+    except OSError:
+        # 其他进程已先完成同一缓存的编译
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        if not DatasetCache.exists(cache_dir):
+            raise
+        print(f"数据集缓存已由其他进程编译完成: {cache_dir}")
+        return
+    print(f"数据集缓存编译完成, 用时 {time.time() - start:.1f}s")
+
+
+class DatasetCache(object):
+    """
+    读取 compile_dataset_cache 生成的缓存. 图像数组以只读内存映射方式打开,
+    取样本时返回的是映射数组的视图, 不发生拷贝; 映射在首次访问时才打开,
+    因此 DataLoader 的每个 worker 各自持有自己的映射.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        with open(os.path.join(cache_dir, META_FILE), 'r') as f:
+            self.meta = json.load(f)
+        index = np.load(os.path.join(cache_dir, INDEX_FILE))
+        self.boxes = index['boxes']
+        self.offsets = index['offsets']
+        self.__images = None
+
+    @staticmethod
+    def exists(cache_dir):
+        return all(os.path.exists(os.path.join(cache_dir, name)) for name in [IMAGES_FILE, INDEX_FILE, META_FILE])
+
+    @property
+    def images(self):
+        if self.__images is None:
+            self.__images = np.load(os.path.join(self.cache_dir, IMAGES_FILE), mmap_mode='r')
+        return self.__images
+
+    def __len__(self):
+        return self.meta['count']
+
+    def raw(self, index):
+        """
+        :return: (img [img_size, img_size, 3] 按缓存 dtype 存储的只读视图(uint8 缓存为 0~255), bboxes [k, 5] 视图)
+        """
+        return self.images[index], self.boxes[self.offsets[index]:self.offsets[index + 1]]
+
+    def __getitem__(self, index):
+        """
+        :return: (img [img_size, img_size, 3] [0, 1] 浮点, bboxes [k, 5] 视图);
+                 浮点缓存返回只读视图, uint8 缓存在这里还原为浮点
+        """
+        img, bboxes = self.raw(index)
+        if img.dtype == np.uint8:
+            img = img.astype(np.float32) / 255.0
+        return img, bboxes
+
+    def __getstate__(self):
+        # 传给 DataLoader worker 时不携带已打开的映射
+        state = self.__dict__.copy()
+        state['_DatasetCache__images'] = None
+        return state
+
+
+if __name__ == "__main__":
+    # python dataset_cache.py [train|test] [img_size]
+    from utils.datasets import BuildDataset
+
+    anno_file_type = sys.argv[1] if len(sys.argv) > 1 else 'train'
+    img_size = int(sys.argv[2]) if len(sys.argv) > 2 else cfg.TRAIN['TRAIN_IMG_SIZE']
+    BuildDataset(anno_file_type, img_size=img_size, use_cache=True)
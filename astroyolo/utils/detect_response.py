@@ -0,0 +1,142 @@
+# coding=utf-8
+import json
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+sys.path.append("..")
+import cv2
+
+import config.model_config as cfg
+
+# full: 原有格式, 原图与结果图都以 base64 PNG 嵌入 JSON
+# boxes: 只返回检测框, 不绘制也不编码任何图像
+# url: 返回检测框与结果图/原图的 URL, 图像在首次请求该 URL 时才绘制并编码
+# multipart: multipart/mixed, 第一部分为检测框 JSON, 第二部分为结果图 PNG(二进制, 不做 base64)
+# image: 响应体直接是结果图 PNG, 检测数放在 X-Detection-Count 头中
+RESPONSE_MODES = ('full', 'boxes', 'url', 'multipart', 'image')
+ACCEPT_MODES = OrderedDict([('application/json', 'full'), ('multipart/mixed', 'multipart'), ('image/png', 'image')])
+MULTIPART_BOUNDARY = 'astroyolo-detect'
+
+
+def negotiate_mode(request):
+    """
+    显式参数 response(表单、查询串或 JSON)优先, 否则按 Accept 头协商;
+    浏览器的 */* 匹配到 application/json, 即原有的 full 格式
+    """
+    mode = request.values.get('response')
+    if mode is None and request.is_json:
+        mode = (request.get_json(silent=True) or {}).get('response')
+    if mode is None:
+        best = request.accept_mimetypes.best_match(list(ACCEPT_MODES))
+        mode = ACCEPT_MODES.get(best, 'full')
+    if mode not in RESPONSE_MODES:
+        raise ValueError(f"Unsupported response mode: {mode}, must be in {RESPONSE_MODES}")
+    return mode
+
+
+def encode_png(image_bgr):
+    ok, buffer = cv2.imencode('.png', image_bgr)
+    if not ok:
+        raise ValueError("PNG encoding failed")
+    return buffer.tobytes()
+
+
+class OverlayStore(object):
+    """
+    url 模式下保存检测时的原图与检测框, 结果图在首次请求时才绘制、编码, 编码后的 PNG 一并缓存.
+    按原图字节数做 LRU 淘汰, 超过 ttl 秒的条目视为过期.
+    """
+
+    def __init__(self, render_fn, max_mb=None, ttl=None):
+        """
+        :param render_fn: (original_img_bgr, boxes) -> 绘制了检测框的 BGR 图像
+        """
+        self.render_fn = render_fn
+        self.max_bytes = (max_mb or cfg.INFERENCE['OVERLAY_CACHE_MB']) * 1024 ** 2
+        self.ttl = ttl or cfg.INFERENCE['OVERLAY_TTL']
+        self.__entries = OrderedDict()  # token -> {'image', 'boxes', 'created', 'png': {kind: bytes}}
+        self.__lock = threading.Lock()
+
+    def __nbytes(self, entry):
+        return entry['image'].nbytes + sum(len(png) for png in entry['png'].values())
+
+    def put(self, original_img_bgr, boxes):
+        token = uuid.uuid4().hex
+        with self.__lock:
+            self.__entries[token] = {'image': original_img_bgr, 'boxes': boxes, 'created': time.time(), 'png': {}}
+            total = sum(self.__nbytes(e) for e in self.__entries.values())
+            while len(self.__entries) > 1 and total > self.max_bytes:
+                _, evicted = self.__entries.popitem(last=False)
+                total -= self.__nbytes(evicted)
+        return token
+
+    def get_png(self, token, kind='result'):
+        """
+        :param kind: 'result' 结果图 | 'original' 原图
+        :return: PNG 字节, token 不存在或已过期时为 None
+        """
+        with self.__lock:
+            entry = self.__entries.get(token)
+            if entry is None or time.time() - entry['created'] > self.ttl:
+                self.__entries.pop(token, None)
+                return None
+            self.__entries.move_to_end(token)
+            png = entry['png'].get(kind)
+        if png is None:
+            # 在锁外绘制与编码, 同一 token 的并发请求最多重复编码一次
+            image = entry['image'] if kind == 'original' else self.render_fn(entry['image'], entry['boxes'])
+            png = encode_png(image)
+            with self.__lock:
+                entry['png'][kind] = png
+        return png
+
+
+def multipart_body(payload, png):
+    """multipart/mixed: JSON 部分 + PNG 部分"""
+    boundary = MULTIPART_BOUNDARY.encode()
+    return b''.join([
+        b'--' + boundary + b'\r\nContent-Type: application/json\r\n\r\n',
+        json.dumps(payload).encode('utf-8'),
+        b'\r\n--' + boundary + b'\r\nContent-Type: image/png\r\nContent-Disposition: inline; filename="result.png"\r\n',
+        f'Content-Length: {len(png)}\r\n\r\n'.encode(),
+        png,
+        b'\r\n--' + boundary + b'--\r\n',
+    ])
+
+
+def benchmark(sample_path=None, runs=5):
+    """
+    用 Flask 测试客户端对同一张示例图依次请求各响应模式, 统计每个请求的进程 CPU 时间与响应字节数.
+    url 模式额外计入随后一次结果图请求(客户端真正需要结果图时的总代价).
+    """
+    import os
+
+    from app import app, initialize_model
+
+    sample_path = sample_path or os.path.join('sample_images', 'SDSS_1.2376611256069e+18_rgb.jpg')
+    initialize_model()
+    client = app.test_client()
+    print(f"sample={sample_path}, runs={runs}")
+    print(f"{'mode':>10} {'cpu ms':>9} {'wall ms':>9} {'bytes':>10}")
+    for mode in RESPONSE_MODES:
+        cpu, wall, nbytes = 0.0, 0.0, 0
+        for _ in range(runs):
+            start_cpu, start_wall = time.process_time(), time.perf_counter()
+            response = client.post('/api/detect', data={'sample_path': sample_path, 'confidence': 0.3,
+                                                        'response': mode})
+            size = len(response.get_data())
+            if mode == 'url':
+                response = client.get(response.get_json()['result_url'])
+                size += len(response.get_data())
+            cpu += time.process_time() - start_cpu
+            wall += time.perf_counter() - start_wall
+            nbytes += size
+        print(f"{mode:>10} {cpu / runs * 1000:>9.1f} {wall / runs * 1000:>9.1f} {nbytes // runs:>10}")
+
+
+if __name__ == "__main__":
+    # 在 astroyolo 目录下运行: python -m utils.detect_response [sample_path]
+    benchmark(sys.argv[1] if len(sys.argv) > 1 else None)
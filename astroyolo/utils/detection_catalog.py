@@ -0,0 +1,256 @@
+# coding=utf-8
+import glob
+import math
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+
+sys.path.append("..")
+import config.model_config as cfg
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = ds = pq = None
+
+# 分区列只出现在目录名中(date=YYYY-MM-DD/task_id=...), 不写入 Parquet 文件本身
+PARTITION_FIELDS = ('date', 'task_id')
+COLUMNS = ('source_file', 'det_id', 'x1', 'y1', 'x2', 'y2', 'confidence', 'class_id', 'class_name',
+           'ra', 'dec', 'image_width', 'image_height', 'detected_at')
+
+
+def file_schema():
+    return pa.schema([
+        ('source_file', pa.string()),
+        ('det_id', pa.int32()),
+        ('x1', pa.float32()),
+        ('y1', pa.float32()),
+        ('x2', pa.float32()),
+        ('y2', pa.float32()),
+        ('confidence', pa.float32()),
+        ('class_id', pa.int16()),
+        ('class_name', pa.string()),
+        ('ra', pa.float64()),  # 无 WCS 时为空
+        ('dec', pa.float64()),
+        ('image_width', pa.int32()),
+        ('image_height', pa.int32()),
+        ('detected_at', pa.float64()),
+    ])
+
+
+def partition_dir(root, date, task_id):
+    return os.path.join(root, f'date={date}', f'task_id={task_id}')
+
+
+class CatalogWriter(object):
+    """
+    一个任务的检测目录写入器: 逐文件追加检测框, 每满 flush_rows 行写出一个 Parquet 文件,
+    文件先以 '.' 开头的临时名写入再重命名, 查询时不会读到写了一半的文件.
+    任务从头重跑(如作业被重新入队)时先清掉该任务已有的分区, 目录中不会出现重复行.
+    """
+
+    def __init__(self, root, task_id, timestamp=None, flush_rows=None):
+        assert pa is not None, "pyarrow is required for the detection catalog"
+        self.task_id = task_id
+        self.date = time.strftime('%Y-%m-%d', time.localtime(timestamp or time.time()))
+        self.flush_rows = flush_rows or cfg.INFERENCE['CATALOG_FLUSH_ROWS']
+        self.class_names = cfg.Customer_DATA['CLASSES']
+        for stale in glob.glob(os.path.join(root, 'date=*', f'task_id={task_id}')):
+            shutil.rmtree(stale, ignore_errors=True)
+        self.out_dir = partition_dir(root, self.date, task_id)
+        self.__rows = {name: [] for name in COLUMNS}
+        self.__pending = 0
+        self.__part = 0
+
+    def add(self, source_file, boxes, image_shape, wcs=None):
+        """
+        :param boxes: [k, 6] (x1, y1, x2, y2, score, class_id), 原图坐标
+        :param image_shape: 原图 (H, W)
+        :param wcs: 原图像素网格的天球 WCS(见 fits_operator.fits_wcs), 为 None 时 ra/dec 为空
+        """
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 6)
+        k = len(boxes)
+        if k == 0:
+            return
+        if wcs is not None:
+            from utils.fits_operator import pixel_to_sky
+            ra, dec = pixel_to_sky(wcs, (boxes[:, 0] + boxes[:, 2]) / 2, (boxes[:, 1] + boxes[:, 3]) / 2)
+            ra, dec = ra.tolist(), dec.tolist()
+        else:
+            ra = dec = [None] * k
+        class_ids = boxes[:, 5].astype(np.int64)
+        rows = self.__rows
+        rows['source_file'] += [source_file] * k
+        rows['det_id'] += list(range(1, k + 1))
+        for i, name in enumerate(('x1', 'y1', 'x2', 'y2', 'confidence')):
+            rows[name] += boxes[:, i].tolist()
+        rows['class_id'] += class_ids.tolist()
+        rows['class_name'] += [self.class_names[c] if 0 <= c < len(self.class_names) else None for c in class_ids]
+        rows['ra'] += ra
+        rows['dec'] += dec
+        rows['image_width'] += [int(image_shape[1])] * k
+        rows['image_height'] += [int(image_shape[0])] * k
+        rows['detected_at'] += [time.time()] * k
+        self.__pending += k
+        if self.__pending >= self.flush_rows:
+            self.flush()
+
+    def flush(self):
+        if not self.__pending:
+            return
+        table = pa.Table.from_pydict(self.__rows, schema=file_schema())
+        os.makedirs(self.out_dir, exist_ok=True)
+        name = f'part-{self.__part:05d}.parquet'
+        tmp_path = os.path.join(self.out_dir, f'.{name}.tmp')
+        pq.write_table(table, tmp_path, compression='zstd')
+        os.replace(tmp_path, os.path.join(self.out_dir, name))
+        self.__rows = {name: [] for name in COLUMNS}
+        self.__pending = 0
+        self.__part += 1
+
+    def close(self):
+        self.flush()
+
+
+def open_writer(task_id, timestamp=None, root=None):
+    """按配置为任务创建 CatalogWriter; 未配置 CATALOG_DIR 或未安装 pyarrow 时返回 None(不写目录)"""
+    root = root or cfg.INFERENCE['CATALOG_DIR']
+    if not root or pa is None:
+        return None
+    return CatalogWriter(root, task_id, timestamp)
+
+
+def _cone_box(ra, dec, radius):
+    """锥形区域的外接 RA/Dec 范围, 用于下推到 Parquet 行组统计的粗筛; 覆盖天极时不限制 RA"""
+    dec_range = (dec - radius, dec + radius)
+    if abs(dec) + radius >= 90:
+        return None, dec_range
+    half = math.degrees(math.asin(min(1.0, math.sin(math.radians(radius)) / math.cos(math.radians(dec)))))
+    return ((ra - half) % 360, (ra + half) % 360), dec_range
+
+
+def _angular_distance(ra1, dec1, ra2, dec2):
+    """球面角距(度), haversine 公式"""
+    ra1, dec1, ra2, dec2 = map(np.radians, (ra1, dec1, ra2, dec2))
+    a = np.sin((dec2 - dec1) / 2) ** 2 + np.cos(dec1) * np.cos(dec2) * np.sin((ra2 - ra1) / 2) ** 2
+    return np.degrees(2 * np.arcsin(np.sqrt(np.clip(a, 0, 1))))
+
+
+class DetectionCatalog(object):
+    """
+    检测目录的查询接口. 按 date/task_id 分区目录剪枝, 其余条件下推到 Parquet 行组统计,
+    逐批扫描, 内存只与结果大小(和 limit)有关, 不随历史检测总量增长.
+    """
+
+    def __init__(self, root=None):
+        assert pa is not None, "pyarrow is required for the detection catalog"
+        self.root = root or cfg.INFERENCE['CATALOG_DIR']
+
+    def dataset(self):
+        partitioning = ds.partitioning(pa.schema([(name, pa.string()) for name in PARTITION_FIELDS]), flavor='hive')
+        return ds.dataset(self.root, format='parquet', partitioning=partitioning,
+                          schema=pa.unify_schemas([file_schema(), partitioning.schema]))
+
+    @staticmethod
+    def build_filter(min_confidence=None, task_id=None, source_file=None, class_id=None, date_from=None,
+                     date_to=None, ra_range=None, dec_range=None, pixel_box=None):
+        """
+        :param source_file: 文件名或文件名列表
+        :param date_from, date_to: 'YYYY-MM-DD', 闭区间
+        :param ra_range: (ra_min, ra_max) 度, ra_min > ra_max 时表示跨越 0 度
+        :param dec_range: (dec_min, dec_max) 度
+        :param pixel_box: (x1, y1, x2, y2) 框中心落在该像素区域内(通常与 source_file 一起使用)
+        :return: pyarrow.dataset 表达式, 无条件时为 None
+        """
+        clauses = []
+        if min_confidence is not None:
+            clauses.append(ds.field('confidence') >= min_confidence)
+        if task_id is not None:
+            clauses.append(ds.field('task_id') == task_id)
+        if source_file is not None:
+            files = [source_file] if isinstance(source_file, str) else list(source_file)
+            clauses.append(ds.field('source_file').isin(files))
+        if class_id is not None:
+            clauses.append(ds.field('class_id') == class_id)
+        if date_from is not None:
+            clauses.append(ds.field('date') >= date_from)
+        if date_to is not None:
+            clauses.append(ds.field('date') <= date_to)
+        if ra_range is not None:
+            ra_min, ra_max = ra_range
+            if ra_min <= ra_max:
+                clauses.append((ds.field('ra') >= ra_min) & (ds.field('ra') <= ra_max))
+            else:
+                clauses.append((ds.field('ra') >= ra_min) | (ds.field('ra') <= ra_max))
+        if dec_range is not None:
+            clauses.append((ds.field('dec') >= dec_range[0]) & (ds.field('dec') <= dec_range[1]))
+        if pixel_box is not None:
+            x1, y1, x2, y2 = pixel_box
+            cx = (ds.field('x1') + ds.field('x2')) / 2
+            cy = (ds.field('y1') + ds.field('y2')) / 2
+            clauses.append((cx >= x1) & (cx <= x2) & (cy >= y1) & (cy <= y2))
+        expression = None
+        for clause in clauses:
+            expression = clause if expression is None else expression & clause
+        return expression
+
+    def scan(self, columns=None, cone=None, batch_size=65536, **filters):
+        """
+        逐批返回满足条件的检测, 条件见 build_filter
+        :param columns: 需要的列(可含分区列 date/task_id), None 表示全部
+        :param cone: (ra, dec, radius) 度, 锥形检索; 先用外接范围下推粗筛, 再逐批按角距精确过滤
+        :return: pyarrow.RecordBatch 迭代器
+        """
+        if not os.path.isdir(self.root):
+            return
+        if cone is not None:
+            ra_range, dec_range = _cone_box(*cone)
+            filters.setdefault('ra_range', ra_range)
+            filters.setdefault('dec_range', dec_range)
+        scan_columns = columns
+        if cone is not None and columns is not None:
+            scan_columns = list(columns) + [c for c in ('ra', 'dec') if c not in columns]
+        scanner = self.dataset().scanner(columns=scan_columns, filter=self.build_filter(**filters),
+                                         batch_size=batch_size)
+        for batch in scanner.to_batches():
+            if cone is not None and batch.num_rows:
+                ra = batch.column('ra').to_numpy(zero_copy_only=False)
+                dec = batch.column('dec').to_numpy(zero_copy_only=False)
+                batch = batch.filter(pa.array(_angular_distance(cone[0], cone[1], ra, dec) <= cone[2]))
+                if columns is not None:
+                    batch = batch.select(list(columns))
+            if batch.num_rows:
+                yield batch
+
+    def query(self, columns=None, cone=None, limit=None, **filters):
+        """
+        :param limit: 最多返回的行数, 达到后停止扫描
+        :return: pyarrow.Table
+        """
+        batches = []
+        count = 0
+        for batch in self.scan(columns=columns, cone=cone, **filters):
+            if limit is not None and count + batch.num_rows >= limit:
+                batches.append(batch.slice(0, limit - count))
+                break
+            batches.append(batch)
+            count += batch.num_rows
+        if not batches:
+            schema = self.dataset().schema if os.path.isdir(self.root) else file_schema()
+            return schema.empty_table() if columns is None else schema.empty_table().select(list(columns))
+        return pa.Table.from_batches(batches)
+
+
+if __name__ == "__main__":
+    # 在 astroyolo 目录下运行: python -m utils.detection_catalog [min_confidence] [ra dec radius]
+    args = [float(a) for a in sys.argv[1:]]
+    catalog = DetectionCatalog()
+    start = time.perf_counter()
+    table = catalog.query(min_confidence=args[0] if args else None, cone=tuple(args[1:4]) if len(args) >= 4 else None)
+    print(f"{table.num_rows} detections in {(time.perf_counter() - start) * 1000:.1f} ms")
+    print(table.slice(0, 20).to_pandas() if table.num_rows else table.schema)
@@ -0,0 +1,74 @@
+# coding=utf-8
+import multiprocessing
+import sys
+
+sys.path.append("..")
+import numpy as np
+
+import config.model_config as cfg
+
+
+class DatasetDiagnostics(object):
+    """
+    数据管线诊断计数器, 默认关闭(cfg.TRAIN['DATASET_DIAGNOSTICS']).
+    关闭时所有检查都是空操作; 开启时计数保存在共享内存中, DataLoader 的各个 worker
+    累加到同一组计数器, 由主进程在每个 epoch 结束时调用 report() 输出一次汇总,
+    取代原先逐样本的打印.
+    """
+
+    COUNTERS = (
+        'samples',  # 读取的样本数(含 Mixup 的第二个样本)
+        'shape_repairs',  # 形状异常并被修正的图像数
+        'nan_inf_images',  # 含 NaN/Inf 的图像数
+        'nan_inf_labels',  # 含 NaN/Inf 的标签数
+        'missing_boxes',  # 没有任何边界框的样本数
+        'load_failures',  # 加载失败并以空白图像代替的样本数
+        'fuzzy_matches',  # 通过目录模糊匹配才找到图像的样本数
+    )
+
+    def __init__(self, enabled=None):
+        self.enabled = cfg.TRAIN['DATASET_DIAGNOSTICS'] if enabled is None else enabled
+        self.__counts = multiprocessing.Array('q', len(self.COUNTERS)) if self.enabled else None
+
+    def count(self, name, n=1):
+        if not self.enabled:
+            return
+        with self.__counts.get_lock():
+            self.__counts[self.COUNTERS.index(name)] += n
+
+    def check_finite(self, name, *arrays):
+        """开启诊断时检查数组中是否有 NaN/Inf, 有则计入 name"""
+        if not self.enabled:
+            return
+        if any(not np.isfinite(np.asarray(arr)).all() for arr in arrays):
+            self.count(name)
+
+    def summary(self):
+        if not self.enabled:
+            return {}
+        with self.__counts.get_lock():
+            return dict(zip(self.COUNTERS, self.__counts[:]))
+
+    def reset(self):
+        if not self.enabled:
+            return
+        with self.__counts.get_lock():
+            self.__counts[:] = [0] * len(self.COUNTERS)
+
+    def report(self, epoch=None, logger=None, reset=True):
+        """
+        输出并(默认)清零本 epoch 的计数
+        :param logger: utils.log.Logger().get_log() 返回的 logger, 为 None 时直接打印
+        :return: 计数字典, 关闭诊断时为空字典
+        """
+        counts = self.summary()
+        if counts:
+            prefix = f"[数据诊断] epoch {epoch}: " if epoch is not None else "[数据诊断] "
+            message = prefix + ", ".join(f"{name}={value}" for name, value in counts.items())
+            if logger is not None:
+                logger.info(message)
+            else:
+                print(message)
+            if reset:
+                self.reset()
+        return counts
@@ -0,0 +1,485 @@
+# coding=utf-8
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append("..")
+import numpy as np
+import torch
+
+import config.model_config as cfg
+
+IOU_THRESHOLDS = np.round(np.linspace(0.5, 0.95, 10), 2)  # AP@[.5:.95], 第 0 个为 AP50
+RECALL_POINTS = np.linspace(0, 1, 101)  # 导出 PR 曲线时的召回率采样点
+SIZE_BINS = {'small': (0, 32), 'medium': (32, 96), 'large': (96, float('inf'))}  # 按 sqrt(面积) 划分, 输入图像素
+FOLD_TXT_DIR = os.path.join(cfg.DATA_PATH, 'txt')  # xml_to_txt.generate_k_fold_cross_validation 的输出目录
+
+
+def box_iou_numpy(boxes1, boxes2):
+    """
+    :param boxes1: [N, 4] (xmin, ymin, xmax, ymax)
+    :param boxes2: [M, 4]
+    :return: [N, M] IoU 矩阵
+    """
+    area1 = (boxes1[:, 2] - boxes1[:, 0]) * (boxes1[:, 3] - boxes1[:, 1])
+    area2 = (boxes2[:, 2] - boxes2[:, 0]) * (boxes2[:, 3] - boxes2[:, 1])
+    left_up = np.maximum(boxes1[:, None, :2], boxes2[None, :, :2])
+    right_down = np.minimum(boxes1[:, None, 2:], boxes2[None, :, 2:])
+    inter_section = np.clip(right_down - left_up, 0, None)
+    inter_area = inter_section[..., 0] * inter_section[..., 1]
+    return inter_area / (area1[:, None] + area2[None, :] - inter_area + 1e-9)
+
+
+def greedy_match(iou, scores, iou_thresholds=IOU_THRESHOLDS):
+    """
+    按分数从高到低的贪心匹配(每个检测取尚未匹配且 IoU 不低于阈值的真值中 IoU 最大者), 所有 IoU 阈值同时进行.
+    不逐个检测循环, 而是在 IoU 达到阈值的 (阈值, 检测, 真值) 候选对上按轮整批确定: 每轮每个待定检测取当前
+    可用真值中 IoU 最大者, 若没有排在它之前的待定检测也能取到这个真值, 逐个匹配时它必然得到这个真值,
+    本轮即可确定. 每轮至少确定每个阈值下排在最前的待定检测, 通常两三轮完成.
+    :param iou: [D, G] IoU 矩阵, 不可匹配的对(如类别不同)置 0
+    :param scores: [D]
+    :return: [D, T] 各阈值下匹配到的真值下标, 未匹配为 -1(与 iou 的行顺序一致)
+    """
+    thresholds = np.asarray(iou_thresholds)
+    num_det, num_gt = iou.shape
+    matched = np.full((len(thresholds), num_det), -1, dtype=np.int64)
+    if num_det == 0 or num_gt == 0:
+        return matched.T
+    order = np.argsort(-scores, kind='stable')
+    iou = iou[order]
+    det_ind, gt_ind = np.nonzero(iou >= thresholds.min())
+    pair_iou = iou[det_ind, gt_ind]
+    t, pair = np.nonzero(pair_iou[None] >= thresholds[:, None])
+    # 每个 (阈值, 检测) 内按 IoU 降序(相同时真值下标小者优先), 组内第一个可用的候选对即 IoU 最大者
+    ranked = np.lexsort((gt_ind[pair], -pair_iou[pair], det_ind[pair], t))
+    t, pair = t[ranked], pair[ranked]
+    d, g = det_ind[pair], gt_ind[pair]
+
+    taken = np.zeros((len(thresholds), num_gt), dtype=bool)
+    done = np.zeros((len(thresholds), num_det), dtype=bool)
+    alive = np.ones(len(t), dtype=bool)
+    while True:
+        alive &= ~taken[t, g] & ~done[t, d]
+        if not alive.any():
+            break
+        at, ad, ag = t[alive], d[alive], g[alive]
+        key = at * num_det + ad
+        head = np.flatnonzero(np.r_[True, key[1:] != key[:-1]])
+        bt, bd, bg = at[head], ad[head], ag[head]
+        first = np.full((len(thresholds), num_gt), num_det)  # 能取到该真值的最靠前的待定检测
+        np.minimum.at(first, (at, ag), ad)
+        win = first[bt, bg] == bd
+        bt, bd, bg = bt[win], bd[win], bg[win]
+        matched[bt, bd] = bg
+        taken[bt, bg] = True
+        done[bt, bd] = True
+    result = np.empty_like(matched)
+    result[:, order] = matched
+    return result.T
+
+
+def match_detections(det, gt, iou_thresholds=IOU_THRESHOLDS):
+    """
+    一张图的检测与真值在所有 IoU 阈值下同时做贪心匹配(同类别才可匹配, 见 greedy_match), IoU 矩阵一次算出.
+    :param det: [D, 6] (xmin, ymin, xmax, ymax, score, class)
+    :param gt: [G, 5] (xmin, ymin, xmax, ymax, class)
+    :return: [D, T] bool, 检测在各阈值下是否为真阳性(与 det 的行顺序一致)
+    """
+    if len(det) == 0 or len(gt) == 0:
+        return np.zeros((len(det), len(iou_thresholds)), dtype=bool)
+    iou = box_iou_numpy(det[:, :4], gt[:, :4])
+    iou[det[:, 5, None] != gt[None, :, 4]] = 0.0
+    return greedy_match(iou, det[:, 4], np.asarray(iou_thresholds)) >= 0
+
+
+def precision_recall(scores, tp, num_gt):
+    """
+    :param scores: [D]
+    :param tp: [D, T] bool
+    :return: (按分数降序的 scores [D], precision [D, T], recall [D, T])
+    """
+    order = np.argsort(-scores, kind='stable')
+    tp = tp[order].astype(np.float64)
+    tp_cum = np.cumsum(tp, axis=0)
+    fp_cum = np.cumsum(1.0 - tp, axis=0)
+    precision = tp_cum / np.maximum(tp_cum + fp_cum, 1e-9)
+    recall = tp_cum / max(num_gt, 1)
+    return scores[order], precision, recall
+
+
+def ap_from_pr(precision, recall):
+    """
+    全点插值的 AP(VOC2010+), 对每一列(IoU 阈值)同时计算
+    :param precision, recall: [D, T]
+    :return: [T]
+    """
+    num_thresh = precision.shape[1]
+    recall = np.concatenate([np.zeros((1, num_thresh)), recall, np.ones((1, num_thresh))])
+    precision = np.concatenate([np.ones((1, num_thresh)), precision, np.zeros((1, num_thresh))])
+    precision = np.flip(np.maximum.accumulate(np.flip(precision, 0), axis=0), 0)
+    return np.sum((recall[1:] - recall[:-1]) * precision[1:], axis=0)
+
+
+def average_precision(scores, tps, num_gt):
+    """单个 IoU 阈值的全点插值 AP, tps 为 0/1 列表"""
+    if num_gt == 0:
+        return float('nan')
+    if len(scores) == 0:
+        return 0.0
+    _, precision, recall = precision_recall(np.asarray(scores, dtype=np.float64),
+                                            np.asarray(tps, dtype=bool).reshape(-1, 1), num_gt)
+    return float(ap_from_pr(precision, recall)[0])
+
+
+def size_bin(boxes):
+    """按 sqrt(面积) 把 [k, 4] 的框分到 SIZE_BINS"""
+    side = np.sqrt(np.clip(boxes[:, 2] - boxes[:, 0], 0, None) * np.clip(boxes[:, 3] - boxes[:, 1], 0, None))
+    bins = np.empty(len(boxes), dtype=object)
+    for name, (lo, hi) in SIZE_BINS.items():
+        bins[(side >= lo) & (side < hi)] = name
+    return bins
+
+
+class MetricAccumulator(object):
+    """逐图累积匹配结果, 最后一次性计算各类别、各 IoU 阈值的 AP 与 PR 曲线"""
+
+    def __init__(self, num_classes, iou_thresholds=IOU_THRESHOLDS):
+        self.num_classes = num_classes
+        self.iou_thresholds = np.asarray(iou_thresholds)
+        self.scores, self.labels, self.tps = [], [], []
+        self.num_gt = np.zeros(num_classes, dtype=np.int64)
+        self.num_images = 0
+
+    def add(self, det, gt):
+        det = np.asarray(det, dtype=np.float64).reshape(-1, 6)
+        gt = np.asarray(gt, dtype=np.float64).reshape(-1, 5)
+        self.tps.append(match_detections(det, gt, self.iou_thresholds))
+        self.scores.append(det[:, 4])
+        self.labels.append(det[:, 5].astype(np.int64))
+        self.num_gt += np.bincount(gt[:, 4].astype(np.int64), minlength=self.num_classes)[:self.num_classes]
+        self.num_images += 1
+
+    def compute(self, class_names=None):
+        """
+        :return: {'mAP50', 'mAP50_95', 'ap': {类别: {'AP50', 'AP50_95', 'num_gt'}}, 'precision', 'recall', 'f1',
+                  'conf_thresh'(F1 最大处的分数阈值, IoU 0.5), 'pr_curve': {'recall', 'precision'}, ...}
+        """
+        class_names = class_names or [str(c) for c in range(self.num_classes)]
+        scores = np.concatenate(self.scores) if self.scores else np.zeros(0)
+        labels = np.concatenate(self.labels) if self.labels else np.zeros(0, dtype=np.int64)
+        tps = np.concatenate(self.tps) if self.tps else np.zeros((0, len(self.iou_thresholds)), dtype=bool)
+        ap = np.full((self.num_classes, len(self.iou_thresholds)), np.nan)
+        pr_curves = []
+        best = {'f1': 0.0, 'precision': 0.0, 'recall': 0.0, 'conf_thresh': None}
+        for c in range(self.num_classes):
+            if self.num_gt[c] == 0:
+                continue
+            mask = labels == c
+            if not mask.any():
+                ap[c] = 0.0
+                continue
+            sorted_scores, precision, recall = precision_recall(scores[mask], tps[mask], self.num_gt[c])
+            ap[c] = ap_from_pr(precision, recall)
+            # IoU 0.5 下的 PR 曲线(插值到 RECALL_POINTS)与 F1 最大的工作点
+            envelope = np.flip(np.maximum.accumulate(np.flip(precision[:, 0])))
+            idx = np.searchsorted(recall[:, 0], RECALL_POINTS, side='left')
+            pr_curves.append(np.where(idx < len(envelope), envelope[np.minimum(idx, len(envelope) - 1)], 0.0))
+            f1 = 2 * precision[:, 0] * recall[:, 0] / np.maximum(precision[:, 0] + recall[:, 0], 1e-9)
+            k = int(np.argmax(f1))
+            if f1[k] > best['f1']:
+                best = {'f1': float(f1[k]), 'precision': float(precision[k, 0]), 'recall': float(recall[k, 0]),
+                        'conf_thresh': float(sorted_scores[k])}
+        valid = ~np.isnan(ap[:, 0])
+        return {
+            'mAP50': float(np.mean(ap[valid, 0])) if valid.any() else float('nan'),
+            'mAP50_95': float(np.mean(ap[valid])) if valid.any() else float('nan'),
+            'ap': {class_names[c]: {'AP50': float(ap[c, 0]), 'AP50_95': float(np.mean(ap[c])),
+                                    'num_gt': int(self.num_gt[c])} for c in range(self.num_classes)},
+            **best,
+            'pr_curve': {'recall': RECALL_POINTS.tolist(),
+                         'precision': np.mean(pr_curves, axis=0).tolist() if pr_curves else []},
+            'iou_thresholds': self.iou_thresholds.tolist(),
+            'num_images': self.num_images,
+            'num_detections': int(len(scores)),
+        }
+
+
+def merged_annotation_file(anno_txt_path, out_dir=None):
+    """
+    xml_to_txt 生成的折文件每行只有一个框(同一张图重复多行), 而 BuildDataset 每行视为一个样本;
+    评估前按图片合并为每图一行, 写入缓存目录并按内容哈希命名, 内容不变时直接复用
+    :return: 合并后的标注文件路径
+    """
+    out_dir = out_dir or os.path.join(cfg.TRAIN['DATASET_CACHE_DIR'], 'eval')
+    with open(anno_txt_path, 'r') as f:
+        lines = [line.strip() for line in f if line.strip()]
+    merged = OrderedDict()
+    for line in lines:
+        path, *boxes = line.split(' ')
+        merged.setdefault(path, []).extend(boxes)
+    content = ''.join(' '.join([path] + boxes) + '\n' for path, boxes in merged.items())
+    digest = hashlib.sha1(content.encode('utf-8')).hexdigest()[:12]
+    name = os.path.splitext(os.path.basename(anno_txt_path))[0]
+    merged_path = os.path.join(out_dir, f'{name}.{digest}.txt')
+    if not os.path.exists(merged_path):
+        os.makedirs(out_dir, exist_ok=True)
+        tmp_path = f'{merged_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(content)
+        os.replace(tmp_path, merged_path)
+    return merged_path
+
+
+class _ParsedSamples(object):
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, index):
+        return self.dataset.parse_sample(index)
+
+
+def load_eval_samples(anno_txt_path, img_size, use_cache=None):
+    """
+    评估样本(不做数据增强): 默认与训练一样使用预处理缓存(首次编译), 之后每次评估只读内存映射
+    :return: 可索引对象, 第 i 项为 (img [img_size, img_size, 3] [0, 1] 浮点, bboxes [k, 5])
+    """
+    from utils.dataset_cache import DatasetCache, cache_dir_for, compile_dataset_cache
+    from utils.datasets import BuildDataset
+
+    dataset = BuildDataset('test', img_size=img_size, anno_txt_path=merged_annotation_file(anno_txt_path),
+                           use_cache=False)
+    if not (cfg.TRAIN['DATASET_CACHE'] if use_cache is None else use_cache):
+        return _ParsedSamples(dataset)
+    cache_dir = cache_dir_for(dataset.annotations, img_size, sources=dataset.source_files())
+    if not DatasetCache.exists(cache_dir):
+        compile_dataset_cache(dataset, cache_dir)
+    return DatasetCache(cache_dir)
+
+
+class Evaluator(object):
+    """
+    一个标注文件(如 foldK_test.txt)上的批量评估: 前向与后处理(filter_detections)在设备上按批完成,
+    匹配与 AP 计算见 match_detections / MetricAccumulator.
+    """
+
+    def __init__(self, anno_txt_path, img_size=None, batch_size=None, conf_thresh=None, nms_thresh=None,
+                 iou_thresholds=IOU_THRESHOLDS, use_cache=None):
+        self.anno_txt_path = anno_txt_path
+        self.img_size = img_size or cfg.VAL['TEST_IMG_SIZE']
+        self.batch_size = batch_size or cfg.VAL['BATCH_SIZE']
+        self.conf_thresh = cfg.VAL['CONF_THRESH'] if conf_thresh is None else conf_thresh
+        self.nms_thresh = cfg.VAL['NMS_THRESH'] if nms_thresh is None else nms_thresh
+        self.iou_thresholds = np.asarray(iou_thresholds)
+        self.samples = load_eval_samples(anno_txt_path, self.img_size, use_cache)
+
+    def evaluate(self, model, device=None, detector=None):
+        """
+        :param model: BuildModel, 评估期间切到 eval 模式, 结束后恢复原模式
+        :param detector: imgs -> list of [k, 6], 不为 None 时代替 model 的前向与后处理(如 utils.tta.TTAEngine)
+        :return: MetricAccumulator.compute() 的结果, 另含 'seconds'
+        """
+        from utils.postprocess import filter_detections, split_batch_predictions
+
+        device = device or next(model.parameters()).device
+        was_training = model.training
+        model.eval()
+        start = time.perf_counter()
+        accumulator = MetricAccumulator(cfg.Customer_DATA['NUM'], self.iou_thresholds)
+        try:
+            for i in range(0, len(self.samples), self.batch_size):
+                samples = [self.samples[j] for j in range(i, min(i + self.batch_size, len(self.samples)))]
+                imgs = torch.from_numpy(np.stack([img for img, _ in samples])).permute(0, 3, 1, 2)
+                imgs = imgs.to(device, dtype=torch.float32, non_blocking=True)
+                if detector is not None:
+                    detections = detector(imgs)
+                else:
+                    with torch.no_grad():
+                        pred = split_batch_predictions(model(imgs)[1], len(imgs), self.img_size)
+                    detections = filter_detections(pred, self.conf_thresh, self.nms_thresh, score_with_cls=True,
+                                                   clip_size=self.img_size)
+                for det, (_, gt) in zip(detections, samples):
+                    accumulator.add(det.cpu().numpy(), gt)
+        finally:
+            model.train(was_training)
+        metrics = accumulator.compute(cfg.Customer_DATA['CLASSES'])
+        metrics['seconds'] = time.perf_counter() - start
+        return metrics
+
+
+def ap50_by_size(model, batches, conf_thresh=None, nms_thresh=None, iou_thresh=0.5, detector=None):
+    """
+    按目标尺寸分组的 AP50: 预测与所有真值贪心匹配, 命中的预测计入真值所在的组, 未命中的按自身尺寸计入.
+    :param detector: imgs -> list of [k, 6] 检测(如 utils.tta.TTAEngine), 不为 None 时代替 model 的前向与后处理
+    :return: {'all': ap, 'small': ap, 'medium': ap, 'large': ap}
+    """
+    from utils.postprocess import filter_detections, split_batch_predictions
+
+    conf_thresh = cfg.VAL["CONF_THRESH"] if conf_thresh is None else conf_thresh
+    nms_thresh = cfg.VAL["NMS_THRESH"] if nms_thresh is None else nms_thresh
+    img_size = cfg.VAL["TEST_IMG_SIZE"]
+    records = {name: ([], []) for name in ['all'] + list(SIZE_BINS)}
+    num_gt = dict.fromkeys(records, 0)
+    for imgs, gts in batches:
+        if detector is not None:
+            detections = detector(imgs)
+        else:
+            with torch.no_grad():
+                pred = split_batch_predictions(model(imgs)[1], len(imgs), img_size)
+            detections = filter_detections(pred, conf_thresh, nms_thresh, score_with_cls=True, clip_size=img_size)
+        for det, gt in zip(detections, gts):
+            det = det.cpu().numpy()
+            gt_bins = size_bin(gt[:, :4])
+            num_gt['all'] += len(gt)
+            for name in SIZE_BINS:
+                num_gt[name] += int(np.sum(gt_bins == name))
+            iou = box_iou_numpy(det[:, :4], gt[:, :4])
+            iou[det[:, 5, None] != gt[None, :, 4]] = 0.0
+            match = greedy_match(iou, det[:, 4], [iou_thresh])[:, 0]
+            hit = match >= 0
+            bins = size_bin(det[:, :4])
+            bins[hit] = gt_bins[match[hit]]
+            for key, selected in [('all', slice(None))] + [(name, bins == name) for name in SIZE_BINS]:
+                records[key][0].extend(det[selected, 4])
+                records[key][1].extend(hit[selected])
+    return {name: average_precision(scores, tps, num_gt[name]) for name, (scores, tps) in records.items()}
+
+
+def fold_annotation_files(split='test', txt_dir=None):
+    """xml_to_txt 生成的 fold*_{split}.txt, 按折序号排序"""
+    txt_dir = txt_dir or FOLD_TXT_DIR
+    paths = glob.glob(os.path.join(txt_dir, f'fold*_{split}.txt'))
+    return sorted(paths, key=lambda p: int(os.path.basename(p)[4:].split('_')[0]))
+
+
+def _load_model(weights, device):
+    from model.model import BuildModel
+
+    model = BuildModel().to(device)
+    state = torch.load(weights, map_location=device) if isinstance(weights, str) else weights
+    model.load_state_dict(state['model'] if isinstance(state, dict) and 'model' in state else state)
+    return model.eval()
+
+
+def _evaluate_fold(anno_txt_path, weight_path, device, num_threads, kwargs):
+    torch.set_num_threads(num_threads)
+    device = torch.device(device)
+    model = _load_model(weight_path, device)
+    return Evaluator(anno_txt_path, **kwargs).evaluate(model, device)
+
+
+def _devices(count):
+    if torch.cuda.is_available():
+        return [f'cuda:{i % torch.cuda.device_count()}' for i in range(count)]
+    return ['cpu'] * count
+
+
+def evaluate_folds(weight_paths, fold_files=None, processes=None, **kwargs):
+    """
+    各折在独立进程中并行评估(多 GPU 时轮流分配设备, CPU 上平分线程)
+    :param weight_paths: 所有折共用的一个权重文件, 或与 fold_files 一一对应的列表
+    :return: {'folds': [{'fold', 'anno', metrics...}], 'mean': {...}, 'std': {...}}
+    """
+    fold_files = fold_files or fold_annotation_files()
+    assert fold_files, f"No fold annotation files in {FOLD_TXT_DIR}, run utils/xml_to_txt.py first"
+    if isinstance(weight_paths, str):
+        weight_paths = [weight_paths] * len(fold_files)
+    assert len(weight_paths) == len(fold_files), "one weight file per fold expected"
+    processes = min(processes or cfg.VAL['EVAL_PROCESSES'], len(fold_files))
+    devices = _devices(len(fold_files))
+    num_threads = max(1, (os.cpu_count() or 1) // processes)
+    # spawn: 子进程不继承父进程的 CUDA 上下文
+    with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = [pool.submit(_evaluate_fold, anno, weights, device, num_threads, kwargs)
+                   for anno, weights, device in zip(fold_files, weight_paths, devices)]
+        folds = [dict(fold=i, anno=anno, **future.result())
+                 for i, (anno, future) in enumerate(zip(fold_files, futures))]
+    summary = {'folds': folds, 'mean': {}, 'std': {}}
+    for key in ('mAP50', 'mAP50_95', 'precision', 'recall', 'f1', 'seconds'):
+        values = np.array([fold[key] for fold in folds], dtype=np.float64)
+        summary['mean'][key], summary['std'][key] = float(np.nanmean(values)), float(np.nanstd(values))
+    return summary
+
+
+_worker = {}
+
+
+def _init_async_worker(anno_txt_path, device, num_threads, kwargs):
+    torch.set_num_threads(num_threads)
+    _worker['device'] = torch.device(device)
+    _worker['evaluator'] = Evaluator(anno_txt_path, **kwargs)
+
+
+def _evaluate_async(epoch, state_dict):
+    device = _worker['device']
+    model = _worker.get('model')
+    if model is None:
+        model = _worker['model'] = _load_model(state_dict, device)
+    else:
+        model.load_state_dict(state_dict)
+    return epoch, _worker['evaluator'].evaluate(model, device)
+
+
+class AsyncEvaluator(object):
+    """
+    训练中每 EVAL_EPOCH 轮的评估放到一个常驻的评估进程: submit 只把权重拷到 CPU 后交给该进程,
+    训练进程不等待; 评估进程首次启动时加载样本与模型, 之后每次只更新权重.
+    """
+
+    def __init__(self, anno_txt_path, device=None, num_threads=None, **kwargs):
+        device = device or cfg.VAL['EVAL_DEVICE']
+        num_threads = num_threads or max(1, (os.cpu_count() or 1) // 4)
+        self.__pool = ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn'),
+                                          initializer=_init_async_worker,
+                                          initargs=(anno_txt_path, device, num_threads, kwargs))
+        self.__pending = []
+
+    def submit(self, epoch, model):
+        state_dict = {k: v.detach().cpu() for k, v in model.state_dict().items()}
+        future = self.__pool.submit(_evaluate_async, epoch, state_dict)
+        self.__pending.append(future)
+        return future
+
+    def results(self, wait=False):
+        """:return: 已完成的 [(epoch, metrics)], wait 为 True 时等待全部完成"""
+        done = [f for f in self.__pending if wait or f.done()]
+        self.__pending = [f for f in self.__pending if f not in done]
+        return [f.result() for f in done]
+
+    def close(self):
+        self.__pool.shutdown(wait=True)
+
+
+def print_summary(summary):
+    print(f"{'fold':>4} {'images':>7} {'mAP50':>7} {'mAP50:95':>9} {'P':>7} {'R':>7} {'F1':>7} {'conf':>6} {'s':>6}")
+    for fold in summary['folds']:
+        conf = fold['conf_thresh'] if fold['conf_thresh'] is not None else float('nan')
+        print(f"{fold['fold']:>4} {fold['num_images']:>7} {fold['mAP50']:>7.4f} {fold['mAP50_95']:>9.4f} "
+              f"{fold['precision']:>7.4f} {fold['recall']:>7.4f} {fold['f1']:>7.4f} {conf:>6.3f} "
+              f"{fold['seconds']:>6.1f}")
+    mean, std = summary['mean'], summary['std']
+    print(f"mean mAP50 {mean['mAP50']:.4f} ± {std['mAP50']:.4f}, "
+          f"mAP50:95 {mean['mAP50_95']:.4f} ± {std['mAP50_95']:.4f}, F1 {mean['f1']:.4f} ± {std['f1']:.4f}")
+
+
+if __name__ == "__main__":
+    # 在 astroyolo 目录下运行: python -m utils.evaluator weight_path [fold1_weight ...] [--json report.json]
+    # 只给一个权重时所有折共用; 给 k 个时与 fold0..fold{k-1} 一一对应
+    args = sys.argv[1:]
+    json_path = None
+    if '--json' in args:
+        json_path = args[args.index('--json') + 1]
+        args = args[:args.index('--json')] + args[args.index('--json') + 2:]
+    summary = evaluate_folds(args[0] if len(args) == 1 else args)
+    print_summary(summary)
+    if json_path:
+        with open(json_path, 'w') as f:
+            json.dump(summary, f, indent=2)
@@ -1,14 +1,23 @@
+import hashlib
+import io
 import math
 import os
+import re
+import threading
 import warnings
-from typing import Dict
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
 
 import cv2
 import numpy as np
 from astropy.io import fits
 from astropy.utils.exceptions import AstropyWarning
 from astropy.visualization import MinMaxInterval, SqrtStretch
+from astropy.wcs import WCS
 from reproject import reproject_interp
+from scipy.ndimage import map_coordinates
+
+import config.model_config as cfg
 
 
 def create_dir(path):
@@ -40,7 +49,7 @@ def fits_reproject(fits_path_obj: Dict, a: int = 70, n_samples: int = 500, contr
     for fits_path in fits_path_obj['fits_without_target_path']:
         warnings.simplefilter('ignore', AstropyWarning)
         hdu = fits.open(fits_path)[0]
-        reprojected_data, reprojected_footprint = reproject_interp(hdu, target_header)
+        reprojected_data = reproject_with_plan(hdu.data, hdu.header, target_header, target_data.shape)
         reprojected_data = SqrtStretch()(MinMaxInterval()(reprojected_data, clip=False))
         stack_img = np.concatenate((stack_img, np.expand_dims(reprojected_data, axis=-1)), axis=-1)
     # NaN to 0
@@ -48,6 +57,262 @@ def fits_reproject(fits_path_obj: Dict, a: int = 70, n_samples: int = 500, contr
     return np.asarray(stack_img.transpose((2, 1, 0)), dtype=np.float32)
 
 
+def read_fits_image(source, hdu_index=None) -> Tuple[np.ndarray, fits.Header]:
+    """
+    Open a FITS file with memmap=True and return the first HDU holding image data
+    :param source: file path or raw bytes (bytes cannot be memory-mapped)
+    :param hdu_index: explicit HDU index, default: first HDU with >= 2 dimensions
+    :return: (H x W data, header)
+    """
+    warnings.simplefilter('ignore', AstropyWarning)
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    # The data is copied out before the file is closed, so neither the handle nor the memmap outlives the call;
+    # with memmap=True only the selected plane is read from disk.
+    with fits.open(source, memmap=True) as hdul:
+        hdus = hdul if hdu_index is None else [hdul[hdu_index]]
+        for hdu in hdus:
+            if hdu.data is not None and hdu.data.ndim >= 2:
+                data = hdu.data
+                if data.ndim > 2:
+                    # data cube: use the first plane
+                    data = data.reshape((-1,) + data.shape[-2:])[0]
+                return np.array(data), hdu.header.copy()
+    raise ValueError('No image data found in FITS file')
+
+
+def read_fits_header(source, hdu_index=None) -> fits.Header:
+    """
+    Header of the HDU read_fits_image would return, without reading any pixel data
+    :param source: file path or raw bytes
+    :param hdu_index: explicit HDU index, default: first image HDU with >= 2 non-empty dimensions
+    """
+    warnings.simplefilter('ignore', AstropyWarning)
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    with fits.open(source, memmap=True) as hdul:
+        hdus = hdul if hdu_index is None else [hdul[hdu_index]]
+        for hdu in hdus:
+            naxis = hdu.header.get('NAXIS', 0)
+            if hdu.is_image and naxis >= 2 and all(hdu.header.get(f'NAXIS{i}', 0) > 0 for i in range(1, naxis + 1)):
+                return hdu.header.copy()
+    raise ValueError('No image data found in FITS file')
+
+
+def stretch_fits(data: np.ndarray) -> np.ndarray:
+    """
+    MinMaxInterval + SqrtStretch to [0, 1] with NaN set to 0, same as fits_reproject
+    :return: H x W float32 array
+    """
+    data = SqrtStretch()(MinMaxInterval()(np.asarray(data, dtype=np.float32), clip=False))
+    return np.nan_to_num(np.asarray(data, dtype=np.float32), nan=0.0)
+
+
+def _wcs_key(header: fits.Header) -> str:
+    return WCS(header).celestial.to_header_string(relax=True)
+
+
+class ReprojectionPlan(object):
+    """
+    Pixel mapping from a target WCS grid back to a source image, i.e. the part of
+    reproject_interp that only depends on the two WCS and the shapes. Applying a plan is a
+    single bilinear map_coordinates call, so every later image observed with the same pair
+    of headers skips the WCS transforms entirely.
+    """
+
+    def __init__(self, coords: np.ndarray):
+        """
+        :param coords: 2 x H x W float32 array of (row, col) source pixel coordinates
+        """
+        self.coords = coords
+
+    @classmethod
+    def build(cls, source_header: fits.Header, target_header: fits.Header, shape_out: Tuple[int, int],
+              shape_in: Tuple[int, int]):
+        source_wcs = WCS(source_header).celestial
+        target_wcs = WCS(target_header).celestial
+        rows, cols = np.mgrid[0:shape_out[0], 0:shape_out[1]]
+        world = target_wcs.pixel_to_world_values(cols, rows)
+        source_cols, source_rows = source_wcs.world_to_pixel_values(*world)
+        coords = np.stack([source_rows, source_cols]).astype(np.float32)
+        # Same edge handling as reproject's map_coordinates: the outer half of the border pixels
+        # takes the border value, anything further out (or NaN) is outside the footprint
+        outside = ~np.isfinite(coords).all(axis=0)
+        for axis, size in enumerate(shape_in):
+            c = coords[axis]
+            outside |= (c < -0.5) | (c > size - 0.5)
+            c[(c >= -0.5) & (c < 0)] = 0
+            c[(c >= size - 1) & (c <= size - 0.5)] = size - 1
+        coords[:, outside] = -2  # map_coordinates returns cval there
+        return cls(coords)
+
+    def apply(self, data: np.ndarray) -> np.ndarray:
+        """
+        Bilinear interpolation like reproject_interp (order=1), NaN outside the source footprint
+        :return: H x W float32 array on the target grid
+        """
+        return map_coordinates(np.asarray(data, dtype=np.float32), self.coords, order=1,
+                               mode='constant', cval=np.nan)
+
+
+PLAN_VERSION = 'plan-v2'  # part of the plan key, so plans persisted without edge handling are not reused
+_plan_cache = OrderedDict()
+_plan_lock = threading.Lock()
+
+
+def get_reprojection_plan(source_header: fits.Header, target_header: fits.Header, shape_out: Tuple[int, int],
+                          shape_in: Tuple[int, int]) -> ReprojectionPlan:
+    """
+    Reprojection plan keyed by (source WCS, target WCS, output shape, input shape).
+    Plans are kept in an in-memory LRU and persisted as .npy under cfg.FITS['PLAN_CACHE_DIR'],
+    so they survive restarts and are shared between worker processes (loaded with mmap).
+    """
+    key_str = '\n'.join([PLAN_VERSION, _wcs_key(source_header), _wcs_key(target_header), str(tuple(shape_out)),
+                         str(tuple(shape_in))])
+    key = hashlib.sha1(key_str.encode('utf-8')).hexdigest()
+    with _plan_lock:
+        if key in _plan_cache:
+            _plan_cache.move_to_end(key)
+            return _plan_cache[key]
+
+    cache_dir = cfg.FITS['PLAN_CACHE_DIR']
+    plan_path = os.path.join(cache_dir, f'{key}.npy') if cache_dir else None
+    if plan_path and os.path.exists(plan_path):
+        plan = ReprojectionPlan(np.load(plan_path, mmap_mode='r'))
+    else:
+        plan = ReprojectionPlan.build(source_header, target_header, shape_out, shape_in)
+        if plan_path:
+            create_dir(cache_dir)
+            tmp_path = f'{plan_path}.{os.getpid()}.tmp.npy'
+            np.save(tmp_path, plan.coords)
+            os.replace(tmp_path, plan_path)
+
+    with _plan_lock:
+        _plan_cache[key] = plan
+        while len(_plan_cache) > cfg.FITS['PLAN_CACHE_SIZE']:
+            _plan_cache.popitem(last=False)
+    return plan
+
+
+def reproject_with_plan(data: np.ndarray, header: fits.Header, target_header: fits.Header,
+                        shape_out: Tuple[int, int]) -> np.ndarray:
+    """Drop-in replacement for reproject_interp((data, header), target_header, shape_out)[0]"""
+    return get_reprojection_plan(header, target_header, shape_out, data.shape).apply(data)
+
+
+_reprojected_cache = OrderedDict()
+_reprojected_lock = threading.Lock()
+
+
+def reproject_band(fits_path: str, target_header: fits.Header, target_shape: Tuple[int, int]) -> np.ndarray:
+    """
+    Reproject one band onto the target WCS. Results are kept in an LRU cache keyed by
+    (file, mtime, target WCS, shape), so re-running a field does not reproject it again.
+    :return: H x W reprojected data (not stretched)
+    """
+    target_wcs = WCS(target_header).to_header_string()
+    key = (os.path.abspath(fits_path), os.path.getmtime(fits_path), target_wcs, tuple(target_shape))
+    with _reprojected_lock:
+        if key in _reprojected_cache:
+            _reprojected_cache.move_to_end(key)
+            return _reprojected_cache[key]
+    data, header = read_fits_image(fits_path)
+    reprojected_data = reproject_with_plan(data, header, target_header, tuple(target_shape))
+    with _reprojected_lock:
+        _reprojected_cache[key] = reprojected_data
+        while len(_reprojected_cache) > cfg.FITS['REPROJECT_CACHE_SIZE']:
+            _reprojected_cache.popitem(last=False)
+    return reprojected_data
+
+
+def load_fits_cube(fits_paths: List[str], target_index: int = 0) -> np.ndarray:
+    """
+    Stack the bands of one field into an H x W x C cube on the WCS grid of fits_paths[target_index]
+    :param fits_paths: band files in channel order
+    :return: H x W x C float32 array in [0, 1], C = max(3, number of bands)
+    """
+    target_data, target_header = read_fits_image(fits_paths[target_index])
+    layers = []
+    for i, fits_path in enumerate(fits_paths):
+        if i == target_index:
+            layers.append(stretch_fits(target_data))
+        else:
+            layers.append(stretch_fits(reproject_band(fits_path, target_header, target_data.shape)))
+    if len(layers) == 2:
+        # The model takes 3 channels: a 2-band group gets their mean as the third channel
+        layers.append((layers[0] + layers[1]) / 2)
+    return np.stack(layers, axis=-1)
+
+
+def load_fits_image(source) -> np.ndarray:
+    """
+    Load a single-band FITS (path or bytes) or a multi-band group
+    :param source: path, bytes, or {'fits_paths': [...], 'target_index': int} (see group_fits_bands)
+    :return: H x W x C float32 array in [0, 1], C = 1 for a single band, otherwise see load_fits_cube
+    """
+    if isinstance(source, dict):
+        return load_fits_cube(source['fits_paths'], source.get('target_index', 0))
+    data, _ = read_fits_image(source)
+    return stretch_fits(data)[..., None]
+
+
+def fits_wcs(source) -> Optional[WCS]:
+    """
+    Celestial WCS of the pixel grid load_fits_image returns for the same source; only the header is read
+    :param source: path, bytes, or a band group dict (the WCS of the target band)
+    :return: celestial WCS, None when the header has no usable celestial WCS
+    """
+    if isinstance(source, dict):
+        source = source['fits_paths'][source.get('target_index', 0)]
+    try:
+        header = read_fits_header(source)
+        wcs = WCS(header).celestial
+    except (OSError, ValueError):
+        return None
+    return wcs if wcs.has_celestial else None
+
+
+def pixel_to_sky(wcs: WCS, x: np.ndarray, y: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Image coordinates (pixel i spans [i, i + 1), as detection boxes do) to (RA, Dec) in degrees
+    """
+    world = wcs.pixel_to_world_values(np.asarray(x, dtype=np.float64) - 0.5, np.asarray(y, dtype=np.float64) - 0.5)
+    return np.asarray(world[wcs.wcs.lng]), np.asarray(world[wcs.wcs.lat])
+
+
+_band_pattern = re.compile(r'(?<=[-_.])([A-Za-z])(?=[-_.])')
+
+
+def group_fits_bands(filenames: List[str], bands: List[str] = None, target_band: str = None) -> List[Tuple]:
+    """
+    Group multi-band FITS of the same field by the band letter in the file name,
+    e.g. frame-g-001000-1-0027.fits, frame-r-001000-1-0027.fits, frame-i-001000-1-0027.fits.
+    Files without a band letter, or groups missing a band, are returned as single-band groups.
+    :return: list of (group_name, [filename in band order], target_index)
+    """
+    bands = bands or cfg.FITS['BANDS']
+    target_band = target_band or cfg.FITS['TARGET_BAND']
+    groups = OrderedDict()
+    singles = []
+    for filename in sorted(filenames):
+        match = next((m for m in _band_pattern.finditer(filename) if m.group(1) in bands), None)
+        if match is None:
+            singles.append(filename)
+            continue
+        key = filename[:match.start()] + '{}' + filename[match.end():]
+        groups.setdefault(key, {})[match.group(1)] = filename
+
+    result = []
+    for key, members in groups.items():
+        if all(band in members for band in bands):
+            target_index = bands.index(target_band) if target_band in bands else 0
+            result.append((key.format(''.join(bands)), [members[band] for band in bands], target_index))
+        else:
+            singles.extend(members.values())
+    result.extend((filename, [filename], 0) for filename in sorted(singles))
+    return result
+
+
 def save_nan_error_img(fits_ndarr: np.ndarray) -> None:
     print(np.min(fits_ndarr), np.max(fits_ndarr))
     print(np.sum(np.isnan(fits_ndarr)))
@@ -82,3 +347,27 @@ def save_bbox_img(save_path: str, fits_name: str, fits_ndarr: np.ndarray, pred_b
     except Exception as e:
         print('[Warning]: save pred img failed: {}'.format(e))
         pass
+
+
+if __name__ == "__main__":
+    # python fits_operator.py target.fits band1.fits [band2.fits ...]
+    # Compare reproject_interp with the cached reprojection plan on real survey frames
+    import sys
+    import time
+
+    target_data, target_header = read_fits_image(sys.argv[1])
+    for fits_path in sys.argv[2:]:
+        data, header = read_fits_image(fits_path)
+        start = time.perf_counter()
+        expected, _ = reproject_interp((data, header), target_header, shape_out=target_data.shape)
+        interp_time = time.perf_counter() - start
+        start = time.perf_counter()
+        plan = get_reprojection_plan(header, target_header, target_data.shape, data.shape)
+        build_time = time.perf_counter() - start
+        start = time.perf_counter()
+        actual = plan.apply(data)
+        apply_time = time.perf_counter() - start
+        valid = np.isfinite(expected) & np.isfinite(actual)
+        print('{}: reproject_interp {:.3f}s, plan build {:.3f}s, plan apply {:.3f}s, max abs diff {:.3g}'.format(
+            os.path.basename(fits_path), interp_time, build_time, apply_time,
+            np.abs(expected[valid] - actual[valid]).max() if valid.any() else 0.0))
@@ -2,6 +2,8 @@ import numpy as np
 import torch
 import torch.nn as nn
 
+from model.attention import attention_flops
+
 
 def get_model_complexity_info(
         model, input_res, print_per_layer_stat=True, as_strings=True, channel=3
@@ -57,13 +59,11 @@ def print_model_with_flops(model, units="GMac", precision=3):
     total_flops = model.compute_average_flops_cost()
 
     def accumulate_flops(self):
-        if is_supported_instance(self):
-            return self.__flops__ / model.__batch_counter__
-        else:
-            sum = 0
-            for m in self.children():
-                sum += m.accumulate_flops()
-            return sum
+        # MultiheadAttention 在 sdpa/window 模式下 out_proj 由子模块自身计数, 这里把子模块一并累加
+        sum = self.__flops__ / model.__batch_counter__ if is_supported_instance(self) else 0
+        for m in self.children():
+            sum += m.accumulate_flops()
+        return sum
 
     def flops_repr(self):
         accumulated_flops_cost = self.accumulate_flops()
@@ -210,6 +210,10 @@ def is_supported_instance(module):
                     torch.nn.Upsample,
                     nn.AdaptiveMaxPool2d,
                     nn.AdaptiveAvgPool2d,
+                    nn.MultiheadAttention,
+                    nn.LayerNorm,
+                    nn.GELU,
+                    nn.Mish,
             ),
     ):
         return True
@@ -236,9 +240,9 @@ def relu_flops_counter_hook(module, input, output):
 
 
 def linear_flops_counter_hook(module, input, output):
+    # 输入可为 [..., in_features](如 Transformer 的 [b, n, c]), 每个输出元素 in_features 次乘加
     input = input[0]
-    batch_size = input.shape[0]
-    module.__flops__ += batch_size * input.shape[1] * output.shape[1]
+    module.__flops__ += output.numel() * input.shape[-1]
 
 
 def pool_flops_counter_hook(module, input, output):
@@ -256,6 +260,24 @@ def bn_flops_counter_hook(module, input, output):
     module.__flops__ += batch_flops
 
 
+def layernorm_flops_counter_hook(module, input, output):
+    input = input[0]
+    batch_flops = np.prod(input.shape)
+    if module.elementwise_affine:
+        batch_flops *= 2
+    module.__flops__ += batch_flops
+
+
+def multihead_attention_flops_counter_hook(module, input, output):
+    # 只有直接调用 nn.MultiheadAttention.forward(attention 模式为 mha)时触发, 此时 out_proj 不经过其模块 hook;
+    # sdpa/window 模式由 model.attention.efficient_attention 调用 attention_flops 计数
+    query, key, value = input[:3]
+    seq_dim = 1 if module.batch_first else 0
+    batch_size, num_queries, num_keys = query.shape[1 - seq_dim], query.shape[seq_dim], key.shape[seq_dim]
+    module.__flops__ += attention_flops(module, query, key, value, batch_size * num_queries, num_keys)
+    module.__flops__ += batch_size * num_queries * module.embed_dim * module.embed_dim
+
+
 def conv_flops_counter_hook(conv_module, input, output):
     # Can have multiple inputs, getting the first one
     input = input[0]
@@ -339,6 +361,8 @@ def add_flops_counter_hook_function(module):
                         torch.nn.ELU,
                         torch.nn.LeakyReLU,
                         torch.nn.ReLU6,
+                        nn.GELU,
+                        nn.Mish,
                 ),
         ):
             handle = module.register_forward_hook(relu_flops_counter_hook)
@@ -358,6 +382,10 @@ def add_flops_counter_hook_function(module):
             handle = module.register_forward_hook(bn_flops_counter_hook)
         elif isinstance(module, torch.nn.Upsample):
             handle = module.register_forward_hook(upsample_flops_counter_hook)
+        elif isinstance(module, nn.LayerNorm):
+            handle = module.register_forward_hook(layernorm_flops_counter_hook)
+        elif isinstance(module, nn.MultiheadAttention):
+            handle = module.register_forward_hook(multihead_attention_flops_counter_hook)
         else:
             handle = module.register_forward_hook(empty_flops_counter_hook)
         module.__flops_handle__ = handle
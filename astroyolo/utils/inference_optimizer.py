@@ -0,0 +1,165 @@
+# coding=utf-8
+import sys
+import time
+
+sys.path.append("..")
+import torch
+import torch.nn as nn
+
+import config.model_config as cfg
+from model.layers import CBL, CBM
+from utils.model_registry import model_nbytes
+from utils.torch_utils import fuse_conv_and_bn
+
+OPTIMIZE_MODES = ('none', 'fuse', 'torchscript', 'compile')
+
+
+def fuse_model(model):
+    """
+    把 backbone、SpatialPyramidPooling、PANet 与 PredictNet 中所有 CBM/CBL 的 Conv+BN 融合为一个卷积,
+    BN 替换为 nn.Identity. 只能用于 eval 模式(使用 BN 的 running 统计量), 原地修改并返回 model.
+    :return: (model, 融合的层数)
+    """
+    count = 0
+    for module in model.modules():
+        if isinstance(module, (CBM, CBL)) and isinstance(module.bn, nn.BatchNorm2d):
+            module.conv2d = fuse_conv_and_bn(module.conv2d, module.bn)
+            module.bn = nn.Identity()
+            count += 1
+    return model, count
+
+
+def example_input(device, batch_size=1, img_size=None):
+    img_size = img_size or cfg.VAL["TEST_IMG_SIZE"]
+    return torch.rand((batch_size, 3, img_size, img_size), device=device)
+
+
+def max_abs_diff(model_a, model_b, inputs):
+    """两个模型解码输出 p_d 的最大绝对误差与是否在容差内(rtol/atol 见 cfg.INFERENCE['OPTIMIZE_TOL'])"""
+    rtol, atol = cfg.INFERENCE["OPTIMIZE_TOL"]
+    with torch.no_grad():
+        _, p_a = model_a(inputs)
+        _, p_b = model_b(inputs)
+    return (p_a - p_b).abs().max().item(), torch.allclose(p_a, p_b, rtol=rtol, atol=atol)
+
+
+class OptimizedModel(nn.Module):
+    """
+    包装 TorchScript / torch.compile 得到的模型, 调用方式与 eval 模式的 BuildModel 相同.
+    冻结后的 TorchScript 不再暴露参数, 因此记下优化前的字节数供 ModelRegistry 计算内存预算.
+    """
+
+    def __init__(self, module, mode, nbytes):
+        super(OptimizedModel, self).__init__()
+        self.module = module
+        self.mode = mode
+        self.nbytes = nbytes
+        self.eval()
+
+    def forward(self, x):
+        return self.module(x)
+
+
+def optimize_for_inference(model, device, mode=None, check=True):
+    """
+    推理优化:
+    1、Conv+BN 融合(所有模式, 'none' 除外);
+    2、'torchscript': 用 torch.jit.trace 追踪并 torch.jit.freeze 冻结, 常量折叠后省去 Python 调度开销;
+    3、'compile': torch.compile(后端见 cfg.INFERENCE['COMPILE_BACKEND']), 首次调用时编译.
+    check=True 时在随机输入上与原始 eager 模型比较解码输出, 超出容差或追踪/编译失败时退回到更保守的模式.
+    :param model: eval 模式的 BuildModel
+    :return: 可直接调用的模型, 输出与 BuildModel 相同 (p, p_d)
+    """
+    mode = mode or cfg.INFERENCE["OPTIMIZE"]
+    assert mode in OPTIMIZE_MODES, f"Error: optimize mode must be in {OPTIMIZE_MODES}"
+    if mode == 'none':
+        return model
+
+    model.eval()
+    nbytes = model_nbytes(model)
+    inputs = example_input(device)
+    reference = None
+    if check:
+        with torch.no_grad():
+            reference = model(inputs)[1]
+
+    def matches(candidate, name):
+        if reference is None:
+            return True
+        with torch.no_grad():
+            p_d = candidate(inputs)[1]
+        rtol, atol = cfg.INFERENCE["OPTIMIZE_TOL"]
+        if torch.allclose(reference, p_d, rtol=rtol, atol=atol):
+            return True
+        print(f"{name} 输出与 eager 模型不一致(最大误差 {(reference - p_d).abs().max().item():.3g}), 放弃该优化")
+        return False
+
+    fused, count = fuse_model(model)
+    if not matches(fused, "Conv+BN 融合"):
+        # 融合是原地修改, 无法退回时只能报错, 避免静默地用错误的模型服务
+        raise RuntimeError("Conv+BN 融合后的输出超出容差")
+    print(f"已融合 {count} 个 Conv+BN 层")
+    if mode == 'fuse':
+        return fused
+
+    try:
+        with torch.no_grad():
+            if mode == 'torchscript':
+                traced = torch.jit.trace(fused, inputs, check_trace=False)
+                optimized = torch.jit.freeze(traced)
+            else:
+                optimized = torch.compile(fused, backend=cfg.INFERENCE["COMPILE_BACKEND"], dynamic=True)
+                optimized(inputs)  # 触发编译
+    except Exception as e:
+        print(f"{mode} 优化失败, 使用融合后的 eager 模型: {str(e)}")
+        return fused
+
+    optimized = OptimizedModel(optimized, mode, nbytes)
+    if not matches(optimized, mode):
+        return fused
+    return optimized
+
+
+def benchmark_latency(model, inputs, warmup=3, runs=20):
+    """平均单次前向耗时(ms)"""
+    with torch.no_grad():
+        for _ in range(warmup):
+            model(inputs)
+        if inputs.is_cuda:
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        for _ in range(runs):
+            model(inputs)
+        if inputs.is_cuda:
+            torch.cuda.synchronize()
+    return (time.perf_counter() - start) / runs * 1000
+
+
+if __name__ == "__main__":
+    # python inference_optimizer.py [weight_path] [batch_size]
+    import copy
+
+    from model.model import BuildModel
+
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    weight_path = sys.argv[1] if len(sys.argv) > 1 else None
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else cfg.INFERENCE["BATCH_SIZE"]
+
+    eager = BuildModel().to(device)
+    if weight_path:
+        state = torch.load(weight_path, map_location=device)
+        eager.load_state_dict(state['model'] if isinstance(state, dict) and 'model' in state else state)
+    eager.eval()
+    inputs = example_input(device, batch_size)
+
+    rtol, atol = cfg.INFERENCE["OPTIMIZE_TOL"]
+    print(f"device={device}, batch={batch_size}, img_size={cfg.VAL['TEST_IMG_SIZE']}, tol: rtol={rtol} atol={atol}")
+    eager_ms = benchmark_latency(eager, inputs)
+    print(f"{'eager':>12}: {eager_ms:8.2f} ms")
+    for mode in OPTIMIZE_MODES[1:]:
+        if mode == 'compile' and not hasattr(torch, 'compile'):
+            continue
+        optimized = optimize_for_inference(copy.deepcopy(eager), device, mode)
+        diff, ok = max_abs_diff(eager, optimized, inputs)
+        ms = benchmark_latency(optimized, inputs)
+        print(f"{mode:>12}: {ms:8.2f} ms  x{eager_ms / ms:.2f}  max|diff|={diff:.3g}  {'OK' if ok else 'MISMATCH'}")
@@ -0,0 +1,261 @@
+# coding=utf-8
+import json
+import multiprocessing
+import os
+import threading
+import time
+import traceback
+
+JOB_FILE = 'job.json'
+TASK_INFO_FILE = 'task_info.json'
+CANCEL_FILE = 'CANCEL'
+
+# 作业状态
+QUEUED = 'queued'
+RUNNING = 'running'
+COMPLETED = 'completed'
+CANCELLED = 'cancelled'
+FAILED = 'failed'
+FINISHED_STATES = (COMPLETED, CANCELLED, FAILED)
+
+
+def write_json_atomic(path, obj):
+    """先写临时文件再替换, 读取方不会读到写了一半的 JSON"""
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(obj, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def read_json(path, default=None):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def index_task(store, task_info, results_from=0):
+    """同步写入任务索引(utils.task_store.TaskStore); 索引出错不影响任务本身, task_info.json 仍是权威数据"""
+    if store is None:
+        return
+    try:
+        store.upsert(task_info, results_from)
+    except Exception as e:
+        print(f"写入任务索引失败 {task_info.get('task_id')}: {e}")
+
+
+def create_task_dir(output_dir):
+    """
+    按 task_<timestamp> 的目录约定创建任务目录; 同一秒内的多个任务顺延时间戳以避免冲突
+    :return: (task_id, task_dir)
+    """
+    timestamp = int(time.time())
+    while True:
+        task_id = f"task_{timestamp}"
+        task_dir = os.path.join(output_dir, task_id)
+        try:
+            os.makedirs(task_dir)
+            return task_id, task_dir
+        except FileExistsError:
+            timestamp += 1
+
+
+class TaskRecorder(object):
+    """
+    逐文件记录任务结果并增量写入 task_info.json, 同时把摘要与新增的逐文件记录写入任务索引(store).
+    写入按时间节流(默认每秒至多一次), 避免大数据集时反复重写整个结果列表.
+    """
+
+    def __init__(self, task_dir, task_info, total, flush_interval=1.0, store=None):
+        self.task_dir = task_dir
+        self.store = store
+        self.info_path = os.path.join(task_dir, TASK_INFO_FILE)
+        self.task_info = dict(task_info)
+        self.task_info.update({
+            'status': RUNNING,
+            'files_count': 0,
+            'detection_count': 0,
+            'success_count': 0,
+            'progress': {'processed': 0, 'total': total},
+            'results': [],
+        })
+        self.flush_interval = flush_interval
+        self.__last_flush = 0.0
+        self.__indexed = 0  # 已写入索引的结果条数
+        self.flush(force=True)
+
+    def add_result(self, result):
+        self.task_info['results'].append(result)
+        self.task_info['progress']['processed'] += 1
+        self.task_info['files_count'] += 1
+        self.task_info['detection_count'] += result.get('detection_count', 0)
+        if result.get('status') != 'error':
+            self.task_info['success_count'] += 1
+        self.flush()
+
+    def cancelled(self):
+        return os.path.exists(os.path.join(self.task_dir, CANCEL_FILE))
+
+    def flush(self, force=False):
+        now = time.time()
+        if force or now - self.__last_flush >= self.flush_interval:
+            write_json_atomic(self.info_path, self.task_info)
+            index_task(self.store, self.task_info, self.__indexed)
+            self.__indexed = len(self.task_info['results'])
+            self.__last_flush = now
+
+    def finish(self, status=COMPLETED, message=None):
+        self.task_info['status'] = status
+        self.task_info['finished_at'] = time.time()
+        if message is not None:
+            self.task_info['message'] = message
+        self.flush(force=True)
+        return self.task_info
+
+
+def _mark_task(task_dir, status, message=None, store=None):
+    info_path = os.path.join(task_dir, TASK_INFO_FILE)
+    task_info = read_json(info_path, {'task_id': os.path.basename(task_dir), 'timestamp': time.time()})
+    task_info['status'] = status
+    task_info['finished_at'] = time.time()
+    if message is not None:
+        task_info['message'] = message
+    write_json_atomic(info_path, task_info)
+    index_task(store, task_info, len(task_info.get('results', [])))
+
+
+def _worker_main(queue, output_dir, runner, store=None):
+    """
+    工作进程主循环: 从队列取出 task_id, 调用 runner(task_dir, job) 处理.
+    runner 负责通过 TaskRecorder 写进度, 并在 recorder.cancelled() 时提前结束.
+    """
+    while True:
+        task_id = queue.get()
+        if task_id is None:
+            break
+        task_dir = os.path.join(output_dir, task_id)
+        job = read_json(os.path.join(task_dir, JOB_FILE))
+        if job is None:
+            continue
+        if os.path.exists(os.path.join(task_dir, CANCEL_FILE)):
+            _mark_task(task_dir, CANCELLED, store=store)
+            continue
+        try:
+            runner(task_dir, job)
+        except Exception as e:
+            traceback.print_exc()
+            _mark_task(task_dir, FAILED, str(e), store)
+
+
+class JobQueue(object):
+    """
+    持久化的检测作业队列.
+    1、每个作业对应 OUTPUT_DIR 下的一个 task_<timestamp> 目录, 作业参数保存在 job.json,
+       进度与结果由工作进程增量写入 task_info.json, 与同步接口产生的目录结构一致;
+    2、服务重启后, 以 start(recover=True) 启动的队列把状态为 queued/running 的作业重新排队并从头执行;
+       恢复只应由唯一的服务进程在启动时进行, 提交作业时的延迟启动不恢复, 避免其他进程仍在运行的作业被重复执行;
+    3、取消通过在任务目录下创建 CANCEL 标记文件实现, 工作进程在每个微批之间检查.
+    """
+
+    def __init__(self, output_dir, runner, num_workers=1, store=None):
+        """
+        :param output_dir: 任务目录所在的根目录
+        :param runner: 可被子进程导入的函数 runner(task_dir, job)
+        :param num_workers: 工作进程数, 每个进程各自加载一份模型
+        :param store: 任务索引 utils.task_store.TaskStore, 为 None 时不写索引
+        """
+        self.output_dir = output_dir
+        self.runner = runner
+        self.num_workers = num_workers
+        self.store = store
+        self.__ctx = multiprocessing.get_context('spawn')  # CUDA 不支持 fork 出的子进程
+        self.__queue = None
+        self.__workers = []
+        self.__lock = threading.Lock()
+
+    @property
+    def started(self):
+        return self.__queue is not None
+
+    def start(self, recover=False):
+        """
+        创建工作进程, 已启动时直接返回; 并发调用只会创建一组工作进程
+        :param recover: True 时把上次服务退出时未完成的作业重新排队
+        """
+        with self.__lock:
+            if self.started:
+                return self
+            queue = self.__ctx.Queue()
+            for _ in range(self.num_workers):
+                worker = self.__ctx.Process(target=_worker_main,
+                                            args=(queue, self.output_dir, self.runner, self.store), daemon=True)
+                worker.start()
+                self.__workers.append(worker)
+            if recover:
+                self.__requeue_unfinished(queue)
+            self.__queue = queue
+        return self
+
+    def stop(self):
+        with self.__lock:
+            if not self.started:
+                return
+            for _ in self.__workers:
+                self.__queue.put(None)
+            for worker in self.__workers:
+                worker.join(timeout=5)
+            self.__workers = []
+            self.__queue = None
+
+    def alive(self):
+        """是否还有存活的工作进程"""
+        return any(worker.is_alive() for worker in self.__workers)
+
+    def __requeue_unfinished(self, queue):
+        for task_id in sorted(os.listdir(self.output_dir)):
+            task_dir = os.path.join(self.output_dir, task_id)
+            if not os.path.exists(os.path.join(task_dir, JOB_FILE)):
+                continue
+            task_info = read_json(os.path.join(task_dir, TASK_INFO_FILE), {})
+            if task_info.get('status') in (QUEUED, RUNNING):
+                print(f"重新排队未完成的作业: {task_id}")
+                queue.put(task_id)
+
+    def submit(self, task_id, job, task_info):
+        """
+        :param task_id: create_task_dir 返回的任务 ID
+        :param job: 交给 runner 的作业参数(需可 JSON 序列化)
+        :param task_info: 初始的 task_info 字段, 如 dataset_name
+        """
+        self.start()
+        task_dir = os.path.join(self.output_dir, task_id)
+        write_json_atomic(os.path.join(task_dir, JOB_FILE), job)
+        task_info = dict(task_info)
+        task_info.update({
+            'task_id': task_id,
+            'timestamp': task_info.get('timestamp', time.time()),
+            'status': QUEUED,
+            'files_count': 0,
+            'detection_count': 0,
+            'progress': {'processed': 0, 'total': job.get('total', 0)},
+            'results': [],
+        })
+        write_json_atomic(os.path.join(task_dir, TASK_INFO_FILE), task_info)
+        index_task(self.store, task_info)
+        self.__queue.put(task_id)
+        return task_info
+
+    def cancel(self, task_id):
+        """请求取消; 排队中的作业直接标记为已取消, 运行中的作业在下一个微批前停止"""
+        task_dir = os.path.join(self.output_dir, task_id)
+        task_info = read_json(os.path.join(task_dir, TASK_INFO_FILE))
+        if task_info is None:
+            return None
+        if task_info.get('status') in FINISHED_STATES:
+            return task_info
+        open(os.path.join(task_dir, CANCEL_FILE), 'w').close()
+        if task_info.get('status') == QUEUED:
+            _mark_task(task_dir, CANCELLED, store=self.store)
+            task_info['status'] = CANCELLED
+        return task_info
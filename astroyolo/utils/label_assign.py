@@ -0,0 +1,116 @@
+# coding=utf-8
+import sys
+
+sys.path.append("..")
+import torch
+import torch.nn.functional as F
+
+import config.model_config as cfg
+import utils.data_augment as dataAug
+import utils.tools as tools
+
+
+def assign_targets(bboxes, valid, img_size, num_classes, max_boxes=150, iou_thresh=0.3):
+    """
+    向量化的标签分配, 与 BuildDataset 原先逐框循环的结果一致:
+    1、所有框、所有尺度、所有 anchor 的 IoU 一次算出, IoU > iou_thresh 的 anchor 负责预测该框;
+    2、没有任何 anchor 超过阈值的框, 退而使用所有尺度中 IoU 最大的 anchor;
+    3、多个框落到同一个 anchor 时, 保留顺序上最后的框(与循环中后写覆盖先写一致);
+    4、每个尺度最多记录 max_boxes 个框, 超出后循环覆盖, 同样保留最后写入的框.
+    可在 CPU 上逐样本调用, 也可在 GPU 上对整批调用.
+    :param bboxes: [B, K, 6] (xmin, ymin, xmax, ymax, class, mix)
+    :param valid: [B, K] bool, 补齐的无效框为 False
+    :return: (label_sbbox, label_mbbox, label_lbbox, sbboxes, mbboxes, lbboxes)
+             label_*: [B, grid, grid, anchors, 6+num_classes], *bboxes: [B, max_boxes, 4]
+    """
+    device = bboxes.device
+    anchors = torch.tensor(cfg.MODEL["ANCHORS"], dtype=torch.float32, device=device)  # [3, A, 2]
+    strides = cfg.MODEL["STRIDES"]
+    anchors_per_scale = cfg.MODEL["ANCHORS_PER_SCLAE"]
+    batch_size, num_boxes = valid.shape
+
+    bboxes = bboxes.float()
+    coor, cls, mix = bboxes[..., :4], bboxes[..., 4].long(), bboxes[..., 5]
+    one_hot_smooth = dataAug.LabelSmooth()(F.one_hot(cls.clamp(min=0), num_classes).float(), num_classes)
+
+    # convert "xyxy" to "xywh", 超出输入图的坐标收回到 img_size - 1
+    bbox_xywh = torch.cat([(coor[..., 2:] + coor[..., :2]) * 0.5, coor[..., 2:] - coor[..., :2]], dim=-1)
+    bbox_xywh = torch.where(bbox_xywh >= img_size, torch.full_like(bbox_xywh, img_size - 1.0), bbox_xywh)
+    stride_t = torch.tensor(strides, dtype=torch.float32, device=device)
+    bbox_xywh_scaled = bbox_xywh[:, :, None, :] / stride_t[:, None]  # [B, K, 3, 4]
+    cell = bbox_xywh_scaled[..., :2].floor()  # [B, K, 3, 2]
+
+    anchors_xywh = torch.cat([
+        (cell + 0.5)[..., None, :].expand(-1, -1, -1, anchors_per_scale, -1),  # 0.5 for compensation
+        anchors.expand(batch_size, num_boxes, -1, -1, -1),
+    ], dim=-1)  # [B, K, 3, A, 4]
+    iou = tools.iou_xywh_torch(bbox_xywh_scaled[..., None, :], anchors_xywh)  # [B, K, 3, A]
+
+    positive = (iou > iou_thresh) & valid[..., None, None]
+    fallback = valid & ~positive.flatten(2).any(-1)
+    best = iou.flatten(2).argmax(-1)
+    positive = positive.flatten(2)
+    positive[fallback, best[fallback]] = True
+    positive = positive.view_as(iou)
+
+    labels, bboxes_xywh = [], []
+    for i, stride in enumerate(strides):
+        grid = int(img_size / stride)
+        label = torch.zeros((batch_size, grid, grid, anchors_per_scale, 6 + num_classes), device=device)
+        label[..., 5] = 1.0
+
+        b, k, a = positive[:, :, i].nonzero(as_tuple=True)  # 按 (图片, 框序号) 排序
+        xind, yind = cell[b, k, i, 0].long(), cell[b, k, i, 1].long()
+        slot = ((b * grid + yind) * grid + xind) * anchors_per_scale + a
+        winner = torch.full((batch_size * grid * grid * anchors_per_scale,), -1, dtype=torch.long, device=device)
+        winner = winner.scatter_reduce(0, slot, k, reduce='amax')
+        last = winner[slot] == k
+        b, k, a, xind, yind = b[last], k[last], a[last], xind[last], yind[last]
+        label[b, yind, xind, a] = torch.cat([
+            bbox_xywh[b, k],
+            torch.ones_like(mix[b, k, None]),
+            mix[b, k, None],
+            one_hot_smooth[b, k],
+        ], dim=-1)
+        labels.append(label)
+
+        has_pos = positive[:, :, i].any(-1)  # [B, K]
+        order = has_pos.long().cumsum(dim=1) - 1
+        count = has_pos.sum(dim=1, keepdim=True)
+        keep = has_pos & (order >= count - max_boxes)
+        b, k = keep.nonzero(as_tuple=True)
+        buffer = torch.zeros((batch_size, max_boxes, 4), device=device)
+        buffer[b, order[b, k] % max_boxes] = bbox_xywh[b, k]
+        bboxes_xywh.append(buffer)
+
+    return tuple(labels) + tuple(bboxes_xywh)
+
+
+def collate_boxes(batch):
+    """
+    配合 BuildDataset(assign_labels=False) 的 collate_fn: 只堆叠图像并把各样本的框补齐到相同数量,
+    标签留到主进程中按批生成(见 build_batch_targets)
+    :param batch: list of (img [3, H, W], bboxes [k, 6]); 开启 BATCH_AUGMENT 时为 (uint8 img, bboxes [k, 5])
+    :return: (imgs [B, 3, H, W], bboxes [B, K, 6 或 5], valid [B, K])
+    """
+    imgs = torch.stack([img for img, _ in batch])
+    max_boxes = max([len(bboxes) for _, bboxes in batch] + [1])
+    bboxes = torch.zeros((len(batch), max_boxes, batch[0][1].shape[-1]))
+    valid = torch.zeros((len(batch), max_boxes), dtype=torch.bool)
+    for i, (_, boxes) in enumerate(batch):
+        bboxes[i, :len(boxes)] = boxes
+        valid[i, :len(boxes)] = True
+    return imgs, bboxes, valid
+
+
+def build_batch_targets(imgs, bboxes, valid, device, img_size=None, num_classes=None):
+    """
+    在 device(通常为 GPU)上整批生成标签, 返回与逐样本 DataLoader 相同的 7 元组
+    :return: (imgs, label_sbbox, label_mbbox, label_lbbox, sbboxes, mbboxes, lbboxes)
+    """
+    img_size = img_size or imgs.shape[-1]
+    num_classes = num_classes or cfg.Customer_DATA["NUM"]
+    imgs = imgs.to(device, non_blocking=True)
+    targets = assign_targets(bboxes.to(device, non_blocking=True), valid.to(device, non_blocking=True),
+                             img_size, num_classes)
+    return (imgs,) + targets
@@ -0,0 +1,130 @@
+# coding=utf-8
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import config.model_config as cfg
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def model_nbytes(model):
+    """参数与缓冲区占用的字节数, 用于内存预算; 冻结后的模型(见 inference_optimizer.OptimizedModel)自带 nbytes"""
+    if hasattr(model, 'nbytes'):
+        return model.nbytes
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+class ModelRegistry(object):
+    """
+    已加载模型的 LRU 缓存, 以权重文件内容的 sha256 为键:
+    1、同一份权重(无论上传时的文件名)只加载一次, 之后的请求直接复用;
+    2、超过 MAX_MODELS 个或超出 MEMORY_BUDGET_MB 时淘汰最久未使用的模型;
+    3、加载在后台线程池中进行, 同一权重的并发请求共享同一个加载任务;
+    4、每个请求通过 get() 拿到自己的模型, 不再替换全局模型.
+    """
+
+    def __init__(self, load_fn, device, max_models=None, memory_budget_mb=None, num_loaders=1):
+        """
+        :param load_fn: (weight_path, device) -> eval 模式的模型
+        :param max_models: 最多常驻的模型数
+        :param memory_budget_mb: 常驻模型的总内存预算(MB), None 或 0 表示不限制
+        """
+        self.load_fn = load_fn
+        self.device = device
+        self.max_models = max_models or cfg.INFERENCE['MAX_MODELS']
+        budget = memory_budget_mb if memory_budget_mb is not None else cfg.INFERENCE['MEMORY_BUDGET_MB']
+        self.memory_budget = budget * 1024 ** 2 if budget else None
+        self.__models = OrderedDict()  # key -> (model, nbytes)
+        self.__loading = {}  # key -> Future
+        self.__hashes = {}  # (path, mtime, size) -> key
+        self.__lock = threading.Lock()
+        self.__loader = ThreadPoolExecutor(num_loaders)
+
+    def key_for(self, weight_path):
+        """权重文件的 sha256, 按 (路径, 修改时间, 大小) 缓存以避免重复读取大文件"""
+        stat = os.stat(weight_path)
+        file_id = (os.path.abspath(weight_path), stat.st_mtime, stat.st_size)
+        with self.__lock:
+            key = self.__hashes.get(file_id)
+        if key is None:
+            # 在锁外读取文件, 不阻塞其他请求
+            key = file_sha256(weight_path)
+            with self.__lock:
+                self.__hashes[file_id] = key
+        return key
+
+    def __load(self, key, weight_path):
+        try:
+            model = self.load_fn(weight_path, self.device)
+            with self.__lock:
+                self.__models[key] = (model, model_nbytes(model))
+                self.__models.move_to_end(key)
+                self.__evict(keep=key)
+            return model
+        finally:
+            with self.__lock:
+                self.__loading.pop(key, None)
+
+    def __evict(self, keep):
+        while len(self.__models) > 1:
+            total = sum(nbytes for _, nbytes in self.__models.values())
+            if len(self.__models) <= self.max_models and (self.memory_budget is None or total <= self.memory_budget):
+                break
+            key = next(k for k in self.__models if k != keep)
+            print(f"模型缓存已满, 释放权重 {key[:12]}")
+            del self.__models[key]
+
+    def prefetch(self, weight_path, key=None):
+        """
+        在后台加载权重, 已加载或正在加载时直接返回
+        :return: concurrent.futures.Future, 结果为模型
+        """
+        key = key or self.key_for(weight_path)
+        with self.__lock:
+            if key in self.__models:
+                self.__models.move_to_end(key)
+                future = Future()
+                future.set_result(self.__models[key][0])
+                return future
+            future = self.__loading.get(key)
+            if future is None:
+                future = self.__loader.submit(self.__load, key, weight_path)
+                self.__loading[key] = future
+            return future
+
+    def get(self, weight_path, key=None):
+        """返回权重对应的模型, 未加载时阻塞等待后台加载完成"""
+        key = key or self.key_for(weight_path)
+        with self.__lock:
+            entry = self.__models.get(key)
+            if entry is not None:
+                self.__models.move_to_end(key)
+                return entry[0]
+        return self.prefetch(weight_path, key).result()
+
+    def key_of(self, model):
+        """已加载模型对应的权重哈希, 模型不在缓存中时返回 None"""
+        with self.__lock:
+            for key, (loaded, _) in self.__models.items():
+                if loaded is model:
+                    return key
+        return None
+
+    def info(self):
+        with self.__lock:
+            return {
+                'loaded': [{'key': k, 'bytes': nbytes} for k, (_, nbytes) in self.__models.items()],
+                'loading': list(self.__loading.keys()),
+                'max_models': self.max_models,
+                'memory_budget': self.memory_budget,
+            }
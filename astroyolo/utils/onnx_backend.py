@@ -0,0 +1,156 @@
+# coding=utf-8
+import os
+import sys
+
+sys.path.append("..")
+import numpy as np
+import torch
+import torch.nn as nn
+
+import config.model_config as cfg
+
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
+BACKENDS = ('torch', 'onnxruntime')
+
+
+class ExportWrapper(nn.Module):
+    """
+    导出用的包装: 输出直接是每张图一行的解码结果 [B, num_boxes, 5+num_classes],
+    与 postprocess.split_batch_predictions 的结果相同, 批大小随输入变化(动态轴).
+    """
+
+    def __init__(self, model):
+        super(ExportWrapper, self).__init__()
+        self.model = model.eval()
+
+    def forward(self, x):
+        features = self.model.yolo_v4(x)
+        heads = [self.model.head_s, self.model.head_m, self.model.head_l]
+        p_d = [head(feature)[1] for head, feature in zip(heads, features)]
+        return torch.cat([p.reshape(x.shape[0], -1, p.shape[-1]) for p in p_d], dim=1)
+
+
+def export_onnx(model, onnx_path, img_size=None, opset=None):
+    """
+    把 eval 模式的 BuildModel(含 TransFusion 注意力与 YOLOHead 解码)导出为 ONNX, 批大小为动态轴.
+    先写临时文件再改名, 并发导出同一份权重时不会读到半个文件.
+    torch.onnx.export 结束时会按导出前的状态递归恢复 training 标志, 因此包装先切到 eval,
+    导出后再恢复调用方模型原来的模式.
+    """
+    img_size = img_size or cfg.VAL["TEST_IMG_SIZE"]
+    opset = opset or cfg.INFERENCE["ONNX_OPSET"]
+    device = next(model.parameters()).device
+    os.makedirs(os.path.dirname(os.path.abspath(onnx_path)), exist_ok=True)
+    tmp_path = f"{onnx_path}.{os.getpid()}.tmp"
+    dummy = torch.zeros((1, 3, img_size, img_size), device=device)
+    training = model.training
+    try:
+        with torch.no_grad():
+            # 新的 dynamo 导出器不支持 Mish 与 SplitToSequence, 固定使用 TorchScript 导出器
+            torch.onnx.export(
+                ExportWrapper(model).eval(), dummy, tmp_path,
+                input_names=['images'], output_names=['p_d'],
+                dynamic_axes={'images': {0: 'batch'}, 'p_d': {0: 'batch'}},
+                opset_version=opset, do_constant_folding=True, dynamo=False,
+            )
+    finally:
+        model.train(training)
+    os.replace(tmp_path, onnx_path)
+    print(f"ONNX 模型已导出: {onnx_path}")
+    return onnx_path
+
+
+def session_options(intra_op_threads=None, inter_op_threads=None):
+    """
+    :param intra_op_threads: 单个算子内部的线程数, 0 表示由 ONNX Runtime 按物理核数决定
+    :param inter_op_threads: 算子间并行的线程数, 大于 1 时启用并行执行模式
+    """
+    intra = cfg.INFERENCE["ORT_INTRA_OP_THREADS"] if intra_op_threads is None else intra_op_threads
+    inter = cfg.INFERENCE["ORT_INTER_OP_THREADS"] if inter_op_threads is None else inter_op_threads
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.intra_op_num_threads = intra
+    options.inter_op_num_threads = inter
+    options.execution_mode = ort.ExecutionMode.ORT_PARALLEL if inter > 1 else ort.ExecutionMode.ORT_SEQUENTIAL
+    return options
+
+
+class OnnxModel(object):
+    """
+    ONNX Runtime 推理会话, 调用方式与 eval 模式的 BuildModel 相同: model(x) -> (None, p_d).
+    p_d 已是 [B, num_boxes, 5+num_classes], split_batch_predictions 会原样返回.
+    """
+
+    def __init__(self, onnx_path, device, intra_op_threads=None, inter_op_threads=None):
+        if ort is None:
+            raise ImportError("onnxruntime is not installed, set INFERENCE['BACKEND'] to 'torch'")
+        self.onnx_path = onnx_path
+        self.device = torch.device(device) if isinstance(device, str) else device
+        providers = ['CPUExecutionProvider']
+        if self.device.type == 'cuda' and 'CUDAExecutionProvider' in ort.get_available_providers():
+            providers.insert(0, 'CUDAExecutionProvider')
+        self.session = ort.InferenceSession(onnx_path, session_options(intra_op_threads, inter_op_threads),
+                                            providers=providers)
+        self.input_name = self.session.get_inputs()[0].name
+        self.nbytes = os.path.getsize(onnx_path)
+
+    def eval(self):
+        return self
+
+    def __call__(self, x):
+        inputs = x.detach().cpu().numpy().astype(np.float32, copy=False)
+        p_d = self.session.run(None, {self.input_name: inputs})[0]
+        return None, torch.from_numpy(p_d).to(self.device)
+
+
+def onnx_path_for(weight_key):
+    return os.path.join(cfg.INFERENCE["ONNX_DIR"], f"{weight_key}.onnx")
+
+
+def load_onnx_model(model, weight_key, device):
+    """
+    按权重哈希缓存导出结果, 同一份权重只导出一次
+    :param model: 已加载权重、eval 模式的 BuildModel
+    """
+    onnx_path = onnx_path_for(weight_key)
+    if not os.path.exists(onnx_path):
+        export_onnx(model, onnx_path)
+    return OnnxModel(onnx_path, device)
+
+
+def sample_inputs(sample_dir, img_size=None):
+    """读取 sample_images 中的 jpg/npy 示例(不含缩略图), 缩放为 [n, 3, img_size, img_size] 的 [0, 1] 张量"""
+    import cv2
+
+    from utils.tiled_inference import TiledFrame, open_frame
+
+    img_size = img_size or cfg.VAL["TEST_IMG_SIZE"]
+    names = sorted(f for f in os.listdir(sample_dir)
+                   if f.lower().endswith(('.jpg', '.jpeg', '.png', '.npy')) and '_thumb' not in f)
+    images = []
+    for name in names:
+        image_type = 'npy' if name.lower().endswith('.npy') else 'jpg'
+        frame, channels_first = open_frame(os.path.join(sample_dir, name), image_type)
+        img_bgr, _ = TiledFrame(frame, channels_first, bgr=image_type != 'npy').render_preview()
+        img_rgb = cv2.cvtColor(cv2.resize(img_bgr, (img_size, img_size)), cv2.COLOR_BGR2RGB)
+        images.append(img_rgb)
+    batch = torch.from_numpy(np.stack(images)).permute(0, 3, 1, 2).float().div(255.0)
+    return names, batch
+
+
+if __name__ == "__main__":
+    # python onnx_backend.py weight_path [onnx_path]
+    # 与 torch 模型的一致性检查见 tests/test_onnx_backend.py
+    from model.model import BuildModel
+
+    weight_path = sys.argv[1]
+    onnx_path = sys.argv[2] if len(sys.argv) > 2 else os.path.splitext(weight_path)[0] + '.onnx'
+    device = torch.device('cpu')
+    model = BuildModel().to(device)
+    state = torch.load(weight_path, map_location=device)
+    model.load_state_dict(state['model'] if isinstance(state, dict) and 'model' in state else state)
+    export_onnx(model.eval(), onnx_path)
@@ -0,0 +1,313 @@
+# coding=utf-8
+import sys
+import time
+
+sys.path.append("..")
+import numpy as np
+import torch
+
+import config.model_config as cfg
+from model.head import SparsePredictions
+
+try:
+    from torchvision.ops import box_iou as _tv_box_iou
+    from torchvision.ops import nms as _tv_nms
+except ImportError:
+    _tv_box_iou = _tv_nms = None
+
+
+def split_batch_predictions(p_d, batch_size, img_size=None):
+    """
+    BuildModel 在 eval 模式下把三个尺度的解码结果按 dim=0 拼接, 每个尺度内部是
+    [bs*grid*grid*anchors, 5+num_classes], 不同图片的框混在一起.
+    这里按尺度切分后重排为每张图一行.
+    :param p_d: [sum_i(bs*grid_i*grid_i*anchors), 5+num_classes]
+                或已按图排列的 [bs, num_boxes, 5+num_classes](ONNX 后端的输出)、SparsePredictions, 此时原样返回
+    :param batch_size: 批大小
+    :param img_size: 模型输入尺寸, 默认 TEST_IMG_SIZE
+    :return: [bs, num_boxes, 5+num_classes]
+    """
+    if isinstance(p_d, SparsePredictions):
+        assert len(p_d) == batch_size, "prediction batch size does not match"
+        return p_d
+    if p_d.dim() == 3:
+        return p_d
+    img_size = img_size or cfg.VAL["TEST_IMG_SIZE"]
+    anchors_per_scale = cfg.MODEL["ANCHORS_PER_SCLAE"]
+    sizes = [batch_size * anchors_per_scale * (img_size // s) ** 2 for s in cfg.MODEL["STRIDES"]]
+    assert sum(sizes) == p_d.shape[0], "prediction size does not match input size {}".format(img_size)
+    chunks = torch.split(p_d, sizes, dim=0)
+    return torch.cat([c.reshape(batch_size, -1, p_d.shape[-1]) for c in chunks], dim=1)
+
+
+def xywh2xyxy(boxes):
+    return torch.cat([boxes[..., :2] - boxes[..., 2:4] * 0.5, boxes[..., :2] + boxes[..., 2:4] * 0.5], dim=-1)
+
+
+def box_iou(boxes1, boxes2):
+    """
+    :param boxes1: [N, 4] (xmin, ymin, xmax, ymax)
+    :param boxes2: [M, 4] (xmin, ymin, xmax, ymax)
+    :return: [N, M] IoU 矩阵
+    """
+    area1 = (boxes1[:, 2] - boxes1[:, 0]) * (boxes1[:, 3] - boxes1[:, 1])
+    area2 = (boxes2[:, 2] - boxes2[:, 0]) * (boxes2[:, 3] - boxes2[:, 1])
+    left_up = torch.max(boxes1[:, None, :2], boxes2[None, :, :2])
+    right_down = torch.min(boxes1[:, None, 2:], boxes2[None, :, 2:])
+    inter_section = (right_down - left_up).clamp_(min=0)
+    inter_area = inter_section[..., 0] * inter_section[..., 1]
+    return inter_area / (area1[:, None] + area2[None, :] - inter_area + 1e-8)
+
+
+def _blockwise_nms(boxes, scores, iou_thresh, chunk=None):
+    """
+    无 torchvision 时的 NMS: 按分数排序后每次取 chunk 个框, 先去掉被之前各块保留框抑制的框,
+    块内再用 Cluster-NMS (https://arxiv.org/abs/2005.03572) 的不动点迭代求出贪心结果.
+    结果与逐个框的贪心 NMS 完全一致, 每次只计算 [chunk, chunk] 的 IoU, 内存不随候选框数平方增长.
+    """
+    chunk = chunk or cfg.VAL["NMS_CHUNK"]
+    order = scores.argsort(descending=True)
+    boxes = boxes[order]
+    kept = []
+    for start in range(0, len(boxes), chunk):
+        block = boxes[start:start + chunk]
+        alive = torch.ones(len(block), dtype=torch.bool, device=boxes.device)
+        for prev in kept:
+            alive &= ~(box_iou(boxes[prev], block) > iou_thresh).any(dim=0)
+        ind = alive.nonzero().squeeze(1)
+        over = box_iou(block[ind], block[ind]).triu_(diagonal=1) > iou_thresh
+        kept.append(ind[_greedy_keep(over)] + start)
+    return order[torch.cat(kept)]
+
+
+def _greedy_keep(over):
+    """
+    :param over: [N, N] bool 上三角, over[i, j] 表示按分数排序后第 i 个框抑制第 j 个框
+    :return: [N] bool, 与逐个框贪心抑制的结果相同
+    """
+    keep = torch.ones(len(over), dtype=torch.bool, device=over.device)
+    for _ in range(len(over)):
+        # 只有仍被保留的框才有资格抑制排在其后的框
+        new_keep = ~over[keep].any(dim=0)
+        if torch.equal(new_keep, keep):
+            break
+        keep = new_keep
+    return keep
+
+
+def nms(boxes, scores, iou_thresh):
+    """
+    :param boxes: [N, 4] (xmin, ymin, xmax, ymax)
+    :param scores: [N]
+    :return: 保留框的索引, 按分数降序
+    """
+    if boxes.numel() == 0:
+        return torch.zeros((0,), dtype=torch.long, device=boxes.device)
+    if _tv_nms is not None:
+        return _tv_nms(boxes.float(), scores.float(), iou_thresh)
+    return _blockwise_nms(boxes, scores, iou_thresh)
+
+
+def batched_nms(boxes, scores, idxs, iou_thresh):
+    """
+    按类别(或 图片*类别)分组的 NMS, 与 torchvision.ops.batched_nms 相同:
+    给每组的框加上互不重叠的坐标偏移, 一次 NMS 即可完成全部分组.
+    :param idxs: [N] 分组索引
+    """
+    if boxes.numel() == 0:
+        return torch.zeros((0,), dtype=torch.long, device=boxes.device)
+    max_coordinate = boxes.max()
+    offsets = idxs.to(boxes) * (max_coordinate + 1)
+    return nms(boxes + offsets[:, None], scores, iou_thresh)
+
+
+def batched_soft_nms(boxes, scores, idxs, sigma=0.3, score_thresh=0.001, chunk=None):
+    """
+    高斯 soft-NMS 的矩阵形式(Matrix NMS, https://arxiv.org/abs/2003.10152):
+    每个框的衰减系数由所有分数更高的同组框一次性算出, 无逐框循环.
+    IoU 按列分块计算(每块 [N, chunk]), 先求各框的补偿项, 再求衰减系数.
+    :return: (keep, new_scores) keep 为按衰减后分数降序排列的索引
+    """
+    if boxes.numel() == 0:
+        empty = torch.zeros((0,), dtype=torch.long, device=boxes.device)
+        return empty, scores[empty]
+    chunk = chunk or cfg.VAL["NMS_CHUNK"]
+    order = scores.argsort(descending=True)
+    sorted_boxes, groups = boxes[order], idxs[order]
+    rank = torch.arange(len(order), device=boxes.device)
+    starts = range(0, len(order), chunk)
+
+    def column_iou(start):
+        # IoU[:, start:start+chunk], 只保留分数更高的同组框
+        cols = slice(start, start + chunk)
+        mask = (rank[:, None] < rank[None, cols]) & (groups[:, None] == groups[None, cols])
+        return box_iou(sorted_boxes, sorted_boxes[cols]) * mask
+
+    compensate = torch.cat([column_iou(start).max(dim=0)[0] for start in starts])
+    decay = torch.cat([torch.exp(-(column_iou(start) ** 2 - compensate[:, None] ** 2) / sigma).min(dim=0)[0]
+                       for start in starts])
+    decayed = scores[order] * decay
+    keep = decayed > score_thresh
+    order, decayed = order[keep], decayed[keep]
+    resort = decayed.argsort(descending=True)
+    return order[resort], decayed[resort]
+
+
+def filter_detections(pred, conf_thresh=0.3, nms_thresh=0.45, method='nms', sigma=0.3,
+                      class_agnostic=False, score_with_cls=False, clip_size=None, pre_nms_topk=None):
+    """
+    YOLO 解码输出的后处理, 全部在 pred 所在设备上完成:
+    置信度过滤 -> xywh 转 xyxy(可裁剪到输入图范围) -> 逐图取分数前 pre_nms_topk 个框 -> 按类别分组的 NMS.
+    :param pred: [bs, N, 5+num_classes] 解码后的预测(x, y, w, h, conf, cls...), 或 YOLOHead 的 SparsePredictions
+    :param conf_thresh: 分数阈值
+    :param nms_thresh: NMS 的 IoU 阈值
+    :param method: 'nms' 或 'soft-nms'
+    :param sigma: soft-NMS 的高斯参数
+    :param class_agnostic: True 时不同类别之间也互相抑制
+    :param score_with_cls: True 时分数为 conf * cls_prob, 否则为 conf
+    :param clip_size: 不为 None 时把框裁剪到 [0, clip_size] 并去掉退化框
+    :param pre_nms_topk: 每张图参与 NMS 的最多候选框数, 默认 cfg.VAL['NMS_TOPK'], 0 表示不限制
+    :return: list(len=bs) of [k, 6] 张量 (xmin, ymin, xmax, ymax, score, class)
+    """
+    assert method in ['nms', 'soft-nms']
+    sparse_ind = None
+    if isinstance(pred, SparsePredictions):
+        # 稀疏输出: 按一个批大小为 1 的 [1, M, 5+num_classes] 处理, 图片序号取自 img_ind
+        batch_size, sparse_ind, pred = pred.batch_size, pred.img_ind, pred.boxes.unsqueeze(0)
+    else:
+        if pred.dim() == 2:
+            pred = pred.unsqueeze(0)
+        batch_size = pred.shape[0]
+
+    cls_prob, cls_id = pred[..., 5:].max(dim=-1)
+    scores = pred[..., 4] * cls_prob if score_with_cls else pred[..., 4]
+    boxes = xywh2xyxy(pred[..., :4])
+    mask = scores > conf_thresh
+    if clip_size is not None:
+        boxes = boxes.clamp(0, clip_size)
+        mask &= (boxes[..., 2] > boxes[..., 0]) & (boxes[..., 3] > boxes[..., 1])
+
+    img_ind, box_ind = mask.nonzero(as_tuple=True)
+    boxes = boxes[img_ind, box_ind]
+    scores = scores[img_ind, box_ind]
+    labels = cls_id[img_ind, box_ind]
+    if sparse_ind is not None:
+        img_ind = sparse_ind[box_ind]
+
+    # 逐图做 NMS, 每张图只保留分数最高的 pre_nms_topk 个候选框, 类别作为分组索引
+    pre_nms_topk = cfg.VAL["NMS_TOPK"] if pre_nms_topk is None else pre_nms_topk
+    results = []
+    for i in range(batch_size):
+        ind = (img_ind == i).nonzero().squeeze(1)
+        if pre_nms_topk and len(ind) > pre_nms_topk:
+            ind = ind[scores[ind].topk(pre_nms_topk)[1]]
+        img_boxes, img_scores, img_labels = boxes[ind], scores[ind], labels[ind]
+        groups = torch.zeros_like(img_labels) if class_agnostic else img_labels
+        if method == 'nms':
+            keep = batched_nms(img_boxes, img_scores, groups, nms_thresh)
+            kept_scores = img_scores[keep]
+        else:
+            keep, kept_scores = batched_soft_nms(img_boxes, img_scores, groups, sigma, conf_thresh)
+        results.append(torch.cat([img_boxes[keep], kept_scores[:, None],
+                                  img_labels[keep, None].to(boxes.dtype)], dim=1))
+    return results
+
+
+def weighted_box_fusion(detections, num_views, iou_thresh=0.55):
+    """
+    加权框融合(WBF), 合并同一张图多个视图(TTA)各自 NMS 后的检测, 全部为整块张量运算:
+    1、按分数排序后一次算出 IoU 矩阵(有 torchvision 时用 torchvision.ops.box_iou), 不同类别的 IoU 置 0;
+    2、与 Cluster-NMS 相同的不动点迭代求出簇首(贪心 NMS 保留的框), 其余框并入排在其前、
+       IoU 超过阈值的簇首中 IoU 最大者(逐框实现中是与不断更新的融合框比较, 这里与簇首比较);
+    3、融合框为簇内各框按分数加权的平均, 分数为簇内平均分数乘以 min(簇大小, num_views) / num_views,
+       只被少数视图检出的框因此被降权.
+    :param detections: [k, 6] (xmin, ymin, xmax, ymax, score, class), 各视图的检测拼在一起
+    :param num_views: 视图数
+    :return: [m, 6] 按簇首分数降序
+    """
+    if len(detections) == 0:
+        return detections
+    det = detections[detections[:, 4].argsort(descending=True)]
+    boxes = det[:, :4].float()
+    iou = (_tv_box_iou or box_iou)(boxes, boxes)
+    iou = iou * (det[:, 5, None] == det[None, :, 5])
+    over = iou.triu(diagonal=1) > iou_thresh
+    leaders = _greedy_keep(over).nonzero().squeeze(1)
+
+    # 每个框所属的簇: 只考虑排在其前且 IoU 超过阈值的簇首, 簇首属于自己的簇
+    candidates = torch.where(over[leaders].t(), iou[:, leaders], torch.full_like(iou[:, leaders], -1.0))
+    candidates[leaders, torch.arange(len(leaders), device=det.device)] = 2.0
+    cluster = candidates.argmax(1)
+
+    scores = det[:, 4]
+    weight_sum = scores.new_zeros(len(leaders)).index_add_(0, cluster, scores)
+    box_sum = det.new_zeros((len(leaders), 4)).index_add_(0, cluster, det[:, :4] * scores[:, None])
+    counts = scores.new_zeros(len(leaders)).index_add_(0, cluster, torch.ones_like(scores))
+    fused = torch.cat([box_sum / weight_sum[:, None], (weight_sum / counts)[:, None], det[leaders, 5:6]], dim=1)
+    fused[:, 4] *= counts.clamp(max=num_views) / num_views
+    return fused
+
+
+def _legacy_nms(boxes, iou_thresh=0.5):
+    """旧版 app.apply_nms 的实现: 逐对调用 Python 版 IoU, 仅用于基准对比"""
+    scores = np.array([box[4] for box in boxes])
+    coords = np.array([[box[0], box[1], box[2], box[3]] for box in boxes])
+    order = scores.argsort()[::-1]
+    keep = []
+
+    def calc_iou(box1, box2):
+        x1 = max(box1[0], box2[0])
+        y1 = max(box1[1], box2[1])
+        x2 = min(box1[2], box2[2])
+        y2 = min(box1[3], box2[3])
+        inter_area = max(0, x2 - x1) * max(0, y2 - y1)
+        box1_area = (box1[2] - box1[0]) * (box1[3] - box1[1])
+        box2_area = (box2[2] - box2[0]) * (box2[3] - box2[1])
+        return inter_area / (box1_area + box2_area - inter_area + 1e-8)
+
+    while len(order) > 0:
+        i = order[0]
+        keep.append(i)
+        ious = np.array([calc_iou(coords[i], coords[order[j]]) for j in range(1, len(order))])
+        order = order[np.where(ious < iou_thresh)[0] + 1]
+    return [boxes[i] for i in keep]
+
+
+def benchmark(num_boxes_list=(1000, 10000), iou_thresh=0.45, repeat=5, legacy_limit=10000):
+    """
+    对比旧版 Python NMS 与本模块的 NMS 在 1k / 10k 个候选框时的延迟.
+    候选框在 352x352 的输入图内随机生成, 模拟低阈值下的大量重叠框.
+    """
+    img_size = cfg.VAL["TEST_IMG_SIZE"]
+    devices = ['cpu'] + (['cuda'] if torch.cuda.is_available() else [])
+    print("{:>8s} {:>14s} {:>14s} {:>14s}".format('boxes', 'impl', 'device', 'latency(ms)'))
+    for n in num_boxes_list:
+        g = torch.Generator().manual_seed(0)
+        xy = torch.rand(n, 2, generator=g) * img_size
+        wh = torch.rand(n, 2, generator=g) * 30 + 4
+        pred = torch.cat([xy, wh, torch.rand(n, 1, generator=g), torch.ones(n, 1)], dim=1).unsqueeze(0)
+
+        if n <= legacy_limit:
+            boxes = xywh2xyxy(pred[0, :, :4])
+            legacy_in = torch.cat([boxes, pred[0, :, 4:6]], dim=1).tolist()
+            start = time.perf_counter()
+            _legacy_nms(legacy_in, iou_thresh)
+            print("{:>8d} {:>14s} {:>14s} {:>14.2f}".format(n, 'legacy', 'cpu', (time.perf_counter() - start) * 1000))
+
+        for device in devices:
+            pred_d = pred.to(device)
+            for method in ['nms', 'soft-nms']:
+                filter_detections(pred_d, 0.0, iou_thresh, method=method, pre_nms_topk=0)  # warm up
+                if device == 'cuda':
+                    torch.cuda.synchronize()
+                start = time.perf_counter()
+                for _ in range(repeat):
+                    filter_detections(pred_d, 0.0, iou_thresh, method=method, pre_nms_topk=0)
+                if device == 'cuda':
+                    torch.cuda.synchronize()
+                elapsed = (time.perf_counter() - start) / repeat * 1000
+                print("{:>8d} {:>14s} {:>14s} {:>14.2f}".format(n, method, device, elapsed))
+
+
+if __name__ == "__main__":
+    benchmark()
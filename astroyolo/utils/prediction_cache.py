@@ -0,0 +1,131 @@
+# coding=utf-8
+import hashlib
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+sys.path.append("..")
+import config.model_config as cfg
+from utils.model_registry import file_sha256
+
+
+def content_key(image_data, image_type):
+    """
+    图像内容的 sha256(文件路径按文件内容, 多波段 FITS 组按各波段文件内容)
+    :return: 十六进制摘要, 无法确定内容时为 None(不缓存)
+    """
+    sha = hashlib.sha256(image_type.encode())
+    if isinstance(image_data, bytes):
+        sha.update(image_data)
+    elif isinstance(image_data, str):
+        sha.update(file_sha256(image_data).encode())
+    elif isinstance(image_data, dict):
+        for path in image_data['fits_paths']:
+            sha.update(file_sha256(path).encode())
+        sha.update(str(image_data.get('target_index', 0)).encode())
+    elif isinstance(image_data, np.ndarray):
+        sha.update(f'{image_data.dtype}{image_data.shape}'.encode())
+        sha.update(np.ascontiguousarray(image_data).tobytes())
+    else:
+        return None
+    return sha.hexdigest()
+
+
+def entry_nbytes(entry):
+    """缓存条目中数组与张量(含 SparsePredictions 的 boxes/img_ind)及字节串的总大小"""
+    total = 0
+    for value in entry.values():
+        for item in ([value.boxes, value.img_ind] if hasattr(value, 'img_ind') else [value]):
+            if isinstance(item, (bytes, str)):
+                total += len(item)
+            elif hasattr(item, 'element_size'):
+                total += item.numel() * item.element_size()
+            elif hasattr(item, 'nbytes'):
+                total += item.nbytes
+    return total
+
+
+class PredictionCache(object):
+    """
+    单图检测的原始预测缓存, 键为 (图像内容哈希, 权重哈希):
+    条目保存预处理后的原图与置信度过滤之前的解码预测, 同一张图只换 confidence 时
+    跳过解码、预处理与前向, 只重新做阈值过滤与 NMS. 按条目字节数做 LRU 淘汰.
+    """
+
+    def __init__(self, max_mb=None):
+        max_mb = max_mb if max_mb is not None else cfg.INFERENCE['PREDICTION_CACHE_MB']
+        self.max_bytes = max_mb * 1024 ** 2
+        self.__entries = OrderedDict()  # key -> (entry, nbytes)
+        self.__total = 0
+        self.__lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, image_data, image_type, weight_key):
+        if not self.max_bytes or weight_key is None:
+            return None
+        image_key = content_key(image_data, image_type)
+        return None if image_key is None else (image_key, weight_key)
+
+    def get(self, key):
+        """:return: 条目 dict, 未命中时为 None"""
+        if key is None:
+            return None
+        with self.__lock:
+            item = self.__entries.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.__entries.move_to_end(key)
+            return item[0]
+
+    def put(self, key, entry):
+        """写入或更新条目(如补充编码好的原图 PNG), 超出预算时淘汰最久未使用的条目"""
+        if key is None:
+            return
+        nbytes = entry_nbytes(entry)
+        if nbytes > self.max_bytes:
+            return
+        with self.__lock:
+            old = self.__entries.pop(key, None)
+            if old is not None:
+                self.__total -= old[1]
+            self.__entries[key] = (entry, nbytes)
+            self.__total += nbytes
+            while self.__total > self.max_bytes:
+                _, (_, evicted) = self.__entries.popitem(last=False)
+                self.__total -= evicted
+
+    def info(self):
+        with self.__lock:
+            return {'entries': len(self.__entries), 'bytes': self.__total, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses}
+
+
+def benchmark(sample_path=None, confidences=(0.3, 0.4, 0.5, 0.6, 0.7)):
+    """同一张示例图依次以不同 confidence 请求 /api/detect(boxes 模式), 第一次为冷启动, 之后命中缓存"""
+    import os
+
+    from app import app, initialize_model, PREDICTION_CACHE
+
+    sample_path = sample_path or os.path.join('sample_images', 'SDSS_1.2376611256069e+18_rgb.jpg')
+    initialize_model()
+    client = app.test_client()
+    print(f"sample={sample_path}")
+    print(f"{'confidence':>10} {'wall ms':>9} {'boxes':>6}")
+    for confidence in confidences:
+        start = time.perf_counter()
+        response = client.post('/api/detect', data={'sample_path': sample_path, 'confidence': confidence,
+                                                    'response': 'boxes'})
+        ms = (time.perf_counter() - start) * 1000
+        print(f"{confidence:>10} {ms:>9.1f} {response.get_json()['detection_count']:>6}")
+    print(PREDICTION_CACHE.info())
+
+
+if __name__ == "__main__":
+    # 在 astroyolo 目录下运行: python -m utils.prediction_cache [sample_path]
+    benchmark(sys.argv[1] if len(sys.argv) > 1 else None)
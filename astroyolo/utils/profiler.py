@@ -0,0 +1,257 @@
+# coding=utf-8
+import argparse
+import csv
+import glob
+import json
+import math
+import os
+import sys
+import time
+
+import torch
+
+sys.path.append("..")
+import config.model_config as cfg
+from utils.flops_counter import add_flops_counting_methods, flops_to_string, is_supported_instance
+
+SORT_KEYS = ('time', 'self', 'macs', 'peak', 'out', 'name')
+COLUMNS = ('name', 'type', 'calls', 'macs', 'time_ms', 'self_ms', 'peak_mb', 'out_mb')
+
+
+def _tensor_nbytes(output):
+    if isinstance(output, torch.Tensor):
+        return output.numel() * output.element_size()
+    if isinstance(output, (tuple, list)):
+        return sum(_tensor_nbytes(o) for o in output)
+    return 0
+
+
+class ModuleProfiler(object):
+    """
+    逐模块统计一次前向的耗时与显存, 通过 forward pre/post hook 实现:
+    1、耗时为包含子模块的墙钟时间(CUDA 上在每个 hook 中同步), self 为扣除直接子模块后的部分;
+    2、peak 为模块执行期间显存峰值相对进入时已分配显存的增量(仅 CUDA, 其他设备为 NaN), 嵌套模块的峰值逐层向上传递;
+    3、out 为模块输出张量的字节数;
+    4、最后一次前向的每次模块调用记录为 Chrome trace 事件(chrome://tracing 或 Perfetto 打开).
+    """
+
+    def __init__(self, model, device):
+        self.model = model
+        self.device = device
+        self.cuda = device.type == 'cuda'
+        self.names = {module: name or 'model' for name, module in model.named_modules()}
+        self.stats = {module: {'calls': 0, 'time': 0.0, 'child_time': 0.0, 'peak': 0, 'out': 0}
+                      for module in self.names}
+        self.events = []
+        self.runs = 0
+        self.__stack = []  # [module, start, allocated, running_peak, child_time]
+        self.__handles = []
+        self.__origin = None
+
+    def __sync(self):
+        if self.cuda:
+            torch.cuda.synchronize(self.device)
+
+    def __pre_hook(self, module, input):
+        self.__sync()
+        allocated = 0
+        if self.cuda:
+            # 进入子模块前把当前峰值记到所有祖先上, 再为子模块重新统计峰值
+            peak = torch.cuda.max_memory_allocated(self.device)
+            for frame in self.__stack:
+                frame[3] = max(frame[3], peak)
+            torch.cuda.reset_peak_memory_stats(self.device)
+            allocated = torch.cuda.memory_allocated(self.device)
+        self.__stack.append([module, time.perf_counter(), allocated, allocated, 0.0])
+
+    def __post_hook(self, module, input, output):
+        self.__sync()
+        end = time.perf_counter()
+        _, start, allocated, running_peak, child_time = self.__stack.pop()
+        elapsed = end - start
+        peak = max(running_peak, torch.cuda.max_memory_allocated(self.device)) if self.cuda else 0
+        stat = self.stats[module]
+        stat['calls'] += 1
+        stat['time'] += elapsed
+        stat['child_time'] += child_time
+        stat['peak'] = max(stat['peak'], peak - allocated)
+        stat['out'] = max(stat['out'], _tensor_nbytes(output))
+        if self.__stack:
+            self.__stack[-1][3] = max(self.__stack[-1][3], peak)
+            self.__stack[-1][4] += elapsed
+        if self.__origin is not None:
+            args = {'out_mb': _tensor_nbytes(output) / 1024 ** 2}
+            if self.cuda:
+                args['peak_mb'] = (peak - allocated) / 1024 ** 2
+            self.events.append({
+                'name': self.names[module], 'cat': type(module).__name__, 'ph': 'X', 'pid': 0, 'tid': 0,
+                'ts': (start - self.__origin) * 1e6, 'dur': elapsed * 1e6, 'args': args,
+            })
+
+    def __enter__(self):
+        for module in self.names:
+            self.__handles.append(module.register_forward_pre_hook(self.__pre_hook))
+            self.__handles.append(module.register_forward_hook(self.__post_hook))
+        return self
+
+    def __exit__(self, *exc):
+        for handle in self.__handles:
+            handle.remove()
+        self.__handles = []
+
+    def run(self, inputs, warmup=2, runs=5):
+        """
+        :param inputs: list of [b, 3, h, w] 张量, 依次循环使用
+        :return: 每次前向平均的墙钟时间(秒)
+        """
+        with torch.no_grad():
+            for i in range(warmup):
+                self.model(inputs[i % len(inputs)])
+            for stat in self.stats.values():
+                stat.update({'calls': 0, 'time': 0.0, 'child_time': 0.0, 'peak': 0, 'out': 0})
+            total = 0.0
+            with self:
+                for i in range(runs):
+                    self.events = []
+                    self.__origin = time.perf_counter()
+                    self.model(inputs[i % len(inputs)])
+                    total += time.perf_counter() - self.__origin
+            self.__origin = None
+        self.runs = runs
+        return total / runs
+
+    def rows(self, macs):
+        """:param macs: {module: 每张图的乘加数(含子模块)}"""
+        rows = []
+        for module, stat in self.stats.items():
+            if not stat['calls']:
+                continue
+            rows.append({
+                'name': self.names[module],
+                'type': type(module).__name__,
+                'calls': stat['calls'] // self.runs,
+                'macs': macs.get(module, 0),
+                'time_ms': stat['time'] / self.runs * 1000,
+                'self_ms': (stat['time'] - stat['child_time']) / self.runs * 1000,
+                'peak_mb': stat['peak'] / 1024 ** 2 if self.cuda else float('nan'),
+                'out_mb': stat['out'] / 1024 ** 2,
+            })
+        return rows
+
+    def chrome_trace(self, path):
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f)
+
+
+def count_macs(model, inputs):
+    """flops_counter 统计的每张图乘加数, 含 MultiheadAttention/SDPA、LayerNorm、GELU、Mish; 按模块累加子模块"""
+    counter = add_flops_counting_methods(model)
+    counter.start_flops_count()
+    with torch.no_grad():
+        model(inputs[0])
+    batch_count = counter.__batch_counter__
+    own = {m: m.__flops__ / batch_count for m in model.modules() if is_supported_instance(m)}
+    counter.stop_flops_count()
+    for m in model.modules():
+        # 去掉计数属性, 之后的前向(efficient_attention 按 __flops__ 是否存在决定是否计数)不再累加
+        if hasattr(m, '__flops__'):
+            del m.__flops__
+    return {module: sum(own.get(m, 0) for m in module.modules()) for module in model.modules()}
+
+
+def load_inputs(images, img_size, batch_size, device):
+    """images 为空时使用随机输入, 否则按 app.detect 的方式读取图片(缩放到 img_size, RGB, /255)"""
+    if not images:
+        return [torch.rand((batch_size, 3, img_size, img_size), device=device)]
+    import cv2
+
+    paths = []
+    for image in images:
+        paths += sorted(glob.glob(os.path.join(image, '*.*'))) if os.path.isdir(image) else [image]
+    tensors = []
+    for path in paths:
+        img = cv2.imread(path)
+        if img is None:
+            continue
+        img = cv2.cvtColor(cv2.resize(img, (img_size, img_size), interpolation=cv2.INTER_LINEAR), cv2.COLOR_BGR2RGB)
+        tensors.append(torch.from_numpy(img).permute(2, 0, 1).float().div(255.0))
+    assert tensors, f"No readable images in {images}"
+    batches = [torch.stack(tensors[i:i + batch_size]) for i in range(0, len(tensors), batch_size)]
+    return [b.to(device) for b in batches if len(b) == batch_size] or [batches[0].to(device)]
+
+
+def print_table(rows, sort='time', top=None, depth=None):
+    key = {'time': 'time_ms', 'self': 'self_ms', 'macs': 'macs', 'peak': 'peak_mb', 'out': 'out_mb'}.get(sort)
+    if depth is not None:
+        rows = [r for r in rows if r['name'] == 'model' or r['name'].count('.') < depth]
+    # CPU 上 peak 为 NaN, 排序时视为 0
+    rows = sorted(rows, key=lambda r: r['name']) if key is None else \
+        sorted(rows, key=lambda r: 0.0 if math.isnan(r[key]) else -r[key])
+    rows = rows[:top] if top else rows
+    width = max([len(r['name']) for r in rows] + [4])
+    print(f"{'name':<{width}} {'type':>20} {'calls':>5} {'MACs':>12} {'time ms':>9} {'self ms':>9} "
+          f"{'peak MB':>9} {'out MB':>8}")
+    for r in rows:
+        print(f"{r['name']:<{width}} {r['type'][:20]:>20} {r['calls']:>5} "
+              f"{flops_to_string(r['macs'], units='GMac', precision=3):>12} {r['time_ms']:>9.3f} {r['self_ms']:>9.3f} "
+              f"{r['peak_mb']:>9.1f} {r['out_mb']:>8.2f}")
+
+
+def write_csv(rows, path):
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='BuildModel 逐模块 MACs / 耗时 / 显存分析')
+    parser.add_argument('--weights', default=None, help='权重文件, 不指定时使用随机初始化的模型')
+    parser.add_argument('--images', nargs='*', default=None, help='图片文件或目录, 不指定时使用随机输入')
+    parser.add_argument('--img-size', type=int, default=cfg.VAL['TEST_IMG_SIZE'])
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--attention', choices=('mha', 'sdpa', 'window'), default=None,
+                        help='TransFusion 的注意力实现, 默认 cfg.MODEL["ATTENTION"]')
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu')
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--sort', choices=SORT_KEYS, default='time')
+    parser.add_argument('--top', type=int, default=40, help='只显示前 N 行, 0 表示全部')
+    parser.add_argument('--depth', type=int, default=None, help='只显示模块名中层级不超过 depth 的模块')
+    parser.add_argument('--csv', default=None, help='完整结果写入 CSV')
+    parser.add_argument('--trace', default=None, help='最后一次前向的 Chrome trace(JSON)')
+    args = parser.parse_args(argv)
+
+    from model.model import BuildModel
+
+    device = torch.device(args.device)
+    model = BuildModel().to(device)
+    if args.weights:
+        state = torch.load(args.weights, map_location=device)
+        model.load_state_dict(state['model'] if isinstance(state, dict) and 'model' in state else state)
+    model.eval()
+    if args.attention:
+        for module in model.modules():
+            if hasattr(module, 'attention_mode'):
+                module.attention_mode = args.attention
+    inputs = load_inputs(args.images, args.img_size, args.batch_size, device)
+
+    macs = count_macs(model, inputs)
+    profiler = ModuleProfiler(model, device)
+    forward = profiler.run(inputs, warmup=args.warmup, runs=args.runs)
+    rows = profiler.rows(macs)
+    print(f"device={device}, input={tuple(inputs[0].shape)}, attention={args.attention or cfg.MODEL['ATTENTION']}, "
+          f"forward={forward * 1000:.2f} ms (hooked, {args.runs} runs), total={flops_to_string(macs[model])}/image")
+    print_table(rows, args.sort, args.top, args.depth)
+    if args.csv:
+        write_csv(rows, args.csv)
+        print(f"结果已写入 {args.csv}")
+    if args.trace:
+        profiler.chrome_trace(args.trace)
+        print(f"Chrome trace 已写入 {args.trace}")
+    return rows
+
+
+if __name__ == "__main__":
+    # 在 astroyolo 目录下运行: python -m utils.profiler --img-size 352 --sort self --trace trace.json
+    main()
@@ -0,0 +1,181 @@
+# coding=utf-8
+import io
+import json
+import os
+import random
+import sys
+
+sys.path.append("..")
+import numpy as np
+import torch
+import torch.nn as nn
+
+import config.model_config as cfg
+from model.head import YOLOHead
+from model.trans_fusion import TransFusion
+from utils.evaluator import ap50_by_size
+from utils.inference_optimizer import benchmark_latency
+
+QUANTIZED_SUFFIX = '.int8.pt'
+# 保持浮点的模块: 注意力(TransFusion)与解码头(YOLOHead)对量化误差敏感, Mish 没有 int8 内核
+FLOAT_MODULES = (TransFusion, YOLOHead)
+
+
+def calibration_batches(anno_file_type='train', num_samples=None, batch_size=None, img_size=None, seed=0):
+    """
+    从标注列表中随机抽取样本, 按 BuildDataset 的预处理(Resize 到 img_size, 归一化到 [0, 1])生成校准批
+    :return: 生成器, 每次产出 (imgs [n, 3, H, W], bboxes list of [k, 5])
+    """
+    from utils.datasets import BuildDataset
+
+    num_samples = num_samples or cfg.INFERENCE["QUANT_CALIB_SAMPLES"]
+    batch_size = batch_size or cfg.VAL["BATCH_SIZE"]
+    img_size = img_size or cfg.VAL["TEST_IMG_SIZE"]
+    dataset = BuildDataset(anno_file_type, img_size=img_size, use_cache=False)
+    indices = list(range(len(dataset)))
+    random.Random(seed).shuffle(indices)
+    indices = indices[:num_samples]
+    for i in range(0, len(indices), batch_size):
+        samples = [dataset.parse_sample(j) for j in indices[i:i + batch_size]]
+        imgs = torch.from_numpy(np.stack([img for img, _ in samples])).permute(0, 3, 1, 2).float()
+        yield imgs, [np.asarray(bboxes, dtype=np.float32).reshape(-1, 5) for _, bboxes in samples]
+
+
+def quantize_model(model, calib_batches, backend=None):
+    """
+    FX 图模式的训练后静态量化: backbone、SpatialPyramidPooling、PANet 的卷积与 PredictNet 量化为 int8,
+    TransFusion 作为不追踪的叶子模块保持浮点(前后自动插入反量化/量化), YOLOHead 不参与量化.
+    Conv+BN 在 prepare 阶段自动融合.
+    :param model: eval 模式的 BuildModel, 会被移到 CPU
+    :param calib_batches: 可迭代的 [n, 3, H, W] 张量或 (imgs, ...) 元组
+    :return: 量化后的 BuildModel(yolo_v4 替换为量化的 GraphModule), 只能在 CPU 上运行
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.fx.custom_config import PrepareCustomConfig
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    backend = backend or cfg.INFERENCE["QUANT_BACKEND"]
+    torch.backends.quantized.engine = backend
+    model = model.cpu().eval()
+    qconfig_mapping = get_default_qconfig_mapping(backend)
+    for module_type in FLOAT_MODULES + (nn.Mish,):
+        qconfig_mapping.set_object_type(module_type, None)
+    custom_config = PrepareCustomConfig().set_non_traceable_module_classes(list(FLOAT_MODULES))
+
+    img_size = cfg.VAL["TEST_IMG_SIZE"]
+    example = (torch.zeros((1, 3, img_size, img_size)),)
+    prepared = prepare_fx(model.yolo_v4, qconfig_mapping, example, prepare_custom_config=custom_config)
+    count = 0
+    with torch.no_grad():
+        for batch in calib_batches:
+            imgs = batch[0] if isinstance(batch, (tuple, list)) else batch
+            prepared(imgs)
+            count += len(imgs)
+    print(f"校准完成, 共 {count} 张图像")
+    model.yolo_v4 = convert_fx(prepared)
+    return model
+
+
+def save_quantized_model(model, path):
+    """保存为 TorchScript 归档(以 QUANTIZED_SUFFIX 结尾), load_model 可直接加载"""
+    assert path.endswith(QUANTIZED_SUFFIX), f"quantized checkpoint must end with {QUANTIZED_SUFFIX}"
+    img_size = cfg.VAL["TEST_IMG_SIZE"]
+    with torch.no_grad():
+        traced = torch.jit.freeze(torch.jit.trace(model.eval(), torch.zeros((1, 3, img_size, img_size)),
+                                                  check_trace=False))
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    torch.jit.save(traced, path)
+    print(f"量化模型已保存: {path}")
+    return traced
+
+
+class QuantizedModel(nn.Module):
+    """int8 模型只能在 CPU 上运行: 输入搬到 CPU, 解码输出再搬回调用方的设备"""
+
+    def __init__(self, module, nbytes):
+        super(QuantizedModel, self).__init__()
+        self.module = module
+        self.nbytes = nbytes
+        self.eval()
+
+    def forward(self, x):
+        p, p_d = self.module(x.cpu())
+        return p, p_d.to(x.device)
+
+
+def load_quantized_model(path, device):
+    torch.backends.quantized.engine = cfg.INFERENCE["QUANT_BACKEND"]
+    if torch.device(device).type != 'cpu':
+        print("int8 量化模型在 CPU 上运行")
+    return QuantizedModel(torch.jit.load(path, map_location='cpu'), os.path.getsize(path))
+
+
+def serialized_nbytes(model):
+    if isinstance(model, QuantizedModel):
+        # 冻结的 TorchScript 不暴露参数, 包装的 state_dict 为空, 取检查点文件大小
+        return model.nbytes
+    buffer = io.BytesIO()
+    if isinstance(model, torch.jit.ScriptModule):
+        torch.jit.save(model, buffer)
+    else:
+        torch.save(model.state_dict(), buffer)
+    return buffer.getbuffer().nbytes
+
+
+def quantization_report(float_model, quant_model, eval_batches, latency_batch_size=1):
+    """
+    对比浮点与 int8 模型(都在 CPU 上)的分尺寸 AP50、单次前向延迟与序列化后的模型大小
+    :param eval_batches: list of (imgs, bboxes), 通常取自测试折
+    """
+    img_size = cfg.VAL["TEST_IMG_SIZE"]
+    inputs = torch.rand((latency_batch_size, 3, img_size, img_size))
+    float_ap = ap50_by_size(float_model, eval_batches)
+    quant_ap = ap50_by_size(quant_model, eval_batches)
+    float_ms = benchmark_latency(float_model, inputs)
+    quant_ms = benchmark_latency(quant_model, inputs)
+    float_bytes, quant_bytes = serialized_nbytes(float_model), serialized_nbytes(quant_model)
+    return {
+        'ap50': {name: {'float': float_ap[name], 'int8': quant_ap[name], 'delta': quant_ap[name] - float_ap[name]}
+                 for name in float_ap},
+        'latency_ms': {'float': float_ms, 'int8': quant_ms, 'speedup': float_ms / quant_ms},
+        'size_mb': {'float': float_bytes / 1024 ** 2, 'int8': quant_bytes / 1024 ** 2,
+                    'saved': (float_bytes - quant_bytes) / 1024 ** 2},
+        'batch_size': latency_batch_size,
+        'num_threads': torch.get_num_threads(),
+    }
+
+
+def print_report(report):
+    print(f"{'scale':>8} {'float AP50':>11} {'int8 AP50':>10} {'delta':>8}")
+    for name, ap in report['ap50'].items():
+        print(f"{name:>8} {ap['float']:>11.4f} {ap['int8']:>10.4f} {ap['delta']:>+8.4f}")
+    latency, size = report['latency_ms'], report['size_mb']
+    print(f"latency: float {latency['float']:.1f} ms, int8 {latency['int8']:.1f} ms (x{latency['speedup']:.2f})")
+    print(f"size: float {size['float']:.1f} MB, int8 {size['int8']:.1f} MB (saved {size['saved']:.1f} MB)")
+
+
+if __name__ == "__main__":
+    # python quantization.py weight_path [output_path] [eval_anno_type]
+    # 在训练标注上校准, 保存 *.int8.pt, 并在 eval_anno_type(默认 test)上输出精度/延迟/大小报告(同名 .json)
+    import copy
+
+    from model.model import BuildModel
+
+    weight_path = sys.argv[1]
+    output_path = sys.argv[2] if len(sys.argv) > 2 else os.path.splitext(weight_path)[0] + QUANTIZED_SUFFIX
+    eval_anno_type = sys.argv[3] if len(sys.argv) > 3 else 'test'
+
+    float_model = BuildModel()
+    state = torch.load(weight_path, map_location='cpu')
+    float_model.load_state_dict(state['model'] if isinstance(state, dict) and 'model' in state else state)
+    float_model.eval()
+
+    quant_model = quantize_model(copy.deepcopy(float_model), calibration_batches('train'))
+    quant_model = save_quantized_model(quant_model, output_path)
+
+    eval_batches = list(calibration_batches(eval_anno_type, num_samples=sys.maxsize))
+    report = quantization_report(float_model, quant_model, eval_batches)
+    report['weight_path'], report['quantized_path'] = weight_path, output_path
+    print_report(report)
+    with open(output_path[:-len(QUANTIZED_SUFFIX)] + '.int8.json', 'w') as f:
+        json.dump(report, f, indent=2)
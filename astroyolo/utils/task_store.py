@@ -0,0 +1,265 @@
+# coding=utf-8
+import base64
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+sys.path.append("..")
+import config.model_config as cfg
+
+TASK_DB_FILE = 'task_index.sqlite'
+# 排序方式: (键列, 方向). 键列以 task_id 结尾保证唯一, 分页游标即上一页最后一行的键
+ORDERS = {
+    'newest': (('timestamp', 'task_id'), 'DESC'),
+    'oldest': (('timestamp', 'task_id'), 'ASC'),
+    'detections': (('detection_count', 'timestamp', 'task_id'), 'DESC'),
+}
+SUMMARY_FIELDS = ('task_id', 'timestamp', 'status', 'dataset_name', 'files_count', 'detection_count',
+                  'success_count', 'processed', 'total', 'finished_at', 'message')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    task_id TEXT PRIMARY KEY,
+    timestamp REAL,
+    status TEXT,
+    dataset_name TEXT,
+    files_count INTEGER DEFAULT 0,
+    detection_count INTEGER DEFAULT 0,
+    success_count INTEGER DEFAULT 0,
+    processed INTEGER DEFAULT 0,
+    total INTEGER DEFAULT 0,
+    finished_at REAL,
+    message TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_tasks_time_key ON tasks (timestamp, task_id);
+CREATE INDEX IF NOT EXISTS idx_tasks_detections_key ON tasks (detection_count, timestamp, task_id);
+CREATE INDEX IF NOT EXISTS idx_tasks_status_key ON tasks (status, timestamp, task_id);
+CREATE INDEX IF NOT EXISTS idx_tasks_dataset_key ON tasks (dataset_name, timestamp, task_id);
+CREATE TABLE IF NOT EXISTS task_files (
+    task_id TEXT,
+    seq INTEGER,
+    filename TEXT,
+    status TEXT,
+    detection_count INTEGER DEFAULT 0,
+    result_filename TEXT,
+    PRIMARY KEY (task_id, seq)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+-- 全部任务的合计由触发器随写入维护, 第一页不必扫描整个 tasks 表
+INSERT OR IGNORE INTO meta SELECT 'total_tasks', COUNT(*) FROM tasks;
+INSERT OR IGNORE INTO meta SELECT 'total_files', COALESCE(SUM(files_count), 0) FROM tasks;
+INSERT OR IGNORE INTO meta SELECT 'total_detections', COALESCE(SUM(detection_count), 0) FROM tasks;
+CREATE TRIGGER IF NOT EXISTS tasks_totals_insert AFTER INSERT ON tasks BEGIN
+    UPDATE meta SET value = CAST(value AS INTEGER) + CASE key
+        WHEN 'total_tasks' THEN 1
+        WHEN 'total_files' THEN COALESCE(NEW.files_count, 0)
+        ELSE COALESCE(NEW.detection_count, 0) END
+    WHERE key IN ('total_tasks', 'total_files', 'total_detections');
+END;
+CREATE TRIGGER IF NOT EXISTS tasks_totals_update AFTER UPDATE OF files_count, detection_count ON tasks BEGIN
+    UPDATE meta SET value = CAST(value AS INTEGER) + CASE key
+        WHEN 'total_files' THEN COALESCE(NEW.files_count, 0) - COALESCE(OLD.files_count, 0)
+        ELSE COALESCE(NEW.detection_count, 0) - COALESCE(OLD.detection_count, 0) END
+    WHERE key IN ('total_files', 'total_detections');
+END;
+"""
+TOTAL_KEYS = ('total_tasks', 'total_files', 'total_detections')
+
+
+def summarize(task_info):
+    """task_info.json -> tasks 表的一行(不含逐文件结果)"""
+    results = task_info.get('results', [])
+    progress = task_info.get('progress', {})
+    success_count = task_info.get('success_count')
+    if success_count is None:
+        success_count = sum(1 for r in results if r.get('status', 'success') != 'error')
+    return {
+        'task_id': task_info['task_id'],
+        'timestamp': task_info.get('timestamp', 0),
+        'status': task_info.get('status', 'completed'),
+        'dataset_name': task_info.get('dataset_name'),
+        'files_count': task_info.get('files_count', len(results)),
+        'detection_count': task_info.get('detection_count', 0),
+        'success_count': success_count,
+        'processed': progress.get('processed', len(results)),
+        'total': progress.get('total', len(results)),
+        'finished_at': task_info.get('finished_at'),
+        'message': task_info.get('message'),
+    }
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(list(values)).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor, size):
+    """:raise ValueError: 游标不是 encode_cursor 生成的、键个数为 size 的列表"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except Exception:
+        raise ValueError(f"invalid cursor: {cursor}")
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError(f"invalid cursor: {cursor}")
+    return values
+
+
+class TaskStore(object):
+    """
+    任务摘要的 SQLite 索引, 与各任务目录下的 task_info.json 同步写入:
+    tasks 表每个任务一行(状态、文件数、检测数等), task_files 表每个文件一行(检测数、结果图文件名).
+    /api/tasks 只查询索引, 不再遍历 OUTPUT_DIR 和读取每个 task_info.json.
+    每个线程/进程各自打开连接, WAL 模式下读写互不阻塞.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.__local = threading.local()
+
+    def __getstate__(self):
+        # 传给作业工作进程时不携带已打开的连接
+        return {'db_path': self.db_path}
+
+    def __setstate__(self, state):
+        self.__init__(state['db_path'])
+
+    @property
+    def conn(self):
+        conn = getattr(self.__local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(SCHEMA)
+            self.__local.conn = conn
+        return conn
+
+    def upsert(self, task_info, results_from=0):
+        """
+        写入任务摘要, 以及 results[results_from:] 的逐文件记录
+        :param results_from: 已写入过的结果条数, TaskRecorder 增量写入时只传新增部分
+        """
+        row = summarize(task_info)
+        files = [(row['task_id'], seq, r.get('filename'), r.get('status', 'success'),
+                  r.get('detection_count', 0), r.get('result_filename'))
+                 for seq, r in enumerate(task_info.get('results', [])[results_from:], start=results_from)]
+        updates = ', '.join(f'{k} = excluded.{k}' for k in SUMMARY_FIELDS[1:])
+        with self.conn:
+            # ON CONFLICT DO UPDATE(而不是 REPLACE)使合计触发器能看到旧值
+            self.conn.execute(
+                f"INSERT INTO tasks ({', '.join(SUMMARY_FIELDS)}) VALUES ({', '.join('?' * len(SUMMARY_FIELDS))}) "
+                f"ON CONFLICT (task_id) DO UPDATE SET {updates}", [row[k] for k in SUMMARY_FIELDS])
+            if files:
+                self.conn.executemany("INSERT OR REPLACE INTO task_files VALUES (?, ?, ?, ?, ?, ?)", files)
+
+    def get(self, task_id):
+        row = self.conn.execute("SELECT * FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+        return self.__to_dict(row) if row is not None else None
+
+    def files(self, task_id, offset=0, limit=-1):
+        rows = self.conn.execute("SELECT * FROM task_files WHERE task_id = ? ORDER BY seq LIMIT ? OFFSET ?",
+                                 (task_id, limit, offset)).fetchall()
+        return [dict(row) for row in rows]
+
+    @staticmethod
+    def __to_dict(row):
+        task = dict(row)
+        task['progress'] = {'processed': task.pop('processed'), 'total': task.pop('total')}
+        return task
+
+    def totals(self):
+        """全部任务的任务数、文件数与检测数合计, 读取触发器维护的 meta 记录"""
+        rows = dict(self.conn.execute(
+            f"SELECT key, value FROM meta WHERE key IN ({', '.join('?' * len(TOTAL_KEYS))})", TOTAL_KEYS).fetchall())
+        return {key: int(rows.get(key) or 0) for key in TOTAL_KEYS}
+
+    def list(self, page_size=None, cursor=None, status=None, dataset_name=None, since=None, until=None,
+             min_detections=None, order='newest', with_stats=False):
+        """
+        可过滤的任务列表, 只读索引. 按排序键做 keyset 分页: 下一页从 cursor(上一页返回的 next_cursor)
+        之后开始, 走索引定位, 不使用 OFFSET, 翻页耗时与页码无关.
+        :param cursor: 为 None 时返回第一页
+        :param with_stats: 第一页是否附带合计; 无过滤条件时读取 meta 中的合计,
+                           有过滤条件时需要扫描满足条件的全部任务
+        :return: (tasks, next_cursor, stats) next_cursor 在没有更多任务时为 None;
+                 stats 为过滤后全部任务的 total_tasks / total_files / total_detections,
+                 只在 with_stats 的第一页返回, 其余为 None
+        :raise ValueError: cursor 无效
+        """
+        page_size = min(page_size or cfg.INFERENCE['TASKS_PAGE_SIZE'], cfg.INFERENCE['TASKS_MAX_PAGE_SIZE'])
+        assert order in ORDERS, f"order must be in {list(ORDERS)}"
+        columns, direction = ORDERS[order]
+        where, args = [], []
+        for clause, value in [('status = ?', status), ('dataset_name = ?', dataset_name), ('timestamp >= ?', since),
+                              ('timestamp < ?', until), ('detection_count >= ?', min_detections)]:
+            if value is not None:
+                where.append(clause)
+                args.append(value)
+        filters = f"WHERE {' AND '.join(where)}" if where else ''
+
+        stats = None
+        if cursor is None and with_stats:
+            if where:
+                total, files, detections = self.conn.execute(
+                    f"SELECT COUNT(*), COALESCE(SUM(files_count), 0), COALESCE(SUM(detection_count), 0) "
+                    f"FROM tasks {filters}", args).fetchone()
+                stats = {'total_tasks': total, 'total_files': files, 'total_detections': detections}
+            else:
+                stats = self.totals()
+        if cursor is not None:
+            where.append(f"({', '.join(columns)}) {'<' if direction == 'DESC' else '>'} "
+                         f"({', '.join('?' * len(columns))})")
+            args = args + decode_cursor(cursor, len(columns))
+        where = f"WHERE {' AND '.join(where)}" if where else ''
+        order_by = ', '.join(f'{column} {direction}' for column in columns)
+        # 多取一行判断是否还有下一页
+        rows = self.conn.execute(f"SELECT * FROM tasks {where} ORDER BY {order_by} LIMIT ?",
+                                 args + [page_size + 1]).fetchall()
+        next_cursor = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            next_cursor = encode_cursor(rows[-1][column] for column in columns)
+        return [self.__to_dict(row) for row in rows], next_cursor, stats
+
+    def backfill(self, output_dir, force=False):
+        """
+        一次性迁移: 把 output_dir 下已有的 task_* 目录写入索引. 完成后在 meta 表中记录,
+        之后的启动不再扫描目录(新任务由写入 task_info.json 的代码同步写入索引).
+        :param force: 重新扫描并覆盖索引中已有的任务
+        :return: 写入的任务数
+        """
+        done = self.conn.execute("SELECT value FROM meta WHERE key = 'backfilled_at'").fetchone()
+        if done is not None and not force:
+            return 0
+        known = {row[0] for row in self.conn.execute("SELECT task_id FROM tasks")}
+        count = 0
+        for task_id in sorted(os.listdir(output_dir)):
+            task_dir = os.path.join(output_dir, task_id)
+            if not task_id.startswith('task_') or not os.path.isdir(task_dir) or (task_id in known and not force):
+                continue
+            try:
+                with open(os.path.join(task_dir, 'task_info.json'), 'r') as f:
+                    task_info = json.load(f)
+            except (OSError, ValueError):
+                task_info = {'status': 'unknown'}
+            task_info.setdefault('task_id', task_id)
+            task_info.setdefault('timestamp', os.path.getctime(task_dir))
+            self.upsert(task_info)
+            count += 1
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('backfilled_at', ?)", (str(time.time()),))
+        print(f"任务索引迁移完成, 写入 {count} 个任务")
+        return count
+
+
+if __name__ == "__main__":
+    # python -m utils.task_store [output_dir] [--force]
+    output_dir = sys.argv[1] if len(sys.argv) > 1 and not sys.argv[1].startswith('--') else 'detection_results'
+    TaskStore(os.path.join(output_dir, TASK_DB_FILE)).backfill(output_dir, force='--force' in sys.argv)
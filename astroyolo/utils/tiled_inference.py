@@ -0,0 +1,212 @@
+# coding=utf-8
+import io
+import sys
+
+sys.path.append("..")
+import cv2
+import numpy as np
+import torch
+
+import config.model_config as cfg
+from utils.fits_operator import load_fits_image
+from utils.postprocess import batched_nms, filter_detections
+
+
+def tile_origins(length, tile_size, overlap):
+    """
+    沿一个方向的窗口起点, 相邻窗口重叠 overlap 像素, 最后一个窗口与边缘对齐
+    :return: list of int
+    """
+    if length <= tile_size:
+        return [0]
+    step = tile_size - overlap
+    origins = list(range(0, length - tile_size, step))
+    origins.append(length - tile_size)
+    return origins
+
+
+def open_frame(image_data, image_type='npy'):
+    """
+    打开整幅图像但不做缩放. npy 文件以只读内存映射方式打开, 窗口读取时才真正读盘.
+    :return: (array, channels_first) array 为 [H, W]、[H, W, C] 或 [C, H, W];
+             jpg/png 为 BGR 的 [H, W, 3], fits 为 [0, 1] 的 [H, W, C]
+    """
+    if image_type == 'npy':
+        if isinstance(image_data, str):
+            frame = np.load(image_data, mmap_mode='r', allow_pickle=False)
+        elif isinstance(image_data, bytes):
+            frame = np.load(io.BytesIO(image_data), allow_pickle=True)
+        elif isinstance(image_data, np.ndarray):
+            frame = image_data
+        else:
+            raise ValueError("NPY image_data is not a file path, bytes, or numpy array.")
+        channels_first = frame.ndim == 3 and frame.shape[0] in [1, 3]
+        return frame, channels_first
+    elif image_type in ['jpg', 'jpeg', 'png']:
+        if isinstance(image_data, str):
+            frame = cv2.imread(image_data)
+        else:
+            frame = cv2.imdecode(np.frombuffer(image_data, np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            raise ValueError("Could not decode image.")
+        return frame, False
+    elif image_type == 'fits':
+        # 拉伸后的 [H, W, C] 波段立方体, 通道顺序与 preprocess_image 一致(B/G/R)
+        return load_fits_image(image_data), False
+    raise ValueError(f"Unsupported image_type for tiled inference: {image_type}")
+
+
+class TiledFrame(object):
+    """
+    大幅面图像的窗口读取器: 按窗口从(内存映射的)数组中切片, 转成模型需要的 uint8 RGB.
+    非 uint8 数据按整幅图的最小/最大值归一化, 统计量按行块流式计算, 不需要把整幅图读入内存.
+    """
+
+    def __init__(self, frame, channels_first=False, bgr=False, rows_per_chunk=256):
+        self.frame = frame
+        self.channels_first = channels_first
+        self.bgr = bgr
+        if channels_first:
+            self.height, self.width = frame.shape[1:3]
+        else:
+            self.height, self.width = frame.shape[:2]
+        self.lo, self.hi = 0.0, 255.0
+        if frame.dtype != np.uint8:
+            self.lo, self.hi = self.__min_max(rows_per_chunk)
+
+    def __rows(self, y0, y1):
+        return self.frame[:, y0:y1] if self.channels_first else self.frame[y0:y1]
+
+    def __min_max(self, rows_per_chunk):
+        lo, hi = np.inf, -np.inf
+        for y0 in range(0, self.height, rows_per_chunk):
+            chunk = np.asarray(self.__rows(y0, y0 + rows_per_chunk))
+            lo, hi = min(lo, float(np.nanmin(chunk))), max(hi, float(np.nanmax(chunk)))
+        return lo, hi
+
+    def __to_rgb_uint8(self, block):
+        block = np.asarray(block)
+        if self.channels_first:
+            block = np.transpose(block, (1, 2, 0))
+        if block.ndim == 2:
+            block = block[..., None]
+        if block.dtype != np.uint8:
+            block = block.astype(np.float32)
+            if self.hi > self.lo:
+                block = (block - self.lo) / (self.hi - self.lo) * 255.0
+            else:
+                block = np.zeros_like(block)
+            block = np.clip(np.nan_to_num(block), 0, 255).astype(np.uint8)
+        if block.shape[2] == 1:
+            block = np.repeat(block, 3, axis=2)
+        elif self.bgr:
+            block = block[..., ::-1]
+        return block
+
+    def read(self, x0, y0, size):
+        """读取以 (x0, y0) 为左上角的 size x size 窗口, 超出图像的部分补零"""
+        if self.channels_first:
+            block = self.frame[:, y0:y0 + size, x0:x0 + size]
+        else:
+            block = self.frame[y0:y0 + size, x0:x0 + size]
+        block = self.__to_rgb_uint8(block)
+        if block.shape[:2] != (size, size):
+            padded = np.zeros((size, size, 3), dtype=np.uint8)
+            padded[:block.shape[0], :block.shape[1]] = block
+            block = padded
+        return np.ascontiguousarray(block)
+
+    def render_preview(self, max_side=None, rows_per_chunk=256):
+        """
+        绘制结果图用的 uint8 BGR 预览: 长边超过 max_side 时按整数步长抽样, 逐行块读取,
+        内存只与预览大小有关, 不会拼出整幅原分辨率图像
+        :param max_side: 预览长边上限, 默认 cfg.INFERENCE['TILE_PREVIEW_MAX_SIDE']
+        :return: (image [h, w, 3], scale) scale 为预览坐标 / 原图坐标
+        """
+        max_side = max_side or cfg.INFERENCE["TILE_PREVIEW_MAX_SIDE"]
+        step = max(1, -(-max(self.height, self.width) // max_side))
+        rows = []
+        for y0 in range(0, self.height, rows_per_chunk * step):
+            y1 = min(y0 + rows_per_chunk * step, self.height)
+            if self.channels_first:
+                block = self.frame[:, y0:y1:step, ::step]
+            else:
+                block = self.frame[y0:y1:step, ::step]
+            rows.append(self.__to_rgb_uint8(block)[..., ::-1])
+        return np.ascontiguousarray(np.concatenate(rows, axis=0)), 1.0 / step
+
+
+def to_preview(boxes, scale):
+    """把整图坐标的 [k, 6] 检测框换算到 render_preview 的坐标"""
+    boxes = np.array(boxes, dtype=np.float64).reshape(-1, 6)
+    boxes[:, :4] *= scale
+    return boxes
+
+
+class TiledInference(object):
+    """
+    滑窗分块推理: 以 TEST_IMG_SIZE 大小、相互重叠的窗口覆盖整幅图像, 不做缩放,
+    窗口按 BatchInferenceEngine 的微批送入模型, 各窗口的检测框平移回整图坐标后
+    用向量化 NMS 合并重叠区域内的重复框.
+    """
+
+    def __init__(self, engine, overlap=None, merge_thresh=None):
+        """
+        :param engine: BatchInferenceEngine, 复用其模型、设备与输入缓冲区
+        :param overlap: 相邻窗口的重叠像素数, 应大于目标的典型尺寸
+        :param merge_thresh: 跨窗口合并重复框的 IoU 阈值
+        """
+        self.engine = engine
+        self.tile_size = engine.img_size
+        self.overlap = overlap if overlap is not None else cfg.INFERENCE["TILE_OVERLAP"]
+        self.merge_thresh = merge_thresh if merge_thresh is not None else cfg.INFERENCE["TILE_MERGE_THRESH"]
+        assert 0 <= self.overlap < self.tile_size
+
+    def detect(self, tiled_frame, conf_thresh=0.3, nms_thresh=0.9):
+        """
+        :param tiled_frame: TiledFrame
+        :return: np.ndarray [k, 6] (x1, y1, x2, y2, score, class), 整图坐标
+        """
+        origins = [(x0, y0) for y0 in tile_origins(tiled_frame.height, self.tile_size, self.overlap)
+                   for x0 in tile_origins(tiled_frame.width, self.tile_size, self.overlap)]
+        batch_size = self.engine.batch_size
+        detections = []
+        for i in range(0, len(origins), batch_size):
+            chunk = origins[i:i + batch_size]
+            pred = self.engine.forward([tiled_frame.read(x0, y0, self.tile_size) for x0, y0 in chunk])
+            tile_dets = filter_detections(pred, conf_thresh, nms_thresh, class_agnostic=True,
+                                          clip_size=self.tile_size)
+            for (x0, y0), det in zip(chunk, tile_dets):
+                det[:, [0, 2]] += x0
+                det[:, [1, 3]] += y0
+                detections.append(det)
+
+        detections = torch.cat(detections, dim=0)
+        # 裁掉补零区域, 再合并重叠窗口中的重复框
+        detections[:, [0, 2]] = detections[:, [0, 2]].clamp(max=tiled_frame.width)
+        detections[:, [1, 3]] = detections[:, [1, 3]].clamp(max=tiled_frame.height)
+        detections = detections[(detections[:, 2] > detections[:, 0]) & (detections[:, 3] > detections[:, 1])]
+        groups = torch.zeros(len(detections), dtype=torch.long, device=detections.device)
+        keep = batched_nms(detections[:, :4], detections[:, 4], groups, self.merge_thresh)
+        return detections[keep].cpu().numpy()
+
+    def run(self, items, conf_thresh=0.3):
+        """
+        与 BatchInferenceEngine.run 的产出格式相同, 逐张图分块推理
+        :param items: list of (image_data, image_type)
+        """
+        for index, (image_data, image_type) in enumerate(items):
+            try:
+                frame, channels_first = open_frame(image_data, image_type)
+                tiled_frame = TiledFrame(frame, channels_first, bgr=image_type != 'npy')
+                boxes = self.detect(tiled_frame, conf_thresh)
+                preview, scale = tiled_frame.render_preview()
+                yield index, {
+                    'status': 'success',
+                    'boxes': boxes,
+                    'original_img_bgr': preview,  # 缩小的预览, 框需按 preview_scale 换算后再绘制
+                    'preview_scale': scale,
+                    'original_shape': (tiled_frame.height, tiled_frame.width),
+                }
+            except Exception as e:
+                yield index, {'status': 'error', 'message': str(e)}
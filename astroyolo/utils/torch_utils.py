@@ -59,8 +59,10 @@ def fuse_conv_and_bn(conv, bn):
             kernel_size=conv.kernel_size,
             stride=conv.stride,
             padding=conv.padding,
+            dilation=conv.dilation,
+            groups=conv.groups,
             bias=True,
-        )
+        ).to(conv.weight.device)
 
         # prepare filters
         w_conv = conv.weight.clone().view(conv.out_channels, -1)
@@ -73,7 +75,7 @@ def fuse_conv_and_bn(conv, bn):
         if conv.bias is not None:
             b_conv = conv.bias
         else:
-            b_conv = torch.zeros(conv.weight.size(0))
+            b_conv = torch.zeros(conv.weight.size(0), device=conv.weight.device)
         b_bn = bn.bias - bn.weight.mul(bn.running_mean).div(
             torch.sqrt(bn.running_var + bn.eps)
         )
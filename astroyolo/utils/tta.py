@@ -0,0 +1,183 @@
+# coding=utf-8
+import json
+import sys
+import time
+
+sys.path.append("..")
+import torch
+import torch.nn.functional as F
+
+import config.model_config as cfg
+from model.head import SparsePredictions
+from utils.postprocess import filter_detections, split_batch_predictions, weighted_box_fusion
+
+MERGE_METHODS = ('wbf', 'nms')
+FLIPS = {'h': (True, False), 'v': (False, True), 'hv': (True, True)}
+
+
+def view_size(img_size, scale, multiple=32):
+    """缩放后的视图边长, 取整到 multiple(最大 stride)的倍数, 使各尺度的网格与输入对齐"""
+    return max(multiple, int(round(img_size * scale / multiple)) * multiple)
+
+
+class TTAEngine(object):
+    """
+    测试时增强: 每张图生成 len(scales) * (1 + len(flips)) 个视图(缩放、翻转), 较小的视图放在
+    最大视图尺寸的画布左上角、其余补零, 所有图片的所有视图拼成一批只做一次前向.
+    解码后的框(置信度过滤前)先逆变换回原输入坐标, 再按 merge 合并:
+    nms: 各视图的框直接合在一起做一次 NMS; wbf: 各视图分别 NMS 后做加权框融合.
+    调用方式与 evaluator.ap50_by_size 的 detector 参数一致: imgs -> list of [k, 6].
+    """
+
+    def __init__(self, model, img_size=None, scales=None, flips=None, merge=None, conf_thresh=None,
+                 nms_thresh=None, wbf_iou=None):
+        """
+        :param scales: 相对 img_size 的缩放比例, 默认 MULTI_SCALE_VAL 为真时取 TTA_SCALES, 否则 (1.0,)
+        :param flips: FLIPS 中的键, 默认 FLIP_VAL 为真时取 TTA_FLIPS, 否则不翻转
+        :param merge: 'wbf' | 'nms', 默认 TTA_MERGE
+        """
+        self.model = model
+        self.img_size = img_size or cfg.VAL["TEST_IMG_SIZE"]
+        if scales is None:
+            scales = cfg.VAL["TTA_SCALES"] if cfg.VAL["MULTI_SCALE_VAL"] else (1.0,)
+        if flips is None:
+            flips = cfg.VAL["TTA_FLIPS"] if cfg.VAL["FLIP_VAL"] else ()
+        assert all(f in FLIPS for f in flips), f"Error: flips must be in {list(FLIPS)}"
+        self.merge = merge or cfg.VAL["TTA_MERGE"]
+        assert self.merge in MERGE_METHODS, f"Error: merge must be in {MERGE_METHODS}"
+        self.conf_thresh = cfg.VAL["CONF_THRESH"] if conf_thresh is None else conf_thresh
+        self.nms_thresh = cfg.VAL["NMS_THRESH"] if nms_thresh is None else nms_thresh
+        self.wbf_iou = wbf_iou or cfg.VAL["TTA_WBF_IOU"]
+        # 每个视图: (边长, 水平翻转, 垂直翻转)
+        self.views = [(view_size(self.img_size, s), False, False) for s in scales]
+        self.views += [(size, *FLIPS[f]) for size, _, _ in list(self.views) for f in flips]
+        self.canvas = max(size for size, _, _ in self.views)
+
+    def __len__(self):
+        return len(self.views)
+
+    def make_batch(self, imgs):
+        """
+        :param imgs: [b, 3, img_size, img_size]
+        :return: [b * num_views, 3, canvas, canvas], 第 i 张图的视图位于 [i * num_views, (i + 1) * num_views)
+        """
+        resized = {}
+        views = []
+        for size, flip_h, flip_v in self.views:
+            if size not in resized:
+                resized[size] = imgs if size == imgs.shape[-1] else \
+                    F.interpolate(imgs, size=(size, size), mode='bilinear', align_corners=False)
+            view = resized[size]
+            if flip_h or flip_v:
+                view = view.flip([d for d, flip in ((-1, flip_h), (-2, flip_v)) if flip])
+            if size < self.canvas:
+                view = F.pad(view, (0, self.canvas - size, 0, self.canvas - size))
+            views.append(view)
+        return torch.stack(views, dim=1).flatten(0, 1)
+
+    def untransform(self, boxes, view_ind):
+        """
+        把画布坐标下的 (x, y, w, h, ...) 逆变换回原输入坐标(原地修改)
+        :param boxes: [M, 5+num_classes]
+        :param view_ind: [M] 每个框所在的视图序号
+        """
+        sizes = torch.tensor([size for size, _, _ in self.views], dtype=boxes.dtype, device=boxes.device)
+        flips = torch.tensor([[h, v] for _, h, v in self.views], dtype=torch.bool, device=boxes.device)
+        size = sizes[view_ind]
+        flip = flips[view_ind]
+        boxes[:, 0] = torch.where(flip[:, 0], size - boxes[:, 0], boxes[:, 0])
+        boxes[:, 1] = torch.where(flip[:, 1], size - boxes[:, 1], boxes[:, 1])
+        boxes[:, :4] *= (self.img_size / size)[:, None]
+        return boxes
+
+    def __call__(self, imgs):
+        """
+        :param imgs: [b, 3, img_size, img_size], 值域 [0, 1]
+        :return: list(len=b) of [k, 6] (xmin, ymin, xmax, ymax, score, class), 原输入坐标
+        """
+        batch_size, num_views = len(imgs), len(self.views)
+        with torch.no_grad():
+            p_d = self.model(self.make_batch(imgs))[1]
+        pred = split_batch_predictions(p_d, batch_size * num_views, self.canvas)
+        if isinstance(pred, SparsePredictions):
+            boxes, view_ind = pred.boxes, pred.img_ind
+        else:
+            boxes = pred.reshape(-1, pred.shape[-1])
+            view_ind = torch.arange(len(pred), device=boxes.device).repeat_interleave(pred.shape[1])
+        boxes = self.untransform(boxes.clone(), view_ind)
+        kwargs = dict(conf_thresh=self.conf_thresh, nms_thresh=self.nms_thresh, score_with_cls=True,
+                      clip_size=self.img_size)
+        if self.merge == 'nms' or num_views == 1:
+            return filter_detections(SparsePredictions(boxes, view_ind // num_views, batch_size), **kwargs)
+        per_view = filter_detections(SparsePredictions(boxes, view_ind, batch_size * num_views), **kwargs)
+        return [weighted_box_fusion(torch.cat(per_view[i * num_views:(i + 1) * num_views]), num_views, self.wbf_iou)
+                for i in range(batch_size)]
+
+
+def tta_report(model, eval_batches, configs=None, runs=5):
+    """
+    在 eval_batches(通常为测试折)上比较各 TTA 配置的分尺寸 AP50 与每批延迟(一次批量前向 + 逆变换与合并)
+    :param configs: {name: TTAEngine 参数}, 默认: 无增强 / 翻转 / 多尺度 / 多尺度+翻转, 后三者分别用 nms 与 wbf
+    """
+    from utils.evaluator import ap50_by_size
+
+    if configs is None:
+        configs = {'none': dict(scales=(1.0,), flips=())}
+        for merge in MERGE_METHODS:
+            configs[f'flip-{merge}'] = dict(scales=(1.0,), flips=cfg.VAL["TTA_FLIPS"], merge=merge)
+            configs[f'scale-{merge}'] = dict(scales=cfg.VAL["TTA_SCALES"], flips=(), merge=merge)
+            configs[f'scale+flip-{merge}'] = dict(scales=cfg.VAL["TTA_SCALES"], flips=cfg.VAL["TTA_FLIPS"],
+                                                  merge=merge)
+    imgs = eval_batches[0][0]
+    report = {}
+    for name, kwargs in configs.items():
+        engine = TTAEngine(model, **kwargs)
+        ap = ap50_by_size(model, eval_batches, detector=engine)
+        engine(imgs)  # 预热
+        if imgs.is_cuda:
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        for _ in range(runs):
+            engine(imgs)
+        if imgs.is_cuda:
+            torch.cuda.synchronize()
+        ms = (time.perf_counter() - start) / runs * 1000
+        report[name] = {'views': len(engine), 'canvas': engine.canvas, 'ap50': ap, 'latency_ms': ms,
+                        'latency_ms_per_image': ms / len(imgs)}
+    base = report.get('none')
+    if base is not None:
+        for entry in report.values():
+            entry['ap50_delta'] = entry['ap50']['all'] - base['ap50']['all']
+            entry['latency_ratio'] = entry['latency_ms'] / base['latency_ms']
+    return report
+
+
+def print_report(report):
+    print(f"{'config':>18} {'views':>5} {'canvas':>6} {'AP50':>7} {'delta':>8} {'small':>7} {'medium':>7} "
+          f"{'large':>7} {'ms/img':>8} {'x':>6}")
+    for name, r in report.items():
+        ap = r['ap50']
+        print(f"{name:>18} {r['views']:>5} {r['canvas']:>6} {ap['all']:>7.4f} {r.get('ap50_delta', 0):>+8.4f} "
+              f"{ap['small']:>7.4f} {ap['medium']:>7.4f} {ap['large']:>7.4f} {r['latency_ms_per_image']:>8.2f} "
+              f"{r.get('latency_ratio', 1):>6.2f}")
+
+
+if __name__ == "__main__":
+    # 在 astroyolo 目录下运行: python -m utils.tta weight_path [eval_anno_type] [report.json]
+    from model.model import BuildModel
+    from utils.quantization import calibration_batches
+
+    weight_path = sys.argv[1]
+    eval_anno_type = sys.argv[2] if len(sys.argv) > 2 else 'test'
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    model = BuildModel().to(device)
+    state = torch.load(weight_path, map_location=device)
+    model.load_state_dict(state['model'] if isinstance(state, dict) and 'model' in state else state)
+    model.eval()
+    eval_batches = [(imgs.to(device), gts) for imgs, gts in calibration_batches(eval_anno_type, num_samples=sys.maxsize)]
+    report = tta_report(model, eval_batches)
+    print(f"device={device}, images={sum(len(imgs) for imgs, _ in eval_batches)}, batch={len(eval_batches[0][0])}")
+    print_report(report)
+    if len(sys.argv) > 3:
+        with open(sys.argv[3], 'w') as f:
+            json.dump({'weight_path': weight_path, 'eval': eval_anno_type, 'report': report}, f, indent=2)
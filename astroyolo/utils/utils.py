@@ -4,6 +4,8 @@ import cv2
 import numpy as np
 import torch
 
+from utils.postprocess import batched_nms
+
 
 def nms(bbox, thresh, score=None, limit=None):
     """Suppress bounding boxes according to their IoUs and confidence scores.
@@ -84,46 +86,31 @@ def postprocess(prediction, num_classes, conf_thre=0.7, nms_thre=0.45):
     box_corner[:, :, 3] = prediction[:, :, 1] + prediction[:, :, 3] / 2
     prediction[:, :, :4] = box_corner[:, :, :4]
 
+    # Get (image, box, class) triples whose obj_conf * class_conf reaches the threshold
+    ind = (
+            prediction[:, :, 5: 5 + num_classes] * prediction[:, :, 4:5] >= conf_thre
+    ).nonzero()
+    # Detections ordered as (x1, y1, x2, y2, obj_conf, class_conf, class_pred)
+    detections = torch.cat(
+        (
+            prediction[ind[:, 0], ind[:, 1], :5],
+            prediction[ind[:, 0], ind[:, 1], 5 + ind[:, 2]].unsqueeze(1),
+            ind[:, 2].float().unsqueeze(1),
+        ),
+        1,
+    )
+    # Class-wise NMS for the whole batch in a single call, grouped by (image, class)
+    nms_out_index = batched_nms(
+        detections[:, :4], detections[:, 4] * detections[:, 5], ind[:, 0] * num_classes + ind[:, 2], nms_thre
+    )
+    detections = detections[nms_out_index]
+    image_index = ind[nms_out_index, 0]
+
     output = [None for _ in range(len(prediction))]
-    for i, image_pred in enumerate(prediction):
-        # Filter out confidence scores below threshold
-        class_pred = torch.max(image_pred[:, 5: 5 + num_classes], 1)
-        class_pred = class_pred[0]
-        conf_mask = (image_pred[:, 4] * class_pred >= conf_thre).squeeze()
-        image_pred = image_pred[conf_mask]
-
-        # If none are remaining => process next image
-        if not image_pred.size(0):
-            continue
-        # Get detections with higher confidence scores than the threshold
-        ind = (
-                image_pred[:, 5:] * image_pred[:, 4][:, None] >= conf_thre
-        ).nonzero()
-        # Detections ordered as (x1, y1, x2, y2, obj_conf, class_conf, class_pred)
-        detections = torch.cat(
-            (
-                image_pred[ind[:, 0], :5],
-                image_pred[ind[:, 0], 5 + ind[:, 1]].unsqueeze(1),
-                ind[:, 1].float().unsqueeze(1),
-            ),
-            1,
-        )
-        # Iterate through all predicted classes
-        unique_labels = detections[:, -1].cpu().unique()
-        if prediction.is_cuda:
-            unique_labels = unique_labels.cuda()
-        for c in unique_labels:
-            # Get the detections with the particular class
-            detections_class = detections[detections[:, -1] == c]
-            nms_in = detections_class.cpu().numpy()
-            nms_out_index = nms(
-                nms_in[:, :4], nms_thre, score=nms_in[:, 4] * nms_in[:, 5]
-            )
-            detections_class = detections_class[nms_out_index]
-            if output[i] is None:
-                output[i] = detections_class
-            else:
-                output[i] = torch.cat((output[i], detections_class))
+    for i in range(len(prediction)):
+        image_detections = detections[image_index == i]
+        if image_detections.size(0):
+            output[i] = image_detections
 
     return output
 
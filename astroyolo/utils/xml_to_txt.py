@@ -4,11 +4,15 @@
 # @Software: PyCharm
 
 import os
+import sys
 import xml.etree.ElementTree as ET
 import random
 from sklearn.model_selection import KFold
 import numpy as np
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from utils.annotation_index import AnnotationIndex
+
 # VOC标注和图片路径
 ANNOTATION_PATH = os.path.join('dataset', 'VOCdevkit', 'VOC2007', 'Annotations')
 IMAGE_PATH = os.path.join('dataset', 'VOCdevkit', 'VOC2007', 'JPEGImages')
@@ -58,13 +62,25 @@ def parse_xml(xml_file):
         print(f"[警告] 解析xml失败，已跳过：{xml_file}，错误：{e}")
         return None, []
 
-def write_txt(file_list, save_txt):
+def write_txt(file_list, save_txt, index=None):
+    """
+    :param index: AnnotationIndex, 为 None 时逐个解析 XML
+    """
+    lines = []
+    for xml_name in file_list:
+        if index is None:
+            img_path, bboxes = parse_xml(os.path.join(ANNOTATION_PATH, xml_name))
+        else:
+            record = index.get(os.path.splitext(xml_name)[0])
+            if record is None or not record[0]:  # 解析失败或缺少 filename, 与 parse_xml 一样跳过
+                continue
+            filename, _, boxes, _ = record
+            img_path = os.path.join(IMAGE_PATH, filename.replace('.png', '.npy').replace('.jpg', '.npy'))
+            cls = 0
+            bboxes = [f"{int(x1)},{int(y1)},{int(x2)},{int(y2)},{cls}" for x1, y1, x2, y2 in boxes.tolist()]
+        lines += [f"{img_path} {bbox}\n" for bbox in bboxes]
     with open(save_txt, 'w') as f:
-        for xml_name in file_list:
-            xml_path = os.path.join(ANNOTATION_PATH, xml_name)
-            img_path, bboxes = parse_xml(xml_path)
-            for bbox in bboxes:
-                f.write(f"{img_path} {bbox}\n")
+        f.writelines(lines)
 
 def generate_k_fold_cross_validation(k=5, seed=42):
     """
@@ -168,7 +184,8 @@ def generate_k_fold_cross_validation(k=5, seed=42):
     with open(os.path.join(image_sets_main_dir, 'trainval.txt'), 'w') as f:
         f.write('\n'.join(train_files + valid_files))
         
-    # 生成折叠的训练标注文本文件
+    # 生成折叠的训练标注文本文件, 所有折共用一份标注索引(每个 XML 只解析一次, 未修改的直接读缓存)
+    index = AnnotationIndex.load(ANNOTATION_PATH)
     for fold_idx in range(k):
         # 读取相应的文件列表
         train_file = os.path.join(image_sets_main_dir, f'fold{fold_idx}_train.txt')
@@ -186,9 +203,9 @@ def generate_k_fold_cross_validation(k=5, seed=42):
         
         # 创建标注文件
         os.makedirs(TXT_SAVE_PATH, exist_ok=True)
-        write_txt(train_files, os.path.join(TXT_SAVE_PATH, f'fold{fold_idx}_train.txt'))
-        write_txt(valid_files, os.path.join(TXT_SAVE_PATH, f'fold{fold_idx}_valid.txt'))
-        write_txt(test_files, os.path.join(TXT_SAVE_PATH, f'fold{fold_idx}_test.txt'))
+        write_txt(train_files, os.path.join(TXT_SAVE_PATH, f'fold{fold_idx}_train.txt'), index)
+        write_txt(valid_files, os.path.join(TXT_SAVE_PATH, f'fold{fold_idx}_valid.txt'), index)
+        write_txt(test_files, os.path.join(TXT_SAVE_PATH, f'fold{fold_idx}_test.txt'), index)
 
 if __name__ == "__main__":
     # 生成五折交叉验证数据集